@@ -0,0 +1,399 @@
+#!/usr/bin/env python3
+
+# usage: cachestore.py prune [database ...]
+# drops the cached trees of commits which are no longer reachable in their
+# repository (and of repositories and files which no longer exist) from the
+# given databases, by default those of the ck2 and ck3 parsers. without
+# databases given, it also drops the localisation tables of locstore which
+# weren't used for locstore.PRUNE_AGE days.
+
+import bisect
+import collections
+import hashlib
+import importlib.util
+import io
+import os
+import pathlib
+import pickle
+import sqlite3
+import sys
+import time
+from localpaths import cachedir, ck3cachedir
+import locstore
+
+# GitPython takes long to import, so it is only imported once a repository
+# is looked up
+git_present = importlib.util.find_spec('git') is not None
+
+# where read_repo keeps the latest commit of each file of each repository
+repoindexdir = cachedir / 'repos'
+
+
+class CacheDB:
+    """a single sqlite file holding the disk cache of parse trees, instead of
+    one file per tree
+
+    entries are keyed by (parser, encoding, repo, commit, relpath). repo and
+    commit are '' for files outside a repository or changed since their last
+    commit; those entries are only current if they were written after the
+    file was last modified. entries keyed by content have repo and relpath
+    '' and the hash of the file in place of commit. with max_size (in bytes), the least recently
+    used entries are dropped whenever the cache grows past it."""
+
+    schema = '''CREATE TABLE IF NOT EXISTS trees (
+                    parser TEXT NOT NULL,
+                    encoding TEXT NOT NULL,
+                    repo TEXT NOT NULL,
+                    commit_ TEXT NOT NULL,
+                    relpath TEXT NOT NULL,
+                    written REAL NOT NULL,
+                    used REAL NOT NULL,
+                    size INTEGER NOT NULL,
+                    data BLOB NOT NULL,
+                    PRIMARY KEY (parser, encoding, repo, commit_, relpath))'''
+
+    def __init__(self, path, max_size=None):
+        self.path = pathlib.Path(path)
+        self.max_size = max_size
+        self.rows = {}
+        self.connect()
+
+    def connect(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # autocommit; with the write-ahead log, commits don't sync the disk
+        self.db = sqlite3.connect(str(self.path), timeout=60,
+                                  isolation_level=None)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute(self.schema)
+        self.db.execute('CREATE INDEX IF NOT EXISTS trees_used ON trees(used)')
+        self.size, = self.db.execute(
+            'SELECT IFNULL(SUM(size), 0) FROM trees').fetchone()
+
+    def __getstate__(self):
+        return {'path': self.path, 'max_size': self.max_size}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.rows = {}
+        self.connect()
+
+    def close(self):
+        self.db.close()
+
+    def prefetch(self, keys):
+        """look up the entries of many keys at once, a query per repo"""
+        wanted = collections.defaultdict(set)
+        for parser, encoding, repo, commit, relpath in keys:
+            wanted[parser, encoding, repo].add((commit, relpath))
+        for (parser, encoding, repo), entries in wanted.items():
+            cursor = self.db.execute(
+                'SELECT rowid, commit_, relpath, written FROM trees '
+                'WHERE parser = ? AND encoding = ? AND repo = ?',
+                (parser, encoding, repo))
+            for rowid, commit, relpath, written in cursor:
+                if (commit, relpath) in entries:
+                    key = parser, encoding, repo, commit, relpath
+                    self.rows[key] = rowid, written
+
+    def lookup(self, key):
+        """(rowid, time written) of the entry for key, or None"""
+        try:
+            return self.rows[key]
+        except KeyError:
+            pass
+        row = self.db.execute(
+            'SELECT rowid, written FROM trees WHERE parser = ? AND '
+            'encoding = ? AND repo = ? AND commit_ = ? AND relpath = ?',
+            key).fetchone()
+        if row is not None:
+            self.rows[key] = row
+        return row
+
+    def is_current(self, key, path, is_indexed):
+        row = self.lookup(key)
+        return row is not None and (is_indexed or
+                                    row[1] >= path.stat().st_mtime)
+
+    def open(self, key):
+        """the entry for key as a binary file"""
+        row = self.lookup(key)
+        if row is None:
+            raise KeyError(key)
+        del self.rows[key]
+        data, = self.db.execute('SELECT data FROM trees WHERE rowid = ?',
+                                (row[0],)).fetchone()
+        self.db.execute('UPDATE trees SET used = ? WHERE rowid = ?',
+                        (time.time(), row[0]))
+        return io.BytesIO(data)
+
+    def put(self, key, data):
+        now = time.time()
+        self.rows.pop(key, None)
+        old = self.db.execute(
+            'SELECT size FROM trees WHERE parser = ? AND encoding = ? AND '
+            'repo = ? AND commit_ = ? AND relpath = ?', key).fetchone()
+        self.db.execute('INSERT OR REPLACE INTO trees VALUES '
+                        '(?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                        key + (now, now, len(data), data))
+        self.size += len(data) - (old[0] if old else 0)
+        if self.max_size is not None and self.size > self.max_size:
+            self.evict(self.max_size)
+
+    def evict(self, max_size):
+        """drop the least recently used entries until at most max_size bytes
+        are left"""
+        self.size, = self.db.execute(
+            'SELECT IFNULL(SUM(size), 0) FROM trees').fetchone()
+        while self.size > max_size:
+            victims = self.db.execute(
+                'SELECT rowid, size FROM trees ORDER BY used LIMIT 64'
+                ).fetchall()
+            if not victims:
+                break
+            self.delete(rowid for rowid, _ in victims)
+            self.size -= sum(size for _, size in victims)
+        self.rows.clear()
+
+    def delete(self, rowids):
+        self.db.executemany('DELETE FROM trees WHERE rowid = ?',
+                            ((rowid,) for rowid in rowids))
+
+    def prune(self):
+        """drop the entries of unreachable commits and of repositories and
+        files which no longer exist, returning how many were dropped"""
+        victims = []
+        repos = [repo for repo, in self.db.execute(
+                 'SELECT DISTINCT repo FROM trees')]
+        for repo in repos:
+            cursor = self.db.execute('SELECT rowid, commit_, relpath '
+                                     'FROM trees WHERE repo = ?', (repo,))
+            if not repo:
+                # entries keyed by content (commit is the hash) never go stale
+                victims.extend(rowid for rowid, commit, relpath in cursor
+                               if not commit and
+                               not pathlib.Path(relpath).exists())
+                continue
+            repo_path = pathlib.Path(repo)
+            if not repo_path.is_dir():
+                victims.extend(rowid for rowid, _, _ in cursor)
+                continue
+            if not git_present:
+                print('GitPython is not installed; keeping entries of '
+                      '{}'.format(repo), file=sys.stderr)
+                continue
+            import git
+            try:
+                hashes = sorted(git.Repo(repo).git.rev_list(all=True).split())
+            except (git.InvalidGitRepositoryError, git.GitCommandError):
+                hashes = []
+            for rowid, commit, relpath in cursor.fetchall():
+                if commit:
+                    i = bisect.bisect_left(hashes, commit)
+                    if i == len(hashes) or not hashes[i].startswith(commit):
+                        victims.append(rowid)
+                elif not (repo_path / relpath).exists():
+                    victims.append(rowid)
+        self.delete(victims)
+        self.rows.clear()
+        self.db.execute('VACUUM')
+        self.size, = self.db.execute(
+            'SELECT IFNULL(SUM(size), 0) FROM trees').fetchone()
+        return len(victims)
+
+
+class TreeCache:
+    """parse trees kept in memory by path. with max_size, the least recently
+    used trees are dropped once the files they were parsed from add up to
+    more than max_size bytes, except for pinned paths"""
+
+    def __init__(self, max_size=None):
+        self.max_size = max_size
+        self.trees = collections.OrderedDict()
+        self.pinned = set()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __contains__(self, path):
+        return path in self.trees
+
+    def __len__(self):
+        return len(self.trees)
+
+    def __getitem__(self, path):
+        tree, _ = self.trees[path]
+        self.trees.move_to_end(path)
+        return tree
+
+    def get(self, path):
+        """the tree of path or None, counting hits and misses"""
+        try:
+            tree = self[path]
+        except KeyError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return tree
+
+    def __setitem__(self, path, tree):
+        try:
+            size = path.stat().st_size
+        except OSError:
+            size = 0
+        if path in self.trees:
+            del self[path]
+        self.trees[path] = tree, size
+        self.size += size
+        if self.max_size is not None and self.size > self.max_size:
+            self.evict(self.max_size)
+
+    def __delitem__(self, path):
+        _, size = self.trees.pop(path)
+        self.size -= size
+
+    def evict(self, max_size):
+        for path in list(self.trees):
+            if self.size <= max_size:
+                break
+            if path not in self.pinned:
+                del self[path]
+                self.evictions += 1
+
+    def pin(self, path):
+        self.pinned.add(path)
+
+    def unpin(self, path):
+        self.pinned.discard(path)
+        if self.max_size is not None and self.size > self.max_size:
+            self.evict(self.max_size)
+
+    def clear(self):
+        self.trees.clear()
+        self.size = 0
+
+    def stats(self):
+        stats = '{} hits, {} misses, {} evictions, {} trees, {:.1f} MB'.format(
+            self.hits, self.misses, self.evictions, len(self.trees),
+            self.size / 2 ** 20)
+        if self.max_size is not None:
+            stats += ' of {:.1f} MB'.format(self.max_size / 2 ** 20)
+        return stats
+
+
+def log_entries(log_output):
+    """(commit, file) for each file of each commit in the output of
+    git log -m -z --name-only --pretty=format:%h"""
+    log_iter = iter(log_output.split('\x00'))
+    for entry in log_iter:
+        try:
+            commit, file_str = entry.split('\n', maxsplit=1)
+        except ValueError:
+            continue
+        while file_str:
+            yield commit, file_str
+            file_str = next(log_iter, '')
+
+def read_repo(repo):
+    """(latest_commit, dirty_paths) of a git.Repo: the short hash of the last
+    commit to change each tracked file, and the paths with uncommitted changes
+
+    latest_commit is stored in repoindexdir along with the HEAD it is for.
+    when HEAD has moved since, only the files changed between the two are
+    looked up in the log, instead of walking the whole history."""
+    import git
+    repo_path = pathlib.Path(repo.working_tree_dir)
+    head = repo.git.rev_parse('HEAD')
+    indexpath = repoindexdir / (hashlib.md5(bytes(repo_path)).hexdigest() +
+                                '.pickle')
+    try:
+        with indexpath.open('rb') as f:
+            old_head, latest_commit = pickle.load(f)
+    except (OSError, pickle.PickleError, EOFError, ValueError):
+        old_head, latest_commit = None, {}
+    if old_head != head:
+        tracked_files = set(repo.git.ls_files(z=True).split('\x00')[:-1])
+        changed = None
+        if old_head is not None:
+            try:
+                changed = set(repo.git.diff(
+                    old_head, head, name_only=True, no_renames=True,
+                    z=True).split('\x00')[:-1])
+                # so are the files of the new commits (a merge lists the
+                # files it changes against each parent, not only against
+                # old_head), and those last changed in commits that are no
+                # longer in the history (after a rebase, say)
+                moved = repo.git.log('{}...{}'.format(old_head, head),
+                                     m=True, full_history=True,
+                                     pretty='format:%h', z=True,
+                                     name_only=True)
+                changed.update(file_str for _, file_str
+                               in log_entries(moved))
+            except git.GitCommandError: # e.g. old_head was garbage collected
+                pass
+        if changed is None:
+            latest_commit = {}
+            pending = tracked_files
+        else:
+            for file_str in changed - tracked_files:
+                latest_commit.pop(file_str, None)
+            pending = tracked_files & changed
+            pending.update(tracked_files - latest_commit.keys())
+        # limit the log to the pending files, unless there are too many to
+        # pass on the command line. without history simplification, so that
+        # which merges are walked doesn't depend on the paths it is limited to
+        pathspec = sorted(pending) if len(pending) <= 1000 else ['.']
+        if pending:
+            log_output = repo.git.log(head, '--', *pathspec, m=True,
+                                      full_history=True, pretty='format:%h',
+                                      z=True, name_only=True)
+        else:
+            log_output = ''
+        for commit, file_str in log_entries(log_output):
+            if file_str in pending:
+                pending.remove(file_str)
+                latest_commit[file_str] = commit
+                if not pending:
+                    break
+        repoindexdir.mkdir(parents=True, exist_ok=True)
+        temppath = indexpath.with_suffix('.{}.tmp'.format(os.getpid()))
+        with temppath.open('wb') as f:
+            pickle.dump((head, latest_commit), f, pickle.HIGHEST_PROTOCOL)
+        os.replace(str(temppath), str(indexpath))
+    dirty_paths = []
+    status_output = repo.git.status(z=True)
+    status_iter = iter(status_output.split('\x00')[:-1])
+    for entry in status_iter:
+        dirty_paths.append(pathlib.Path(entry[3:]))
+        if entry[0] == 'R':
+            next(status_iter)
+    return latest_commit, dirty_paths
+
+
+def default_paths():
+    return [cachedir / 'trees.sqlite3', ck3cachedir / 'trees.sqlite3']
+
+def main():
+    args = sys.argv[1:]
+    if not args or args[0] != 'prune':
+        sys.exit('usage: cachestore.py prune [database ...]')
+    paths = [pathlib.Path(arg) for arg in args[1:]]
+    prune_loc = not paths
+    paths = paths or default_paths()
+    for path in paths:
+        if not path.exists():
+            continue
+        cachedb = CacheDB(path)
+        size = cachedb.size
+        count = cachedb.prune()
+        print('{}: dropped {} entries, {:.1f} MB -> {:.1f} MB'.format(
+              path, count, size / 2 ** 20, cachedb.size / 2 ** 20))
+        cachedb.close()
+    if prune_loc:
+        count, size = locstore.prune()
+        print('{}: dropped {} tables, {:.1f} MB'.format(
+              locstore.locdir, count, size / 2 ** 20))
+
+if __name__ == '__main__':
+    main()
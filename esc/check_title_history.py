@@ -1,12 +1,13 @@
 #!/usr/bin/env python3
 
 from bisect import insort
-from collections import defaultdict, namedtuple
+from collections import defaultdict
 from operator import attrgetter
 from intervaltree import Interval, IntervalTree
 from ck2parser import (rootpath, vanilladir, is_codename, TopLevel, Number,
                        Pair, Obj, Date as ASTDate, Comment, SimpleParser,
                        FullParser)
+from gamedate import GameDate
 from print_time import print_time
 
 CHECK_LIEGE_CONSISTENCY = True
@@ -26,23 +27,18 @@ FORMAT_TITLE_HISTORY = False
 CLEANUP_TITLE_HISTORY = False # implies previous, overrides date pruning
 
 
-class Date(namedtuple('Date', ['y', 'm', 'd'])):
+class Date(GameDate):
+    """a GameDate which keeps the (y, m, d) it was read as in val, so that
+    a date such as 1066.2.29 is written out and found in trees as it was
+    given, though it orders and counts as 1066.3.1"""
 
-    def __str__(self):
-        return '{}.{}.{}'.format(*self)
-
-    def get_next_day(self):
-        y, m, d = self.y, self.m, self.d + 1
-        if (d == 29 and m == 2 or
-            d == 31 and m in (4, 6, 9, 11) or
-            d == 32 and m in (1, 3, 5, 7, 8, 10, 12)):
-            m, d = m + 1, 1
-            if m == 13:
-                y, m = y + 1, 1
-        return Date(y, m, d)
+    def __new__(cls, *args):
+        self = super().__new__(cls, *args)
+        self.val = tuple(args) if len(args) == 3 else self.ymd
+        return self
 
-Date.EARLIEST = Date(float('-inf'), float('-inf'), float('-inf'))
-Date.LATEST = Date(float('inf'), float('inf'), float('inf'))
+    def __str__(self):
+        return '{}.{}.{}'.format(*self.val)
 
 
 class TitleHistory:
@@ -137,7 +133,7 @@ class TitleHistory:
             last_iter = i == len(self.tree)
             if not last_iter:
                 date_pair = self.tree.contents[i]
-                date = date_pair.key.val
+                date = Date(*date_pair.key.val)
                 obj = date_pair.value
                 try:
                     j, holder_pair = next((j, e) for j, e in enumerate(obj)
@@ -150,13 +146,13 @@ class TitleHistory:
                 date = Date.LATEST
             prev_i, prev_date_pair, prev_holder_pair = prev
             if prev_date_pair:
-                prev_date = prev_date_pair.key.val
+                prev_date = Date(*prev_date_pair.key.val)
                 prev_holder = prev_holder_pair.value.val
             else:
                 prev = i, date_pair, holder_pair
                 i += 1
                 continue
-            #if self.name == 'c_godwad' and prev_date[0] == 1321:
+            #if self.name == 'c_godwad' and prev_date.year == 1321:
             #    import pdb; pdb.set_trace()
             if not last_iter and holder == 0:
                 if prev_holder == 0:
@@ -210,8 +206,8 @@ class TitleHistory:
                 # will be removed next iteration
                 if end < date:
                     # re-add holder when he's born
-                    if end in self.tree.dictionary:
-                        obj = self.tree[end]
+                    if end.val in self.tree.dictionary:
+                        obj = self.tree[end.val]
                         obj.contents.append(prev_holder_pair)
                         obj.contents.sort(key=self.keys_sort_key)
                     else:
@@ -222,8 +218,8 @@ class TitleHistory:
                                   Date.LATEST)
                 if next_begin < date:
                     no_holder_pair = Pair('holder', Number(0))
-                    if end in self.tree.dictionary:
-                        obj = self.tree[end]
+                    if end.val in self.tree.dictionary:
+                        obj = self.tree[end.val]
                         obj.contents.append(no_holder_pair)
                         obj.contents.sort(key=self.keys_sort_key)
                     else:
@@ -244,8 +240,8 @@ class TitleHistory:
                     i = self.tree.contents.index(date_pair)
                 else:
                     no_holder_pair = Pair('holder', Number(0))
-                    if begin in self.tree.dictionary:
-                        obj = self.tree[begin]
+                    if begin.val in self.tree.dictionary:
+                        obj = self.tree[begin.val]
                         obj.contents.append(no_holder_pair)
                         obj.contents.sort(key=self.keys_sort_key)
                     else:
@@ -302,7 +298,7 @@ def iv_to_str(iv, end=None):
         s = 'till {}'.format(iv[1])
     elif iv[1] == Date.LATEST:
         s = '{} on'.format(iv[0])
-    elif iv[1] == iv[0].get_next_day():
+    elif iv[1] == iv[0] + 1:
         s = str(iv[0])
     else:
         s = '{} to {}'.format(iv[0], iv[1])
@@ -327,6 +323,7 @@ def main():
     else:
         history_parser = simple_parser
     history_parser.no_fold_to_depth = 0
+    history_parser.skip_unchanged_default = True
     landed_titles_index = {0: -1}
     title_djls = {}
     histories = {}
@@ -354,7 +351,7 @@ def main():
             dates.append(Date.LATEST)
             date_filter.addi(Date.EARLIEST, dates[0])
             for i in range(len(dates) - 1):
-                date_filter.addi(dates[i].get_next_day(), dates[i + 1])
+                date_filter.addi(dates[i] + 1, dates[i + 1])
         elif (PRUNE_UNEXECUTED_HISTORY or PRUNE_IMPOSSIBLE_STARTS or
             PRUNE_NONBOOKMARK_STARTS or PRUNE_NONERA_STARTS):
             date_filter.addi(Date.EARLIEST, Date.LATEST)
@@ -363,17 +360,17 @@ def main():
                 for _, v in tree:
                     date = Date(*v['date'].val)
                     if not PRUNE_NONERA_STARTS or v.has_pair('era', 'yes'):
-                        date_filter.chop(date, date.get_next_day())
+                        date_filter.chop(date, date + 1)
                     last_start_date = max(date, last_start_date)
             if not PRUNE_NONBOOKMARK_STARTS and not PRUNE_NONERA_STARTS:
                 defines = simple_parser.parse_file('common/defines.txt')
                 first = Date(*defines['start_date'].val)
                 last = Date(*defines['last_start_date'].val)
-                date_filter.chop(first, last.get_next_day())
+                date_filter.chop(first, last + 1)
                 last_start_date = max(last, last_start_date)
                 if not PRUNE_IMPOSSIBLE_STARTS:
                     date_filter.clear()
-                    date_filter.addi(last_start_date.get_next_day(),
+                    date_filter.addi(last_start_date + 1,
                                      Date.LATEST)
     title_holders = defaultdict(IntervalTree)
     title_unheld = defaultdict(
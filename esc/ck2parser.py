@@ -1,32 +1,45 @@
 #!/usr/bin/env python3
 
+import array
+import bisect
+import codecs
 import collections
+import concurrent.futures
 import csv
+import fnmatch
 import functools
+import gc
 import hashlib
+import importlib.util
+import io
+import mmap
 import operator
 import os
 import pathlib
 import pickle
 import re
+import shutil
+import struct
 import sys
 import time
 import traceback
-from operator import attrgetter
 
-from funcparserlib.lexer import make_tokenizer, Token
+from funcparserlib.lexer import make_tokenizer, Token, LexerError
 from funcparserlib.parser import (some, a, maybe, many, finished, skip,
                                   oneplus, forward_decl, NoParseError)
 from localpaths import rootpath, vanilladir, cachedir
+from cachestore import CacheDB, TreeCache, read_repo
+from gamedate import GameDate
+from fileindex import file_index, has_magic
+from locstore import Localisation
+import timeline
 from functools import total_ordering
 
-try:
-    import git
-    git_present = True
-except ImportError:
-    git_present = False
+# GitPython takes long to import, so it is only imported once a repository
+# is looked up
+git_present = importlib.util.find_spec('git') is not None
 
-VERSION = 3
+VERSION = 4
 
 csv.register_dialect('ckii', delimiter=';', doublequote=False,
                      quotechar='\0', quoting=csv.QUOTE_NONE, strict=True)
@@ -43,11 +56,7 @@ def csv_rows(path, linenum=False, comments=False):
 # give mod dirs in descending lexicographical order of mod name (Z-A),
 # modified for dependencies as necessary.
 def files(glob, moddirs=(), basedir=vanilladir, reverse=False):
-    result_paths = {p.relative_to(d): p
-                    for d in (basedir,) + tuple(moddirs) for p in d.glob(glob)}
-    for _, p in sorted(result_paths.items(), key=lambda t: t[0].parts,
-                       reverse=reverse):
-        yield p
+    yield from file_index(basedir, moddirs).glob(glob, reverse)
 
 def get_cultures(parser, groups=True):
     cultures = []
@@ -88,24 +97,79 @@ def get_province_id_name_map(parser):
 
 def get_provinces(parser):
     id_name = get_province_id_name_map(parser)
+    numbers = []
+    paths = []
     for path in parser.files('history/provinces/* - *.txt'):
         number, name = path.stem.split(' - ')
         number = int(number)
         if id_name.get(number) == name:
-            tree = parser.parse_file(path)
-            try:
-                title = tree['title'].val
-            except KeyError:
-                continue
-            yield number, title, tree
-
-def get_localisation(moddirs=(), basedir=vanilladir, ordered=False):
-    locs = collections.OrderedDict() if ordered else {}
-    for path in files('localisation/*.csv', moddirs, basedir=basedir):
-        for row in csv_rows(path):
-            if row[0] not in locs:
-                locs[row[0]] = row[1]
-    return locs
+            numbers.append(number)
+            paths.append(path)
+    for number, (_, tree) in zip(numbers, parser.parse_paths(paths)):
+        try:
+            title = tree['title'].val
+        except KeyError:
+            continue
+        yield number, title, tree
+
+def province_id_raster(rgb, rgb_id_map, unknown_id=0, warn=False):
+    """the province ids of an array of rgb pixels (e.g. a provinces.bmp) as
+    a uint16 array, given a mapping from (r, g, b) to id, and a Counter of
+    the colors not in the mapping by their number of pixels, which get the
+    id unknown_id. with warn, those colors are also printed to stderr"""
+    import numpy as np # only the map scripts need numpy
+    rgb = np.asarray(rgb)[..., :3].astype(np.uint32)
+    packed = rgb[..., 0] << 16 | rgb[..., 1] << 8 | rgb[..., 2]
+    unset = np.iinfo(np.uint16).max
+    lut = np.full(1 << 24, unset, np.uint16)
+    for (r, g, b), number in rgb_id_map.items():
+        lut[int(r) << 16 | int(g) << 8 | int(b)] = number
+    ids = lut[packed]
+    unknown_colors = collections.Counter()
+    unknown = ids == unset
+    if unknown.any():
+        colors, counts = np.unique(packed[unknown], return_counts=True)
+        for color, count in zip(colors.tolist(), counts.tolist()):
+            unknown_colors[color >> 16, color >> 8 & 0xff, color & 0xff] = count
+        ids[unknown] = unknown_id
+    if warn:
+        for rgb, count in unknown_colors.items():
+            print('unknown color {} in provinces.bmp ({} pixels)'.format(
+                  rgb, count), file=sys.stderr)
+    return ids, unknown_colors
+
+def province_adjacencies(ids, counts=False):
+    """the pairs of different ids which touch horizontally or vertically in
+    an id raster (diagonals don't count), as an (n, 2) array with the
+    smaller id first. with counts, also the number of pixel edges along each
+    of those borders"""
+    import numpy as np # only the map scripts need numpy
+    ids = np.asarray(ids).astype(np.uint32)
+    keys = []
+    for one, two in [(ids[:, :-1], ids[:, 1:]), (ids[:-1], ids[1:])]:
+        border = one != two
+        one, two = one[border], two[border]
+        keys.append(np.minimum(one, two) << 16 | np.maximum(one, two))
+    keys = np.concatenate(keys)
+    if counts:
+        keys, border_counts = np.unique(keys, return_counts=True)
+    else:
+        keys = np.unique(keys)
+    pairs = np.stack([keys >> 16, keys & 0xffff], axis=1).astype(np.uint16)
+    if counts:
+        return pairs, border_counts
+    return pairs
+
+def localisation(moddirs=(), basedir=vanilladir, language='english'):
+    """the localisation of basedir and moddirs as a read-only mapping, which
+    looks strings up in its tables on disk instead of holding them all"""
+    return Localisation(files('localisation/*.csv', moddirs, basedir=basedir),
+                        language)
+
+def get_localisation(moddirs=(), basedir=vanilladir, ordered=False,
+                     language='english'):
+    items = localisation(moddirs, basedir, language).items()
+    return collections.OrderedDict(items) if ordered else dict(items)
 
 def first_post_comment(item):
     if item.post_comment:
@@ -130,13 +194,8 @@ def chars(line, parser):
         line = line.splitlines()[-1]
     except IndexError: # empty string
         pass
-    col = 0
-    for char in line:
-        if char == '\t':
-            col = (col // parser.indent_width + 1) * parser.indent_width
-        else:
-            col += 1
-    return col
+    # tab stops every indent_width columns
+    return len(line.expandtabs(parser.indent_width))
 
 def comments_to_str(parser, comments, indent):
     s = ''
@@ -150,11 +209,19 @@ def comments_to_str(parser, comments, indent):
     comments_str = '\n'.join(c.val for c in comments)
     if comments_str == '':
         return s
+    # the same comments are often written again, as the butlast of longer
+    # ones or across the files of a rewrite
     try:
-        tree = parser.parse(comments_str)
-        if not tree.contents:
-            raise ValueError()
-    except (NoParseError, ValueError):
+        tree = parser.comment_trees[comments_str]
+    except KeyError:
+        try:
+            tree = parser.parse(comments_str)
+            if not tree.contents:
+                raise ValueError()
+        except (NoParseError, ValueError):
+            tree = None
+        parser.comment_trees[comments_str] = tree
+    if tree is None:
         butlast = comments_to_str(parser, comments[:-1], indent)
         if butlast:
             butlast += indent * indent_str
@@ -172,6 +239,8 @@ def comments_to_str(parser, comments, indent):
 
 
 class Comment:
+    __slots__ = 'val',
+
     def __init__(self, string):
         if string and string[0] == '#':
             string = string[1:]
@@ -182,11 +251,104 @@ class Comment:
 
 
 class Stringifiable:
-    pass
+    __slots__ = ()
+
+
+def _key_text(key):
+    """the text a key is matched by in selectors and the key index"""
+    val = key.val
+    if isinstance(val, str):
+        return val
+    if isinstance(val, tuple):
+        return '{}.{}.{}'.format(*val)
+    return str(val)
+
+@functools.lru_cache(maxsize=None)
+def _compile_selectors(selectors):
+    """for each selector, a tuple of its segments, each None for '**' or a
+    function telling if a key text matches it; and the set of texts the
+    last segments match, or None if one is a pattern"""
+    paths = []
+    last_keys = set()
+    for selector in selectors:
+        parts = selector.strip('/').split('/')
+        if not all(parts) or parts[-1] == '**':
+            raise ValueError('bad selector {!r}'.format(selector))
+        segments = []
+        for part in parts:
+            if part == '**':
+                if segments[-1:] != [None]:
+                    segments.append(None)
+            elif part == '*':
+                segments.append(lambda text: True)
+            elif has_magic(part):
+                segments.append(re.compile(fnmatch.translate(part)).match)
+            else:
+                segments.append(part.__eq__)
+        if last_keys is not None and not has_magic(parts[-1]):
+            last_keys.add(parts[-1])
+        else:
+            last_keys = None
+        paths.append(tuple(segments))
+    return tuple(paths), last_keys
+
+def _closure(paths, states):
+    """states plus, for each state at a '**', the state past it, which
+    may match at the same level"""
+    states = set(states)
+    stack = list(states)
+    while stack:
+        p, i = stack.pop()
+        if paths[p][i] is None and (p, i + 1) not in states:
+            states.add((p, i + 1))
+            stack.append((p, i + 1))
+    return frozenset(states)
+
+def _select(contents, paths, states, results):
+    for item in contents:
+        if not isinstance(item, Pair):
+            continue
+        text = _key_text(item.key)
+        matched = False
+        child_states = []
+        for p, i in states:
+            segment = paths[p][i]
+            if segment is None:
+                child_states.append((p, i))
+            elif segment(text):
+                if i + 1 == len(paths[p]):
+                    matched = True
+                else:
+                    child_states.append((p, i + 1))
+        if matched:
+            results.append(item)
+        if child_states and isinstance(item.value, ContainerMixin):
+            _select(item.value.contents, paths,
+                    _closure(paths, child_states), results)
+
+def _build_key_index(contents):
+    """{key text: indices of the items of contents which have a pair with
+    that key anywhere in them}"""
+    index = {}
+    for i, item in enumerate(contents):
+        if not isinstance(item, Pair):
+            continue
+        texts = set()
+        stack = [item]
+        while stack:
+            pair = stack.pop()
+            texts.add(_key_text(pair.key))
+            if isinstance(pair.value, ContainerMixin):
+                stack.extend(x for x in pair.value.contents
+                             if isinstance(x, Pair))
+        for text in texts:
+            index.setdefault(text, []).append(i)
+    return index
 
 
 class ContainerMixin:
     """Common code for TopLevel and Obj"""
+    __slots__ = ()
 
     contents = None
     _dictionary = None
@@ -242,6 +404,28 @@ class ContainerMixin:
                     continue
         return results
 
+    def select(self, *selectors):
+        """the pairs matched by any of selectors, in the order of the tree,
+        found in a single walk. a selector is keys separated by '/', from
+        the items of this container down, where a key may be a glob
+        pattern, and '**' matches any number of levels. e.g.
+        tree.select('**/create_vassal', 'country_event/option/*')
+
+        on a TopLevel whose key index is built, only the items holding the
+        keys last in the selectors are walked, unless those are patterns"""
+        paths, last_keys = _compile_selectors(selectors)
+        states = _closure(paths, ((p, 0) for p in range(len(paths))))
+        results = []
+        index = getattr(self, '_key_index', None)
+        if index is None or last_keys is None:
+            _select(self.contents, paths, states, results)
+        else:
+            indices = sorted({i for key in last_keys
+                              for i in index.get(key, ())})
+            contents = self.contents
+            _select([contents[i] for i in indices], paths, states, results)
+        return results
+
     def get_sorted_entries_with_date(self, default_date=(1, 1, 1), ignore_entries_after=(1444, 11, 11)):
         """create a list of entries for each date and use default_date for entries without a date,
         so that they are sorted first"""
@@ -292,6 +476,8 @@ class ContainerMixin:
         return result
 
 class TopLevel(ContainerMixin, Stringifiable):
+    __slots__ = ('contents', 'post_comments', '_dictionary', '_key_index',
+                 '_timeline')
 
     def __init__(self, contents=None, post_comments=None):
         super().__init__()
@@ -304,6 +490,18 @@ class TopLevel(ContainerMixin, Stringifiable):
         else:
             self.post_comments = [Comment(s) for s in post_comments]
         self._dictionary = None
+        self._key_index = None
+        self._timeline = None
+
+    @property
+    def key_index(self):
+        """{key: indices of the items of contents which have a pair with
+        that key anywhere in them}, which select uses once it is built.
+        trees read from the cache only have it if their parser had
+        index_keys set"""
+        if getattr(self, '_key_index', None) is None:
+            self._key_index = _build_key_index(self.contents)
+        return self._key_index
 
     @property
     def pre_comments(self):
@@ -341,16 +539,18 @@ class TopLevel(ContainerMixin, Stringifiable):
             del c_list[0]
 
     def str(self, parser, indent=0):
-        s = ''
+        return ''.join(self.str_chunks(parser, indent))
+
+    def str_chunks(self, parser, indent=0):
+        """generate str() in pieces, one or two per item"""
         for i, item in enumerate(self):
-            s += item.str(parser, indent)
+            yield item.str(parser, indent)
             if indent <= parser.newlines_to_depth:
                 if (i < len(self) - 1 and (isinstance(item.value, Obj) or
                     isinstance(self.contents[i + 1].value, Obj))):
-                    s += '\n'
+                    yield '\n'
         if self.post_comments:
-            s += comments_to_str(parser, self.post_comments, indent)
-        return s
+            yield comments_to_str(parser, self.post_comments, indent)
 
     def _add_pair_to_result_dict(self, pair, result, keys_which_can_appear_more_than_once):
         if pair.key.val in keys_which_can_appear_more_than_once:
@@ -371,19 +571,8 @@ class TopLevel(ContainerMixin, Stringifiable):
         @return: TopLevel
         """
         result_dict = {}
-        dated_items = []
-        for pair in self.contents:
-            if isinstance(pair.key, Date):
-                if pair.key <= date:
-                    dated_items.append(pair)
-                else:  # ignore dated entries past the date we are looking for
-                    pass
-            else:
-                self._add_pair_to_result_dict(pair, result_dict, keys_which_can_appear_more_than_once)
-
-        for date, date_pairs in sorted(dated_items, key=attrgetter('key')):
-            for pair in date_pairs:
-                self._add_pair_to_result_dict(pair, result_dict, keys_which_can_appear_more_than_once)
+        for pair in self.timeline.pairs_until(date):
+            self._add_pair_to_result_dict(pair, result_dict, keys_which_can_appear_more_than_once)
         result_list = []
         for pair in result_dict.values():
             if isinstance(pair, list):
@@ -392,30 +581,61 @@ class TopLevel(ContainerMixin, Stringifiable):
                 result_list.append(pair)
         return TopLevel(result_list, self.post_comments)
 
+    @property
+    def timeline(self):
+        """the Timeline of this history, built on first use (and not
+        updated if the tree changes after)"""
+        if getattr(self, '_timeline', None) is None:
+            self._timeline = Timeline(self)
+        return self._timeline
+
+
+class Timeline(timeline.Timeline):
+    """the Timeline of a history of this parser's trees"""
+
+    def __init__(self, history):
+        super().__init__(history, Pair, (Date, LeanDate), ContainerMixin)
+
+
+# the pre_comments of nodes without any, until they are used
+_NO_COMMENTS = ()
+
 
 class Commented(Stringifiable):
+    __slots__ = '_pre_comments', 'val', 'post_comment'
 
     def __init__(self, *args):
         super().__init__()
         if len(args) == 3:
-            self.pre_comments = [Comment(s) for s in args[0]]
+            self._pre_comments = ([Comment(s) for s in args[0]] or
+                                  _NO_COMMENTS)
             self.val = self.str_to_val(args[1])
             self.post_comment = Comment(args[2]) if args[2] else None
         elif len(args) == 2:
-            self.pre_comments = args[1].pre_comments
+            self._pre_comments = args[1]._pre_comments
             if isinstance(args[0], str):
                 self.val = self.str_to_val(args[0])
             else:
                 self.val = args[0]
             self.post_comment = args[1].post_comment
         else:
-            self.pre_comments = []
+            self._pre_comments = _NO_COMMENTS
             self.val = self.str_to_val(args[0])
             self.post_comment = None
 
+    @property
+    def pre_comments(self):
+        if self._pre_comments is _NO_COMMENTS:
+            self._pre_comments = []
+        return self._pre_comments
+
+    @pre_comments.setter
+    def pre_comments(self, value):
+        self._pre_comments = value
+
     @property
     def has_comments(self):
-        return self.pre_comments or self.post_comment
+        return self._pre_comments or self.post_comment
 
     def str_to_val(self, string):
         return string
@@ -430,21 +650,21 @@ class Commented(Stringifiable):
     def str(self, parser, indent=0):
         s = ''
         indent_str = '\t' if parser.tab_indents else ' ' * parser.indent_width
-        if self.pre_comments:
+        if self._pre_comments:
             s += indent * indent_str
-            s += comments_to_str(parser, self.pre_comments, indent)
+            s += comments_to_str(parser, self._pre_comments, indent)
         s += indent * indent_str + self.val_str()
         if self.post_comment:
             s += ' ' + str(self.post_comment)
         s += '\n'
         return s
 
-    def inline_str(self, parser, indent=0, col=0):
+    def inline_str(self, parser, indent=0, col=0, fit=False):
         nl = 0
         indent_str = '\t' if parser.tab_indents else ' ' * parser.indent_width
         sep = '\n' + indent * indent_str
         s = ''
-        if self.pre_comments:
+        if self._pre_comments:
             if col > indent * parser.indent_width:
                 s += sep
                 nl += 1
@@ -455,7 +675,7 @@ class Commented(Stringifiable):
                 pre_indent = indent
             # I can't tell the difference if I'm just after, say, "NOT = { "
             # with indent_width == 8, but whatever. # ?????
-            c_s = (comments_to_str(parser, self.pre_comments, pre_indent) +
+            c_s = (comments_to_str(parser, self._pre_comments, pre_indent) +
                    sep[1:])
             s += c_s
             nl += c_s.count('\n')
@@ -470,16 +690,24 @@ class Commented(Stringifiable):
         return s, (nl, col)
 
 
+_no_space = re.compile(r'\S+').fullmatch
+
+
 @total_ordering
 class String(Commented):
+    __slots__ = 'force_quote',
 
     def __init__(self, *args):
         super().__init__(*args)
         self.force_quote = False
 
+    def str_to_val(self, string):
+        # values repeat throughout the trees, so share one copy of each
+        return sys.intern(string) if type(string) is str else string
+
     def val_str(self):
         s = self.val
-        if self.force_quote or not re.fullmatch(r'\S+', s):
+        if self.force_quote or not _no_space(s):
             s = '"{}"'.format(s)
         return s
 
@@ -509,6 +737,7 @@ class String(Commented):
 
 @total_ordering
 class Number(Commented):
+    __slots__ = ()
 
     def str_to_val(self, string):
         try:
@@ -548,10 +777,11 @@ class Number(Commented):
 
 @total_ordering
 class Date(Commented):
+    __slots__ = ()
 
     def __init__(self, *args):
         if len(args) == 3 and isinstance(args[0], int) and isinstance(args[1], int) and isinstance(args[2], int):
-            self.pre_comments = []
+            self._pre_comments = _NO_COMMENTS
             self.val = tuple(args)
             self.post_comment = None
         else:
@@ -563,6 +793,11 @@ class Date(Commented):
     def val_str(self):
         return '{}.{}.{}'.format(*self.val)
 
+    @property
+    def ordinal(self):
+        """the GameDate of the date, to order and count days by"""
+        return GameDate(*self.val)
+
     def __str__(self):
         return self.val_str()
 
@@ -583,10 +818,106 @@ class Date(Commented):
 
 
 class Op(Commented):
-    pass
+    __slots__ = ()
+
+
+def _val(node):
+    return node.val if isinstance(node, (Commented, LeanValue)) else node
+
+
+@total_ordering
+class LeanValue(Stringifiable):
+    """Value of the lean trees of SimpleParser(lean=True): only the value,
+    without comments or formatting state, and read-only. Compares, hashes
+    and prints like the String, Number, Date or Op it stands for, but is not
+    an instance of them."""
+    __slots__ = 'val',
+
+    _pre_comments = _NO_COMMENTS
+    pre_comments = _NO_COMMENTS
+    post_comment = None
+    has_comments = False
+    force_quote = False
+
+    def __init__(self, string):
+        self.val = string
+
+    val_str = Commented.val_str
+    val_inline_str = Commented.val_inline_str
+    str = Commented.str
+    inline_str = Commented.inline_str
+
+    def __str__(self):
+        return self.val_str()
+
+    def __hash__(self):
+        return hash(self.val)
+
+    def __eq__(self, other):
+        return self.val == _val(other)
+
+    def __lt__(self, other):
+        return self.val < _val(other)
+
+    def __add__(self, other):
+        return self.val + _val(other)
+
+
+class LeanString(LeanValue):
+    __slots__ = ()
+
+    def __init__(self, string):
+        self.val = sys.intern(string)
+
+    val_str = String.val_str
+
+    def __str__(self):
+        return self.val
+
+
+class LeanNumber(LeanValue):
+    __slots__ = ()
+
+    def __init__(self, string):
+        try:
+            self.val = int(string)
+        except ValueError:
+            self.val = float(string)
+
+    def __sub__(self, other):
+        return self.val - _val(other)
+
+
+class LeanDate(LeanValue):
+    __slots__ = ()
+
+    def __init__(self, string):
+        self.val = tuple((int(x) if x else 0) for x in string.split('.'))
+
+    val_str = Date.val_str
+    ordinal = Date.ordinal
+
+
+class LeanOp(LeanValue):
+    __slots__ = ()
+
+    def __reduce__(self):
+        return _lean_op, (self.val,)
+
+
+# lean trees are read-only, so they share one node per operator and brace
+_lean_ops = {}
+
+def _lean_op(val):
+    try:
+        return _lean_ops[val]
+    except KeyError:
+        node = _lean_ops[val] = LeanOp(val)
+        return node
 
 
 class Pair(Stringifiable):
+    __slots__ = 'key', 'op', 'value'
 
     def __init__(self, *args):
         super().__init__()
@@ -652,8 +983,9 @@ class Pair(Stringifiable):
             s += self_is + '\n'
         return s
 
-    def inline_str(self, parser, indent=0, col=0):
-        if isinstance(self.key, String) and self.key.val in parser.fq_keys:
+    def inline_str(self, parser, indent=0, col=0, fit=False):
+        if (isinstance(self.key, String) and self.key.val in parser.fq_keys and
+                isinstance(self.value, String)):
             self.value.force_quote = True
         s = ''
         nl = 0
@@ -683,7 +1015,8 @@ class Pair(Stringifiable):
         if not s[-1].isspace():
             s += ' '
             col += 1
-        val_is, (nl_val, col_val) = self.value.inline_str(parser, indent, col)
+        val_is, (nl_val, col_val) = self.value.inline_str(parser, indent, col,
+                                                          fit)
         if val_is[0] == '\n':
             s = s[:-1]
             col -= 1
@@ -693,7 +1026,12 @@ class Pair(Stringifiable):
         return s, (nl, col)
 
 
+class _NoFit(Exception):
+    pass
+
+
 class Obj(ContainerMixin, Stringifiable):
+    __slots__ = 'kel', 'contents', 'ker', '_dictionary'
 
     def __init__(self, kel, contents=None, ker=None):
         super().__init__()
@@ -743,16 +1081,19 @@ class Obj(ContainerMixin, Stringifiable):
         return s
 
     def might_fit_on_line(self, parser, indent):
-        if self.kel.has_comments or self.ker.pre_comments:
+        if self.kel.has_comments or self.ker._pre_comments:
             return False
         if self.contents and isinstance(self.contents[0], Pair):
             return (len(self) == 1 and not self.contents[0].has_comments and
                     indent > parser.no_fold_to_depth and
                     not self.contents[0].key.val in parser.no_fold_keys)
-        return all(isinstance(x, Commented) and not x.has_comments
-                   for x in self)
+        return all(isinstance(x, (Commented, LeanValue)) and
+                   not x.has_comments for x in self)
 
-    def inline_str(self, parser, indent=0, col=0):
+    # with fit, an Obj raises _NoFit rather than spread over several lines,
+    # which fails the one line attempt of the Obj it is in anyway. otherwise
+    # each level of Objs would build the text of all of its contents twice
+    def inline_str(self, parser, indent=0, col=0, fit=False):
         s = ''
         nl = 0
         kel_is, (nl_kel, col_kel) = self.kel.inline_str(parser, indent, col)
@@ -762,23 +1103,28 @@ class Obj(ContainerMixin, Stringifiable):
         if self.might_fit_on_line(parser, indent):
             # attempt one line object
             s_oneline, col_oneline = s, col
-            for item in self:
-                item_is, (nl_item, col_item) = item.inline_str(parser, indent,
-                                                               1 + col_oneline)
-                s_oneline += ' ' + item_is
-                col_oneline = col_item
-                if nl_item > 0 or col_oneline + 2 > parser.chars_per_line:
-                    break
-            else:
-                if self.contents:
-                    s_oneline += ' '
-                    col_oneline += 1
-                ker_is, (nl_ker, col_ker) = self.ker.inline_str(parser, indent,
-                                                                col_oneline)
-                if nl_ker == 0 or (chars(ker_is.splitlines()[0], parser) <=
-                                   parser.chars_per_line):
-                    s_oneline += ker_is
-                    return s_oneline, (nl_ker, col_ker)
+            try:
+                for item in self:
+                    item_is, (nl_item, col_item) = item.inline_str(
+                        parser, indent, 1 + col_oneline, True)
+                    s_oneline += ' ' + item_is
+                    col_oneline = col_item
+                    if nl_item > 0 or col_oneline + 2 > parser.chars_per_line:
+                        break
+                else:
+                    if self.contents:
+                        s_oneline += ' '
+                        col_oneline += 1
+                    ker_is, (nl_ker, col_ker) = self.ker.inline_str(
+                        parser, indent, col_oneline)
+                    if nl_ker == 0 or (chars(ker_is.splitlines()[0], parser) <=
+                                       parser.chars_per_line):
+                        s_oneline += ker_is
+                        return s_oneline, (nl_ker, col_ker)
+            except _NoFit:
+                pass
+        if fit:
+            raise _NoFit
         indent_str = '\t' if parser.tab_indents else ' ' * parser.indent_width
         if self.has_pairs:
             if s[-1].isspace():
@@ -836,6 +1182,103 @@ class Obj(ContainerMixin, Stringifiable):
         return s, (nl, col)
 
 
+def _rebuild(cls, state):
+    node = cls.__new__(cls)
+    for name, value in state.items():
+        setattr(node, name, value)
+    return node
+
+
+class LazyTopLevel(TopLevel):
+    """A TopLevel whose contents are only built when first used, by calling
+    source.contents(ref). Pickles (and copies) as a plain TopLevel."""
+
+    @functools.cached_property
+    def contents(self):
+        contents = self._source.contents(self._ref)
+        del self._source, self._ref
+        return contents
+
+    def __reduce__(self):
+        return _rebuild, (TopLevel, {'contents': self.contents,
+                                     'post_comments': self.post_comments,
+                                     '_dictionary': None,
+                                     '_key_index': getattr(
+                                         self, '_key_index', None)})
+
+
+class LazyObj(Obj):
+    """An Obj whose contents are only built when first used, by calling
+    source.contents(ref). Pickles (and copies) as a plain Obj."""
+
+    @functools.cached_property
+    def contents(self):
+        contents = self._source.contents(self._ref)
+        del self._source, self._ref
+        return contents
+
+    def __reduce__(self):
+        return _new_obj, (self.kel, self.contents, self.ker)
+
+def _new_lazy(cls, source, ref):
+    node = cls.__new__(cls)
+    node._source = source
+    node._ref = ref
+    node._dictionary = None
+    return node
+
+
+# the node constructors parse their arguments generically, which is a large
+# part of the cost per node when building whole trees, so the scanner and the
+# binary cache build the nodes directly instead
+def _new_string(val):
+    node = String.__new__(String)
+    node._pre_comments = _NO_COMMENTS
+    node.val = sys.intern(val)
+    node.post_comment = None
+    node.force_quote = False
+    return node
+
+def _new_number(string):
+    node = Number.__new__(Number)
+    node._pre_comments = _NO_COMMENTS
+    try:
+        node.val = int(string)
+    except ValueError:
+        node.val = float(string)
+    node.post_comment = None
+    return node
+
+def _new_date(string):
+    node = Date.__new__(Date)
+    node._pre_comments = _NO_COMMENTS
+    node.val = tuple((int(x) if x else 0) for x in string.split('.'))
+    node.post_comment = None
+    return node
+
+def _new_op(val):
+    node = Op.__new__(Op)
+    node._pre_comments = _NO_COMMENTS
+    node.val = val
+    node.post_comment = None
+    return node
+
+def _new_pair(key, op, value):
+    node = Pair.__new__(Pair)
+    node.key = key
+    node.op = op
+    node.value = value
+    return node
+
+def _new_obj(kel, contents, ker):
+    node = Obj.__new__(Obj)
+    node.kel = kel
+    node.contents = contents
+    node.ker = ker
+    node._dictionary = None
+    return node
+
+
 class SimpleTokenizer:
     specs = [
         ('Comment', (r'#.*',)),
@@ -847,6 +1290,8 @@ class SimpleTokenizer:
     ]
     useless = ['Comment', 'Space']
     t = staticmethod(make_tokenizer(specs))
+    date_regex = re.compile(r'-?\d*\.\d*\.\d*')
+    number_regex = re.compile(r'-?\d+(\.\d+)?')
 
     @classmethod
     def tokenize(cls, string):
@@ -861,6 +1306,150 @@ class SimpleTokenizer:
                         x.type = 'Name'
                 yield x
 
+    @classmethod
+    def compiled(cls):
+        """the specs as one regex of alternatives tried in order, like the
+        tokenizer made by make_tokenizer, and the names of the token types
+        records() uses"""
+        if 'regex' not in cls.__dict__:
+            alternatives = []
+            for i, (_, (pattern, *flags)) in enumerate(cls.specs):
+                # inline global flags are only allowed at the very start
+                m = re.match(r'\(\?([aiLmsux]+)\)', pattern)
+                if m:
+                    pattern = '(?{}:{})'.format(m.group(1), pattern[m.end():])
+                alternatives.append('(?P<t{}>{})'.format(i, pattern))
+            cls.regex = re.compile('|'.join(alternatives))
+            cls.types = [name for name, _ in cls.specs]
+            cls.types += ['Date', 'Number', 'Name']
+        return cls.regex, cls.types
+
+    @classmethod
+    def records(cls, string):
+        """the tokens tokenize() would yield, made lazily as compact (type,
+        start, end) records, where type indexes the types of compiled()"""
+        regex, types = cls.compiled()
+        useless = {types.index(name) for name in cls.useless}
+        key = types.index('Key') if 'Key' in types else None
+        date, number, name = (types.index(name)
+                              for name in ('Date', 'Number', 'Name'))
+        date_match = cls.date_regex.fullmatch
+        number_match = cls.number_regex.fullmatch
+        match = regex.match
+        pos = 0
+        length = len(string)
+        while pos < length:
+            m = match(string, pos)
+            if m is None:
+                line = string.count('\n', 0, pos) + 1
+                line_start = string.rfind('\n', 0, pos) + 1
+                raise LexerError((line, pos - line_start + 1),
+                                 string.splitlines()[line - 1])
+            end = m.end()
+            code = int(m.lastgroup[1:])
+            if code not in useless:
+                if code == key:
+                    if date_match(string, pos, end):
+                        code = date
+                    elif number_match(string, pos, end):
+                        code = number
+                    else:
+                        code = name
+                yield code, pos, end
+            pos = end
+
+
+class TokenBuffer:
+    """the tokens of a string for the funcparserlib grammars, tokenized as
+    the parser reaches them and kept as (type, start, end) records in arrays
+    instead of a list of Tokens. a Token is only made for the record the
+    parser is looking at.
+
+    funcparserlib asks for len(tokens) to see whether input is left; until
+    the last token has been read this is sys.maxsize, which is enough since
+    it never asks past the token after the last one it looked at."""
+
+    def __init__(self, string, tokenizer):
+        self.string = string
+        self.records = tokenizer.records(string)
+        _, self.types = tokenizer.compiled()
+        self.codes = array.array('b')
+        self.starts = array.array('q')
+        self.ends = array.array('q')
+        self.exhausted = False
+        self.last = -1
+        # the grammars backtrack over a few tokens at a time, so the Tokens
+        # made for the last few records are kept
+        self.tokens = {}
+        # offsets of the first character of each line read so far
+        self.line_starts = array.array('q', [0])
+        self.lines_read = 0
+
+    def fill(self, index):
+        codes = self.codes
+        while len(codes) <= index and not self.exhausted:
+            try:
+                code, start, end = next(self.records)
+            except StopIteration:
+                self.exhausted = True
+                break
+            codes.append(code)
+            self.starts.append(start)
+            self.ends.append(end)
+
+    def __len__(self):
+        self.fill(self.last + 1)
+        return len(self.codes) if self.exhausted else sys.maxsize
+
+    def position(self, offset):
+        """(line, column) of offset, as make_tokenizer's Tokens count them"""
+        string = self.string
+        while self.lines_read < offset:
+            i = string.find('\n', self.lines_read, offset)
+            if i < 0:
+                self.lines_read = offset
+            else:
+                self.line_starts.append(i + 1)
+                self.lines_read = i + 1
+        line = bisect.bisect_right(self.line_starts, offset)
+        return line, offset - self.line_starts[line - 1]
+
+    def __getitem__(self, index):
+        try:
+            return self.tokens[index]
+        except KeyError:
+            pass
+        if index >= len(self.codes):
+            self.fill(index)
+            if index >= len(self.codes):
+                raise IndexError(index)
+        if index > self.last:
+            self.last = index
+            if len(self.tokens) >= 64:
+                self.tokens = {i: token for i, token in self.tokens.items()
+                               if i > index - 32}
+        token = BufferedToken.__new__(BufferedToken)
+        token.type = self.types[self.codes[index]]
+        token.value = self.string[self.starts[index]:self.ends[index]]
+        token.buffer = self
+        token.index = index
+        self.tokens[index] = token
+        return token
+
+
+class BufferedToken(Token):
+    """a Token of a TokenBuffer, which only works out its position in the
+    string when asked, for error messages"""
+
+    @property
+    def start(self):
+        line, column = self.buffer.position(self.buffer.starts[self.index])
+        return line, column + 1
+
+    @property
+    def end(self):
+        return self.buffer.position(self.buffer.ends[self.index])
+
 
 class FullTokenizer(SimpleTokenizer):
     #specs = [
@@ -886,19 +1475,889 @@ class FullTokenizer(SimpleTokenizer):
     t = staticmethod(make_tokenizer(specs))
 
 
+class SimpleScanner:
+    """Hand-written single-pass replacement for SimpleTokenizer plus the
+    SimpleParser grammar. Builds exactly the same trees, but without a token
+    list or the funcparserlib combinators in between."""
+
+    # comments and whitespace are skipped as a prefix of every match. groups:
+    # 1 '{', 2 '}', 3 op, 4 quoted string contents, 5 date, 6 number, 7 name,
+    # 8 unterminated quote. at the end of input the match is empty.
+    _end = r'(?![^\s"#<=>{}])'
+    regex = re.compile(r'(?:\s+|#[^\n]*)*(?:(\{)|(\})|([<=>]=?)|'
+                       r'"(.*?)(?<!\\)"|'
+                       r'(-?\d*\.\d*\.\d*' + _end + r')|'
+                       r'(-?\d+(?:\.\d+)?' + _end + r')|'
+                       r'([^\s"#<=>{}]+)|(")|\Z)', re.DOTALL)
+    # node constructors by group, and for the braces of Objs
+    make = {1: _new_op, 2: _new_op, 3: _new_op, 4: _new_string, 5: _new_date,
+            6: _new_number, 7: _new_string}
+    lean_make = {1: _lean_op, 2: _lean_op, 3: _lean_op, 4: LeanString,
+                 5: LeanDate, 6: LeanNumber, 7: LeanString}
+
+    @staticmethod
+    def error(string, pos, msg, exc=NoParseError):
+        line = string.count('\n', 0, pos) + 1
+        col = pos - string.rfind('\n', 0, pos)
+        if exc is LexerError:
+            # with its line, as make_tokenizer reports it
+            return LexerError((line, col), string.splitlines()[line - 1])
+        return exc('{}: {},{}'.format(msg, line, col), None)
+
+    @classmethod
+    def grammar_error(cls, string, regex, m, msg):
+        """the error for the token of match m out of place. the
+        funcparserlib engine tokenizes the whole text before parsing it, so
+        an unterminated quote from there on is reported instead, as there"""
+        for m2 in regex.finditer(string, m.start()):
+            i = m2.lastindex
+            if i is None:
+                break
+            if i == 8:
+                return cls.error(string, m2.start(i), string[m2.start(i):],
+                                 LexerError)
+        return cls.error(string, m.start(m.lastindex), msg)
+
+    @classmethod
+    def parse(cls, string, strict=True, make=None):
+        # the trees are acyclic, so collection passes while they are being
+        # built only cost time
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            return cls._parse(string, strict, make=make)
+        finally:
+            if gc_enabled:
+                gc.enable()
+
+    @classmethod
+    def _parse(cls, string, strict, regex=None, make=None, pos=0):
+        if regex is None:
+            regex = cls.regex
+        if make is None:
+            make = cls.make
+        new_kel, new_ker = make[1], make[2]
+        new_pair, new_obj = _new_pair, _new_obj
+        # stack of (contents, key, op, kel) for each enclosing Obj
+        stack = []
+        contents = []
+        key = op = kel = None
+        pending = None  # key or value, as yet unknown which
+        for m in regex.finditer(string, pos):
+            i = m.lastindex
+            if i is None:
+                break
+            if i == 8:
+                raise cls.error(string, m.start(i), string[m.start(i):],
+                                LexerError)
+            if op is not None:
+                if i >= 4:
+                    contents.append(new_pair(key, op, make[i](m.group(i))))
+                    key = op = None
+                elif i == 1:
+                    stack.append((contents, key, op, kel))
+                    contents = []
+                    key = op = None
+                    kel = new_kel('{')
+                else:
+                    raise cls.grammar_error(string, regex, m, 'expected value')
+                continue
+            if pending is not None:
+                if i == 3:
+                    key, op, pending = pending, make[3](m.group(3)), None
+                    continue
+                if not stack:
+                    raise cls.grammar_error(string, regex, m,
+                                            'expected operator')
+                contents.append(pending)
+                pending = None
+            if i >= 4:
+                pending = make[i](m.group(i))
+            elif i == 2 and stack:
+                obj = new_obj(kel, contents, new_ker('}'))
+                contents, key, op, kel = stack.pop()
+                contents.append(new_pair(key, op, obj))
+                key = op = None
+            else:
+                raise cls.grammar_error(string, regex, m, 'unexpected token')
+        if op is not None:
+            raise cls.error(string, len(string), 'expected value')
+        if pending is not None:
+            if not stack:
+                raise cls.error(string, len(string), 'expected operator')
+            contents.append(pending)
+        if stack and strict:
+            raise cls.error(string, len(string), 'expected }')
+        while stack:
+            obj = new_obj(kel, contents, new_ker('}'))
+            contents, key, op, kel = stack.pop()
+            contents.append(new_pair(key, op, obj))
+        return TopLevel(contents)
+
+
+class ByteScanner(SimpleScanner):
+    """SimpleScanner for the bytes of a file, such as an mmap, for the 'mmap'
+    engine. Only the slices that become nodes are decoded, and nothing else
+    of the file is copied. The regex is built from the bytes that decode to
+    whitespace and digits in the encoding, so the trees are the same as from
+    the text read in text mode, newline translation included. Other than
+    ASCII-compatible single-byte encodings and UTF-8, or UTF-8 with non-ASCII
+    whitespace or digits in it, the text is decoded whole and scanned as
+    usual, and so it is on a syntax error, to report it at the same place."""
+
+    regexes = {}
+    _utf8_special = None
+
+    @staticmethod
+    def error(string, pos, msg, exc=NoParseError):
+        # the text is scanned again to report the error
+        return exc(None, msg) if exc is LexerError else exc(msg, None)
+
+    @staticmethod
+    def is_utf8(encoding):
+        return codecs.lookup(encoding).name in ('utf-8', 'utf-8-sig')
+
+    @classmethod
+    def regex_for(cls, encoding):
+        """SimpleScanner.regex for the bytes of the encoding, or None if it
+        can't be scanned as bytes"""
+        try:
+            return cls.regexes[encoding]
+        except KeyError:
+            pass
+        ascii = bytes(range(128))
+        if cls.is_utf8(encoding):
+            chars = ascii.decode()
+        else:
+            chars = bytes(range(256)).decode(encoding, 'replace')
+            if len(chars) != 256 or chars[:128] != ascii.decode():
+                cls.regexes[encoding] = None
+                return None
+        space = b''.join(re.escape(bytes([b])) for b, c in enumerate(chars)
+                         if c.isspace())
+        digit = b'[' + b''.join(re.escape(bytes([b]))
+                                for b, c in enumerate(chars)
+                                if c.isdecimal()) + b']'
+        word = b'[^' + space + b'"#<=>{}]'
+        end = b'(?!' + word + b')'
+        # a lone \r ends a comment, as it is read as a newline
+        regex = re.compile(b'(?:[' + space + b']+|#[^\n\r]*)*(?:(\\{)|(\\})|'
+                           b'([<=>]=?)|'
+                           b'"(.*?)(?<!\\\\)"|'
+                           b'(-?' + digit + b'*\\.' + digit + b'*\\.' +
+                           digit + b'*' + end + b')|'
+                           b'(-?' + digit + b'+(?:\\.' + digit + b'+)?' +
+                           end + b')|'
+                           b'(' + word + b'+)|(")|\\Z)', re.DOTALL)
+        cls.regexes[encoding] = regex
+        return regex
+
+    @classmethod
+    def utf8_special(cls):
+        """regex for the non-ASCII whitespace and digits in UTF-8"""
+        if cls._utf8_special is None:
+            chars = (chr(c) for c in range(0x80, 0x110000)
+                     if not 0xd800 <= c < 0xe000)
+            cls._utf8_special = re.compile(b'|'.join(
+                re.escape(c.encode()) for c in chars
+                if c.isspace() or c.isdecimal()))
+        return cls._utf8_special
+
+    @staticmethod
+    def makers(encoding, errors, make=None):
+        """node constructors by group, as in SimpleScanner.make or the given
+        make, decoding the bytes first"""
+        if make is None:
+            make = SimpleScanner.make
+        # a BOM is only skipped at the start of the file
+        if codecs.lookup(encoding).name == 'utf-8-sig':
+            encoding = 'utf-8'
+        decode = codecs.getdecoder(encoding)
+
+        # most names are repeated keys, so each is only decoded once
+        class Names(dict):
+            def __missing__(self, b):
+                string = self[b] = decode(b, errors)[0]
+                return string
+
+        names = Names()
+
+        new_op, new_quoted, new_date, new_number, new_string = (
+            make[i] for i in range(3, 8))
+
+        def new_name(b):
+            return new_string(names[b])
+
+        def new_quoted_bytes(b):
+            string = decode(b, errors)[0]
+            if '\r' in string:
+                string = string.replace('\r\n', '\n').replace('\r', '\n')
+            return new_quoted(string)
+
+        return {1: make[1], 2: make[2], 3: lambda b: new_op(b.decode()),
+                4: new_quoted_bytes, 5: lambda b: new_date(b.decode()),
+                6: new_number, 7: new_name}
+
+    @staticmethod
+    def decode(data, encoding, errors='strict'):
+        """the text of data as read in text mode"""
+        string = str(data, encoding, errors)
+        if '\r' in string:
+            string = string.replace('\r\n', '\n').replace('\r', '\n')
+        return string
+
+    @classmethod
+    def parse(cls, data, encoding, errors='strict', strict=True, make=None):
+        regex = cls.regex_for(encoding)
+        if regex is not None:
+            pos = 0
+            if cls.is_utf8(encoding):
+                if cls.utf8_special().search(data):
+                    regex = None
+                elif (codecs.lookup(encoding).name == 'utf-8-sig' and
+                      data[:3] == codecs.BOM_UTF8):
+                    pos = 3
+        if regex is not None:
+            gc_enabled = gc.isenabled()
+            gc.disable()
+            try:
+                return cls._parse(data, strict, regex,
+                                  cls.makers(encoding, errors, make), pos)
+            except (NoParseError, LexerError):
+                pass
+            finally:
+                if gc_enabled:
+                    gc.enable()
+        return SimpleScanner.parse(cls.decode(data, encoding, errors), strict,
+                                   make)
+
+
+class LazyScanner:
+    """Parses one container at a time for the 'lazy' engine: the text of
+    each Obj is only skipped over, brace-matching, until its contents are
+    first used. Structural errors in the braces are raised right away, others
+    only when the container that holds them is built."""
+
+    regex = SimpleScanner.regex
+    # groups: 1 '{', 2 '}', 3 unterminated quote
+    skip_regex = re.compile(r'(\{)|(\})|"(?:.*?)(?<!\\)"|#[^\n]*|(")',
+                            re.DOTALL)
+
+    def __init__(self, string, strict=True):
+        self.string = string
+        self.strict = strict
+
+    @classmethod
+    def parse(cls, string, strict=True):
+        tree = _new_lazy(LazyTopLevel, cls(string, strict), None)
+        tree.post_comments = []
+        return tree
+
+    def skip(self, pos):
+        """the position after the } closing the Obj starting at pos, or None
+        if the string ends first"""
+        depth = 1
+        for m in self.skip_regex.finditer(self.string, pos):
+            i = m.lastindex
+            if i == 1:
+                depth += 1
+            elif i == 2:
+                depth -= 1
+                if depth == 0:
+                    return m.end()
+            elif i == 3:
+                raise SimpleScanner.error(self.string, m.start(),
+                                          self.string[m.start():], LexerError)
+        return None
+
+    def contents(self, ref):
+        """the contents of the Obj starting at ref, or of the TopLevel if ref
+        is None"""
+        string = self.string
+        error = SimpleScanner.error
+        match = self.regex.match
+        toplevel = ref is None
+        pos = 0 if toplevel else ref
+        contents = []
+        key = op = pending = None
+        while True:
+            m = match(string, pos)
+            pos = m.end()
+            i = m.lastindex
+            if i is None:
+                break
+            if i == 8:
+                raise error(string, m.start(i), string[m.start(i):],
+                            LexerError)
+            if op is not None:
+                if i >= 4:
+                    if i == 7:
+                        value = _new_string(m.group(7))
+                    elif i == 6:
+                        value = _new_number(m.group(6))
+                    elif i == 4:
+                        value = _new_string(m.group(4))
+                    else:
+                        value = _new_date(m.group(5))
+                elif i == 1:
+                    value = _new_lazy(LazyObj, self, pos)
+                    value.kel = _new_op('{')
+                    value.ker = _new_op('}')
+                    pos = self.skip(pos)
+                    if pos is None:
+                        if self.strict:
+                            raise error(string, len(string), 'expected }')
+                        pos = len(string)
+                else:
+                    raise error(string, m.start(i), 'expected value')
+                contents.append(_new_pair(key, op, value))
+                key = op = None
+                continue
+            if pending is not None:
+                if i == 3:
+                    key, op, pending = pending, _new_op(m.group(3)), None
+                    continue
+                if toplevel:
+                    raise error(string, m.start(i), 'expected operator')
+                contents.append(pending)
+                pending = None
+            if i == 7:
+                pending = _new_string(m.group(7))
+            elif i == 6:
+                pending = _new_number(m.group(6))
+            elif i == 4:
+                pending = _new_string(m.group(4))
+            elif i == 5:
+                pending = _new_date(m.group(5))
+            elif i == 2 and not toplevel:
+                return contents
+            else:
+                raise error(string, m.start(i), 'unexpected token')
+        if op is not None:
+            raise error(string, len(string), 'expected value')
+        if pending is not None:
+            if toplevel:
+                raise error(string, len(string), 'expected operator')
+            contents.append(pending)
+        return contents
+
+
+class StreamScanner:
+    """Generates events from a file read in fixed-size chunks instead of
+    building its tree, so memory use doesn't grow with the size of the file.
+    Events are (event, path, node), where path is the tuple of keys, as
+    written, down to the node:
+        'start', path, pair  the Obj value of pair begins (and is left empty)
+        'end', path, pair    and ends
+        'pair', path, pair   a pair whose value is not an Obj
+        'value', path, node  a bare value inside an Obj
+    With select, a '/'-separated fnmatch pattern per key such as
+    'provinces/*/cores' (or a list of them), only the matching pairs are
+    generated, as 'pair' events with their values built in full, and Objs
+    which can't contain a match are skipped over unparsed. Comments are
+    skipped. Unless strict, unclosed braces at the end of the file are
+    allowed, as are bare values at the top level (like the header of a save),
+    which are generated as 'value' events."""
+
+    regex = SimpleScanner.regex
+    skip_regex = LazyScanner.skip_regex
+    chunk_size = 1 << 20
+
+    def __init__(self, f, strict=True, chunk_size=None):
+        self.f = f
+        self.strict = strict
+        if chunk_size is not None:
+            self.chunk_size = chunk_size
+        self.buf = ''
+        self.eof = False
+        # lines and length of the last line of the text already discarded
+        self.lines = 0
+        self.col = 0
+
+    def read(self, pos):
+        """discard the buffer before pos and append the next chunk, or
+        return False if the file has already ended"""
+        if self.eof:
+            return False
+        buf = self.buf
+        lines = buf.count('\n', 0, pos)
+        if lines:
+            self.lines += lines
+            self.col = pos - buf.rfind('\n', 0, pos) - 1
+        else:
+            self.col += pos
+        chunk = self.f.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+        self.buf = buf[pos:] + chunk
+        return True
+
+    def error(self, pos, msg, exc=NoParseError):
+        buf = self.buf
+        line = self.lines + buf.count('\n', 0, pos) + 1
+        start = buf.rfind('\n', 0, pos)
+        col = pos - start if start >= 0 else self.col + pos + 1
+        if exc is LexerError:
+            return LexerError((line, col), msg)
+        return exc('{}: {},{}'.format(msg, line, col), None)
+
+    def skip(self, pos):
+        """the position after the } closing the Obj starting at pos, or None
+        if the file ends first"""
+        search = self.skip_regex.search
+        depth = 1
+        while True:
+            buf = self.buf
+            m = search(buf, pos)
+            if m is None:
+                if not self.read(len(buf)):
+                    return None
+                pos = 0
+                continue
+            i = m.lastindex
+            if (i == 3 or m.end() == len(buf)) and self.read(m.start()):
+                pos = 0
+                continue
+            if i == 1:
+                depth += 1
+            elif i == 2:
+                depth -= 1
+                if depth == 0:
+                    return m.end()
+            elif i == 3:
+                raise self.error(m.start(), buf[m.start():], LexerError)
+            pos = m.end()
+
+    @staticmethod
+    def compile_select(select):
+        if isinstance(select, str):
+            select = [select]
+        return [[re.compile(fnmatch.translate(part)).match
+                 for part in pattern.split('/')] for pattern in select]
+
+    def events(self, select=None):
+        patterns = None if select is None else self.compile_select(select)
+
+        def selected(path, prefix=False):
+            for pattern in patterns:
+                if ((len(pattern) > len(path) if prefix else
+                     len(pattern) == len(path)) and
+                        all(match(key) for match, key in zip(pattern, path))):
+                    return True
+            return False
+
+        new_op, new_pair, new_obj = _new_op, _new_pair, _new_obj
+        new_value = {7: _new_string, 6: _new_number, 4: _new_string,
+                     5: _new_date}
+        match = self.regex.match
+        path = []  # keys of the Objs entered
+        pairs = []  # and their pairs
+        # while building a selected pair, the stack of (contents, key, op,
+        # kel) for each enclosing Obj up to its value
+        building = []
+        contents = None
+        key = op = kel = pending = None
+        keytext = pendingtext = None
+        pos = 0
+        while True:
+            buf = self.buf
+            m = match(buf, pos)
+            i = m.lastindex
+            # a match reaching the end of the buffer may be cut off
+            if (i == 8 or m.end() == len(buf)) and self.read(pos):
+                pos = 0
+                continue
+            pos = m.end()
+            if i is None:
+                break
+            if i == 8:
+                raise self.error(m.start(i), buf[m.start(i):], LexerError)
+            if op is not None:
+                if i >= 4:
+                    pair = new_pair(key, op, new_value[i](m.group(i)))
+                    if building:
+                        contents.append(pair)
+                    else:
+                        pairpath = tuple(path) + (keytext,)
+                        if patterns is None or selected(pairpath):
+                            yield 'pair', pairpath, pair
+                    key = op = None
+                elif i == 1:
+                    if building or (patterns is not None and
+                                    selected(path + [keytext])):
+                        if not building:
+                            path.append(keytext)
+                        building.append((contents, key, op, kel))
+                        contents = []
+                        kel = new_op('{')
+                    elif patterns is None or selected(path + [keytext],
+                                                      prefix=True):
+                        path.append(keytext)
+                        pair = new_pair(key, op, new_obj(new_op('{'), [],
+                                                         new_op('}')))
+                        pairs.append(pair)
+                        if patterns is None:
+                            yield 'start', tuple(path), pair
+                    else:
+                        pos = self.skip(pos)
+                        if pos is None:
+                            if self.strict:
+                                raise self.error(len(self.buf), 'expected }')
+                            pos = len(self.buf)
+                    key = op = None
+                else:
+                    raise self.error(m.start(i), 'expected value')
+                continue
+            if pending is not None:
+                if i == 3:
+                    key, keytext, op = pending, pendingtext, new_op(m.group(3))
+                    pending = None
+                    continue
+                if building:
+                    contents.append(pending)
+                elif path or not self.strict:
+                    if patterns is None:
+                        yield 'value', tuple(path), pending
+                else:
+                    raise self.error(m.start(i), 'expected operator')
+                pending = None
+            if i >= 4:
+                pendingtext = m.group(i)
+                pending = new_value[i](pendingtext)
+            elif i == 2 and building:
+                obj = new_obj(kel, contents, new_op('}'))
+                contents, key, op, kel = building.pop()
+                pair = new_pair(key, op, obj)
+                if building:
+                    contents.append(pair)
+                else:
+                    yield 'pair', tuple(path), pair
+                    path.pop()
+                key = op = None
+            elif i == 2 and path:
+                objpath = tuple(path)
+                path.pop()
+                pair = pairs.pop()
+                if patterns is None:
+                    yield 'end', objpath, pair
+            else:
+                raise self.error(m.start(i), 'unexpected token')
+        end = len(self.buf)
+        if op is not None:
+            raise self.error(end, 'expected value')
+        if pending is not None:
+            if building:
+                contents.append(pending)
+            elif path or not self.strict:
+                if patterns is None:
+                    yield 'value', tuple(path), pending
+            else:
+                raise self.error(end, 'expected operator')
+        if (building or path) and self.strict:
+            raise self.error(end, 'expected }')
+        while building:
+            obj = new_obj(kel, contents, new_op('}'))
+            contents, key, op, kel = building.pop()
+            pair = new_pair(key, op, obj)
+            if building:
+                contents.append(pair)
+            else:
+                yield 'pair', tuple(path), pair
+                path.pop()
+        while path:
+            objpath = tuple(path)
+            path.pop()
+            pair = pairs.pop()
+            if patterns is None:
+                yield 'end', objpath, pair
+
+
+CACHE_FORMAT = 2
+
+# node kinds in the BinaryTreeSerializer node table
+_STRING, _NUMBER, _DATE, _OP, _PAIR, _OBJ = range(6)
+
+
+class PickleTreeSerializer:
+    """Stores the whole tree with pickle"""
+
+    magic = b'CKTP'
+
+    @staticmethod
+    def dump(tree, f):
+        pickle.dump(tree, f, pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def load(f):
+        # the trees are acyclic, so collection passes while they are being
+        # built only cost time
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            return pickle.load(f)
+        finally:
+            if gc_enabled:
+                gc.enable()
+
+
+class BinaryTreeSerializer:
+    """Stores the tree as a flat node table plus a string pool, and loads it
+    as a LazyTopLevel which only builds the nodes of each container when it
+    is first used.
+
+    layout, all int32 in native byte order:
+        counts: nodes, children, comments, strings, pool bytes, root
+            children offset, root comments offset, key index length
+        nodes: (kind, a, b, c) per node, where a, b, c are
+            String/Number/Date/Op: string index, comments offset, force_quote
+            Pair: key, op and value node indices
+            Obj: kel and ker node indices, children offset
+        children: at each offset, a count and that many node indices
+        comments: at each offset, a count, that many pre_comment string
+            indices, and a post_comment string index or -1
+        strings: pool byte offsets of each string, plus the end offset
+        key index: per key, its string index, a count and that many root
+            children indices
+    followed by the pool of utf-8 encoded strings. A comments offset of -1
+    means no comments; a key index length of -1 means no key index."""
+
+    magic = b'CKTB'
+    counts = struct.Struct('8i')
+    scalar_kinds = ((String, _STRING), (Number, _NUMBER), (Date, _DATE),
+                    (Op, _OP))
+
+    @classmethod
+    def dump(cls, tree, f):
+        nodes = array.array('i')
+        children = array.array('i')
+        comments = array.array('i')
+        strings = {}
+
+        def string(s):
+            try:
+                return strings[s]
+            except KeyError:
+                strings[s] = len(strings)
+                return strings[s]
+
+        def commented(pre_comments, post_comment):
+            if not pre_comments and post_comment is None:
+                return -1
+            offset = len(comments)
+            comments.append(len(pre_comments))
+            comments.extend(string(c.val) for c in pre_comments)
+            comments.append(-1 if post_comment is None else
+                            string(post_comment.val))
+            return offset
+
+        def node(item):
+            if isinstance(item, Pair):
+                record = (_PAIR, node(item.key), node(item.op),
+                          node(item.value))
+            elif isinstance(item, Obj):
+                record = (_OBJ, node(item.kel), node(item.ker),
+                          container(item.contents))
+            else:
+                for node_cls, kind in cls.scalar_kinds:
+                    if isinstance(item, node_cls):
+                        break
+                else:
+                    raise TypeError('cannot serialize {!r}'.format(item))
+                if kind == _DATE:
+                    val = '{}.{}.{}'.format(*item.val)
+                else:
+                    val = str(item.val)
+                record = (kind, string(val),
+                          commented(item._pre_comments, item.post_comment),
+                          int(getattr(item, 'force_quote', False)))
+            nodes.extend(record)
+            return len(nodes) // 4 - 1
+
+        def container(contents):
+            indices = [node(item) for item in contents]
+            offset = len(children)
+            children.append(len(indices))
+            children.extend(indices)
+            return offset
+
+        root = container(tree.contents)
+        root_comments = commented(tree.post_comments, None)
+        key_index = array.array('i')
+        if getattr(tree, '_key_index', None) is not None:
+            for key, indices in tree._key_index.items():
+                key_index.extend((string(key), len(indices)))
+                key_index.extend(indices)
+            key_index_len = len(key_index)
+        else:
+            key_index_len = -1
+        pool = [s.encode('utf-8', 'surrogatepass') for s in strings]
+        pool_offsets = array.array('i', [0])
+        for b in pool:
+            pool_offsets.append(pool_offsets[-1] + len(b))
+        f.write(cls.counts.pack(len(nodes) // 4, len(children),
+                                len(comments), len(pool), pool_offsets[-1],
+                                root, root_comments, key_index_len))
+        for arr in nodes, children, comments, pool_offsets, key_index:
+            f.write(arr.tobytes())
+        f.write(b''.join(pool))
+
+    @classmethod
+    def load(cls, f):
+        return NodeTable(f.read()).toplevel()
+
+
+class NodeTable:
+    """Reader for the BinaryTreeSerializer format, building nodes on
+    demand"""
+
+    def __init__(self, data):
+        counts = BinaryTreeSerializer.counts
+        (n_nodes, n_children, n_comments, n_strings, pool_len, self.root,
+         self.root_comments, key_index_len) = counts.unpack_from(data)
+        sizes = [4 * n for n in (4 * n_nodes, n_children, n_comments,
+                                 n_strings + 1, max(key_index_len, 0))]
+        if counts.size + sum(sizes) + pool_len != len(data):
+            raise ValueError('node table size mismatch')
+        buf = memoryview(data)
+        offset = counts.size
+        arrays = []
+        for size in sizes:
+            arrays.append(buf[offset:offset + size].cast('i'))
+            offset += size
+        (self.nodes, self.children, self.comments, self.pool_offsets,
+         key_index) = arrays
+        self.pool = buf[offset:]
+        self.strings = {}
+        self.key_index = None
+        if key_index_len >= 0:
+            self.key_index = {}
+            i = 0
+            while i < key_index_len:
+                count = key_index[i + 1]
+                self.key_index[self.string(key_index[i])] = list(
+                    key_index[i + 2:i + 2 + count])
+                i += 2 + count
+
+    def string(self, i):
+        try:
+            return self.strings[i]
+        except KeyError:
+            start, end = self.pool_offsets[i], self.pool_offsets[i + 1]
+            s = str(self.pool[start:end], 'utf-8', 'surrogatepass')
+            self.strings[i] = s
+            return s
+
+    def comment_lists(self, offset):
+        comments, string = self.comments, self.string
+        count = comments[offset]
+        pre = [Comment(string(i))
+               for i in comments[offset + 1:offset + 1 + count]] or _NO_COMMENTS
+        post = comments[offset + 1 + count]
+        return pre, (None if post < 0 else Comment(string(post)))
+
+    def node(self, i):
+        nodes = self.nodes
+        i *= 4
+        kind = nodes[i]
+        if kind == _PAIR:
+            node = self.node
+            return _new_pair(node(nodes[i + 1]), node(nodes[i + 2]),
+                             node(nodes[i + 3]))
+        if kind == _OBJ:
+            obj = _new_lazy(LazyObj, self, nodes[i + 3])
+            obj.kel = self.node(nodes[i + 1])
+            obj.ker = self.node(nodes[i + 2])
+            return obj
+        val = self.string(nodes[i + 1])
+        if kind == _STRING:
+            node = _new_string(val)
+            node.force_quote = nodes[i + 3] != 0
+        elif kind == _OP:
+            node = _new_op(val)
+        elif kind == _NUMBER:
+            node = _new_number(val)
+        else:
+            node = _new_date(val)
+        if nodes[i + 2] >= 0:
+            node.pre_comments, node.post_comment = self.comment_lists(
+                nodes[i + 2])
+        return node
+
+    def contents(self, offset):
+        children = self.children
+        node = self.node
+        return [node(i) for i in children[offset + 1:
+                                          offset + 1 + children[offset]]]
+
+    def toplevel(self):
+        tree = _new_lazy(LazyTopLevel, self, self.root)
+        tree.post_comments = []
+        if self.root_comments >= 0:
+            tree.post_comments = self.comment_lists(self.root_comments)[0]
+        tree._key_index = self.key_index
+        return tree
+
+
+# state of the parser in each worker process of SimpleParser.parse_paths
+_worker_parser = None
+
+def _init_worker(cls, state, repos):
+    global _worker_parser
+    _worker_parser = cls.__new__(cls)
+    _worker_parser.__dict__.update(state)
+    _worker_parser.in_worker = True
+    _worker_parser.parse_tree_cache = TreeCache()
+    cls.repos.update(repos)
+
+def _parse_file_in_worker(path, kwargs):
+    return _worker_parser.parse_file(path, memcache=False, **kwargs)
+
+
 class SimpleParser:
     tokenizer = SimpleTokenizer
+    scanner = SimpleScanner
+    byte_scanner = ByteScanner
+    lazy_scanner = LazyScanner
+    stream_scanner = StreamScanner
+    engines = 'funcparserlib', 'scanner', 'lazy', 'mmap'
+    lean_engines = 'funcparserlib', 'scanner', 'mmap'
+    serializers = PickleTreeSerializer, BinaryTreeSerializer
+    cache_header = struct.Struct('4s2i')
     repos = {}
-
-    def __init__(self, *moddirs, strict=True):
+    # funcparserlib grammars by (class, strict, lean), shared by all parsers
+    grammars = {}
+    in_worker = False
+
+    def __init__(self, *moddirs, strict=True, engine='funcparserlib',
+                 lean=False, memcache_max_size=None):
+        if engine not in self.engines:
+            raise ValueError('unsupported engine {!r} for {}'.format(
+                             engine, self.__class__.__name__))
+        if lean and engine not in self.lean_engines:
+            raise ValueError('no lean trees from engine {!r} for {}'.format(
+                             engine, self.__class__.__name__))
         self.moddirs = list(moddirs)
         self.basedir = vanilladir
         self.strict = strict
+        self.engine = engine
+        # build read-only trees of LeanValues, without comments
+        self.lean = lean
+        # build the key index of each tree as it is parsed, so that it is
+        # kept in the disk cache along with the tree
+        self.index_keys = False
         self.cache_hits = 0
         self.cache_misses = 0
-        self.parse_tree_cache = {}
+        # trees kept in memory, up to memcache_max_size bytes of source
+        self.parse_tree_cache = TreeCache(memcache_max_size)
         self.memcache_default = False
         self.diskcache_default = True
+        self.workers_default = 1
+        # leave files which already hold what write would write alone, so
+        # their mtimes and caches keyed by them stay valid
+        self.skip_unchanged_default = False
+        self.write_workers_default = 4
+        self.files_written = 0
+        self.files_unchanged = 0
         self.tab_indents = True
         self.indent_width = 8 # minimum 2
         self.chars_per_line = 125
@@ -906,31 +2365,60 @@ class SimpleParser:
         self.no_fold_keys = []
         self.no_fold_to_depth = -1
         self.newlines_to_depth = -1
+        # parsed comment text by text, for comments_to_str
+        self.comment_trees = {}
         self.crlf = True
         self.encoding = 'cp1252'
         self.ignore_cache = False
+        self.serializer = PickleTreeSerializer
+        self.cachedb = None
+        # key the disk cache by file contents instead of by repo and commit
+        self.content_keys = False
+        self.content_digests = {}
         self.vanilla_is_repo = True
-        self.cachedir = cachedir / self.__class__.__name__
-        self.cachedir.mkdir(parents=True, exist_ok=True)
-        self.setup_parser()
+        # created by the first cache write
+        self.cachedir = cachedir / self.cache_name
 
     def __del__(self):
-        if not self.ignore_cache:
+        if not self.ignore_cache and not self.in_worker:
             print('{}: {} hits, {} misses'.format(
                   self.__class__.__name__, self.cache_hits, self.cache_misses),
                   file=sys.stderr)
+            if self.parse_tree_cache.hits or self.parse_tree_cache.evictions:
+                print('{} memory cache: {}'.format(
+                      self.__class__.__name__, self.parse_tree_cache.stats()),
+                      file=sys.stderr)
+        if (self.files_written or self.files_unchanged) and not self.in_worker:
+            print('{}: {} files written, {} unchanged'.format(
+                  self.__class__.__name__, self.files_written,
+                  self.files_unchanged), file=sys.stderr)
 
-    def setup_parser(self):
+    @property
+    def toplevel(self):
+        """the funcparserlib grammar, built on first use"""
+        key = self.__class__, self.strict, self.lean
+        try:
+            return self.grammars[key]
+        except KeyError:
+            toplevel = self.grammars[key] = self.build_grammar()
+            return toplevel
+
+    def build_grammar(self):
         unarg = lambda f: lambda x: f(*x)
         tokval = lambda x: x.value
         toktype = lambda t: some(lambda x: x.type == t) >> tokval
-        kel = a(Token('Brace', '{')) >> tokval >> Op
-        ker = a(Token('Brace', '}')) >> tokval >> Op
-        op = toktype('Op') >> Op
-        number = toktype('Number') >> Number
-        date = toktype('Date') >> Date
-        name = toktype('Name') >> String
-        string = toktype('String') >> (lambda s: s[1:-1]) >> String
+        if self.lean:
+            new_op, new_number, new_date, new_string = (
+                _lean_op, LeanNumber, LeanDate, LeanString)
+        else:
+            new_op, new_number, new_date, new_string = Op, Number, Date, String
+        kel = a(Token('Brace', '{')) >> tokval >> new_op
+        ker = a(Token('Brace', '}')) >> tokval >> new_op
+        op = toktype('Op') >> new_op
+        number = toktype('Number') >> new_number
+        date = toktype('Date') >> new_date
+        name = toktype('Name') >> new_string
+        string = toktype('String') >> (lambda s: s[1:-1]) >> new_string
         key = date | number | name | string
         pair = forward_decl()
         if self.strict:
@@ -939,14 +2427,37 @@ class SimpleParser:
             obj = (kel + many(pair | string | key) +
                    (ker | skip(finished)) >> unarg(Obj))
         pair.define(key + op + (obj | string | key) >> unarg(Pair))
-        self.toplevel = many(pair) + skip(finished) >> TopLevel
+        return many(pair) + skip(finished) >> TopLevel
 
     def flush(self, path=None):
         if path is None:
-            self.parse_tree_cache = {}
+            self.parse_tree_cache.clear()
         elif path in self.parse_tree_cache:
             del self.parse_tree_cache[path]
 
+    @property
+    def memcache_max_size(self):
+        """how many bytes of source files the trees in the memory cache may
+        add up to, or None for no limit. the least recently used trees which
+        aren't pinned are dropped to keep to it"""
+        return self.parse_tree_cache.max_size
+
+    @memcache_max_size.setter
+    def memcache_max_size(self, max_size):
+        self.parse_tree_cache.max_size = max_size
+        if max_size is not None:
+            self.parse_tree_cache.evict(max_size)
+
+    def pin(self, glob, basedir=None, moddirs=None):
+        """always keep the trees of the files matching glob in the memory
+        cache, however large it grows"""
+        if moddirs is None:
+            moddirs = self.moddirs
+        if basedir is None:
+            basedir = self.basedir
+        for path in files(glob, moddirs, basedir=basedir):
+            self.parse_tree_cache.pin(path.resolve())
+
     def invalidate_repo_cache(self, bad_path=None):
         if bad_path is None:
             self.repos.clear()
@@ -958,20 +2469,25 @@ class SimpleParser:
             if bad_repo_path != None:
                 del self.repos[bad_repo_path]
 
-    def get_cachepath(self, path, encoding):
-        m = hashlib.md5()
-        m.update(encoding.encode())
-        m.update(bytes(path))
-        cachedir = self.cachedir
-        name = m.hexdigest()
+    @property
+    def cache_name(self):
+        """the disk cache of lean trees is kept apart from the full trees"""
+        return self.__class__.__name__ + ('Lean' if self.lean else '')
+
+    def get_cachekey(self, path):
+        """(repo, commit, relpath) of path in the disk cache and whether that
+        entry is indexed by commit. repo is None outside of any repository
+        (or vanilladir if it isn't one), commit is None for files changed since
+        their last commit, and relpath is relative to repo if there is one"""
         if not self.vanilla_is_repo and vanilladir in path.parents:
-            return self.cachedir / 'vanilla' / name, False
+            return (vanilladir, None, str(path.relative_to(vanilladir))), False
         for repo_path, (latest_commit, dirty_paths) in self.repos.items():
             if repo_path in path.parents:
                 break
         else:
             repo_init_start = time.time()
             if git_present:
+                import git
                 try:
                     repo = git.Repo(str(path.parent), odbt=git.GitCmdObjectDB,
                                     search_parent_directories=True)
@@ -983,44 +2499,71 @@ class SimpleParser:
             if no_git:
                 if self.vanilla_is_repo and vanilladir in path.parents:
                     self.vanilla_is_repo = False
-                    return self.cachedir / 'vanilla' / name, False
-                return self.cachedir / name, False
+                    return self.get_cachekey(path)
+                return (None, None, str(path)), False
             repo_path = pathlib.Path(repo.working_tree_dir)
-            tracked_files = set(repo.git.ls_files(z=True).split('\x00')[:-1])
-            latest_commit = {}
-            log_output = repo.git.log('.', m=True, pretty='format:%h', z=True,
-                                      name_only=True)
-            log_iter = iter(log_output.split('\x00'))
-            for entry in log_iter:
-                try:
-                    commit, file_str = entry.split('\n', maxsplit=1)
-                except ValueError:
-                    continue
-                while file_str:
-                    try:
-                        tracked_files.remove(file_str)
-                        latest_commit[file_str] = commit
-                    except KeyError:
-                        pass
-                    file_str = next(log_iter)
-                if not tracked_files:
-                    break
-            dirty_paths = []
-            status_output = repo.git.status(z=True)
-            status_iter = iter(status_output.split('\x00')[:-1])
-            for entry in status_iter:
-                dirty_paths.append(pathlib.Path(entry[3:]))
-                if entry[0] == 'R':
-                    next(status_iter)
+            latest_commit, dirty_paths = read_repo(repo)
             self.repos[repo_path] = latest_commit, dirty_paths
             print('Repo {} processed in {:g} s'.format(
                   repo_path.name, time.time() - repo_init_start),
                   file=sys.stderr)
-        repo_cachedir = self.cachedir / repo_path.name
         path = path.relative_to(repo_path)
         if not any(p == path or p in path.parents for p in dirty_paths):
-            return repo_cachedir / latest_commit[str(path)] / name, True
-        return repo_cachedir / name, False
+            return (repo_path, latest_commit[str(path)], str(path)), True
+        return (repo_path, None, str(path)), False
+
+    def get_cachepath(self, path, encoding):
+        m = hashlib.md5()
+        m.update(encoding.encode())
+        m.update(bytes(path))
+        name = m.hexdigest()
+        (repo, commit, _), is_indexed = self.get_cachekey(path)
+        if repo is None:
+            return self.cachedir / name, False
+        if not self.vanilla_is_repo and repo == vanilladir:
+            return self.cachedir / 'vanilla' / name, False
+        if commit is None:
+            return self.cachedir / repo.name / name, False
+        return self.cachedir / repo.name / commit / name, True
+
+    def get_cacheref(self, path, encoding):
+        """where the tree of path is cached: a file under cachedir, or a key
+        of cachedb if there is one, and whether it is indexed by commit (or
+        by content, with content_keys)"""
+        if self.content_keys:
+            digest = self.content_digest(path, encoding)
+            if self.cachedb is None:
+                return self.cachedir / 'content' / digest[:2] / digest, True
+            return (self.cache_name, encoding, '', digest, ''), True
+        if self.cachedb is None:
+            return self.get_cachepath(path, encoding)
+        (repo, commit, relpath), is_indexed = self.get_cachekey(path)
+        key = (self.cache_name, encoding,
+               '' if repo is None else str(repo), commit or '', relpath)
+        return key, is_indexed
+
+    def content_digest(self, path, encoding):
+        """hash of the bytes of path and the encoding they are read as,
+        remembered until the file's size or mtime changes"""
+        stat = path.stat()
+        try:
+            mtime, size, digest = self.content_digests[path, encoding]
+            if mtime == stat.st_mtime_ns and size == stat.st_size:
+                return digest
+        except KeyError:
+            pass
+        m = hashlib.blake2b(str(encoding).encode(), digest_size=16)
+        with path.open('rb') as f:
+            m.update(f.read())
+        digest = m.hexdigest()
+        self.content_digests[path, encoding] = (stat.st_mtime_ns,
+                                                stat.st_size, digest)
+        return digest
+
+    def use_cachedb(self, max_size=None):
+        """keep the disk cache in one sqlite file shared by all parsers"""
+        self.cachedb = CacheDB(self.cachedir.parent / 'trees.sqlite3',
+                               max_size)
 
     def files(self, glob, reverse=False):
         yield from files(glob, self.moddirs, basedir=self.basedir,
@@ -1037,14 +2580,132 @@ class SimpleParser:
 
         return dictionary.items()
 
-    def parse_files(self, glob, basedir=None, moddirs=None, **kwargs):
+    def parse_files(self, glob, basedir=None, moddirs=None, workers=None,
+                    **kwargs):
         if moddirs is None:
             moddirs = self.moddirs
         if basedir is None:
             basedir = self.basedir
-        for path in files(glob, moddirs, basedir=basedir):
-            if path.is_file():
+        paths = (path for path in files(glob, moddirs, basedir=basedir)
+                 if path.is_file())
+        yield from self.parse_paths(paths, workers, **kwargs)
+
+    def parse_paths(self, paths, workers=None, **kwargs):
+        """parse each path, yielding (path, tree) in the order given
+
+        with more than one worker, files which are in neither the memory nor
+        the disk cache are parsed (and written to the disk cache) in a pool
+        of that many processes, a few files ahead of the consumer"""
+        if workers is None:
+            workers = self.workers_default
+        if self.cachedb is not None and not self.ignore_cache:
+            paths = [path.resolve() for path in paths]
+            encoding = kwargs.get('encoding') or self.encoding
+            self.cachedb.prefetch(self.get_cacheref(path, encoding)[0]
+                                  for path in paths)
+        # lazy trees would be built in full to be sent back from a worker
+        if workers <= 1 or self.engine == 'lazy':
+            for path in paths:
                 yield path.resolve(), self.parse_file(path, **kwargs)
+            return
+        memcache = kwargs.pop('memcache', None)
+        jobs = [(path.resolve(), self.is_cached(path, kwargs.get('encoding'),
+                                                kwargs.get('errors', 'replace')))
+                for path in paths]
+        if all(cached for _, cached in jobs):
+            for path, _ in jobs:
+                yield path, self.parse_file(path, memcache=memcache, **kwargs)
+            return
+        state = {k: v for k, v in vars(self).items()
+                 if k != 'parse_tree_cache'}
+        with concurrent.futures.ProcessPoolExecutor(
+                workers, initializer=_init_worker,
+                initargs=(self.__class__, state, dict(self.repos))) as executor:
+            window = collections.deque()
+            jobs = iter(jobs)
+            while True:
+                for path, cached in jobs:
+                    future = None if cached else executor.submit(
+                        _parse_file_in_worker, path, kwargs)
+                    window.append((path, future))
+                    if len(window) >= 4 * workers:
+                        break
+                if not window:
+                    break
+                path, future = window.popleft()
+                if future is None:
+                    tree = self.parse_file(path, memcache=memcache, **kwargs)
+                else:
+                    tree = future.result()
+                    if not (self.ignore_cache or
+                            kwargs.get('errors', 'replace') != 'replace'):
+                        self.cache_misses += 1
+                        if memcache is None:
+                            keep = (self.memcache_default or
+                                    path in self.parse_tree_cache.pinned)
+                        else:
+                            keep = memcache
+                        if keep:
+                            self.parse_tree_cache[path] = tree
+                yield path, tree
+
+    def is_cached(self, path, encoding=None, errors='replace'):
+        """whether parse_file would answer from the memory or disk cache"""
+        path = path.resolve()
+        if self.ignore_cache or errors != 'replace':
+            return False
+        if path in self.parse_tree_cache:
+            return True
+        if encoding is None:
+            encoding = self.encoding
+        return self.cache_is_current(path,
+                                     *self.get_cacheref(path, encoding))
+
+    def cache_is_current(self, path, cacheref, is_indexed):
+        if self.cachedb is not None:
+            return self.cachedb.is_current(cacheref, path, is_indexed)
+        return cacheref.exists() and (is_indexed or
+                                      (os.path.getmtime(str(cacheref)) >=
+                                       os.path.getmtime(str(path))))
+
+    def read_cache(self, cacheref, settings):
+        """the tree stored at cacheref, or None if it was written in another
+        cache format or with other settings"""
+        if self.cachedb is not None:
+            f = self.cachedb.open(cacheref)
+        else:
+            f = cacheref.open('rb')
+        with f:
+            header = f.read(self.cache_header.size)
+            if len(header) < self.cache_header.size:
+                return None
+            magic, cache_format, settings_len = self.cache_header.unpack(header)
+            for serializer in self.serializers:
+                if serializer.magic == magic:
+                    break
+            else:
+                return None
+            if (cache_format != CACHE_FORMAT or
+                pickle.loads(f.read(settings_len)) != settings):
+                return None
+            return serializer.load(f)
+
+    def write_cache(self, cacheref, tree, settings):
+        # the binary format has no lean nodes
+        serializer = PickleTreeSerializer if self.lean else self.serializer
+        settings = pickle.dumps(settings)
+        if self.cachedb is not None:
+            f = io.BytesIO()
+        else:
+            cacheref.parent.mkdir(parents=True, exist_ok=True)
+            f = cacheref.open('wb')
+        with f:
+            f.write(self.cache_header.pack(serializer.magic, CACHE_FORMAT,
+                                           len(settings)))
+            f.write(settings)
+            serializer.dump(tree, f)
+            if self.cachedb is not None:
+                self.cachedb.put(cacheref, f.getvalue())
 
     def parse_file(self, path, encoding=None, errors='replace',
                    memcache=None, diskcache=None):
@@ -1054,71 +2715,200 @@ class SimpleParser:
             return self.parse_file(self.file(path),
                                    encoding, errors, memcache, diskcache)
         if memcache is None:
-            memcache = self.memcache_default
+            memcache = (self.memcache_default or
+                        path in self.parse_tree_cache.pinned)
         if diskcache is None:
             diskcache = self.diskcache_default
         if encoding is None:
             encoding = self.encoding
         ignore_cache = (self.ignore_cache or errors != 'replace')
         if not ignore_cache:
-            if path in self.parse_tree_cache:
-                return self.parse_tree_cache[path]
-            cachepath, is_indexed = self.get_cachepath(path, encoding)
+            tree = self.parse_tree_cache.get(path)
+            if tree is not None:
+                return tree
+            cacheref, is_indexed = self.get_cacheref(path, encoding)
+            # the lazy engine only scans the text, which is cheaper than
+            # reading a cached tree, and caching its tree would build it all
+            lazy = self.engine == 'lazy'
+            if lazy:
+                diskcache = False
             try:
-                if cachepath.exists() and (is_indexed or
-                                           (os.path.getmtime(str(cachepath)) >=
-                                            os.path.getmtime(str(path)))):
-                    with cachepath.open('rb') as f:
-                        tree = pickle.load(f)
-                        if tree.version == VERSION:
-                            if memcache:
-                                self.parse_tree_cache[path] = tree
-                            self.cache_hits += 1
-                            return tree
-            except AttributeError:
-                pass
-            except (pickle.PickleError, EOFError, ImportError, IndexError):
+                if (not lazy and
+                        self.cache_is_current(path, cacheref, is_indexed)):
+                    tree = self.read_cache(cacheref, VERSION)
+                    if tree is not None:
+                        if memcache:
+                            self.parse_tree_cache[path] = tree
+                        self.cache_hits += 1
+                        return tree
+            except (pickle.PickleError, EOFError, ImportError, IndexError,
+                    struct.error, ValueError):
                 print('Error retrieving cache for {}'.format(path),
                       file=sys.stderr)
                 traceback.print_exc()
                 pass
             self.cache_misses += 1
+        try:
+            if self.engine == 'mmap':
+                tree = self.parse_mapped(path, encoding, errors)
+            else:
+                with path.open(encoding=encoding, errors=errors) as f:
+                    tree = self.parse(f.read())
+            if self.index_keys:
+                tree.key_index
+            if not ignore_cache:
+                if diskcache:
+                    # possible todo: put this i/o in another thread
+                    self.write_cache(cacheref, tree, VERSION)
+                if memcache:
+                    self.parse_tree_cache[path] = tree
+            return tree
+        except:
+            print(path, file=sys.stderr)
+            raise
+
+    def parse_mapped(self, path, encoding, errors='replace'):
+        """parse the file from a read-only mmap of it, with ByteScanner"""
+        with path.open('rb') as f:
+            # empty files can't be mapped
+            if os.fstat(f.fileno()).st_size == 0:
+                return self.parse('')
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                return self.byte_scanner.parse(data, encoding, errors,
+                                               self.strict, self.node_makers)
+
+    def iterparse(self, path, select=None, encoding=None, errors='replace',
+                  strict=None):
+        """generate StreamScanner events for the file, without building or
+        caching its tree"""
+        try:
+            path = path.resolve()
+        except AttributeError:
+            path = self.file(path)
+        if encoding is None:
+            encoding = self.encoding
+        if strict is None:
+            strict = self.strict
         with path.open(encoding=encoding, errors=errors) as f:
             try:
-                tree = self.parse(f.read())
-                if not ignore_cache:
-                    if diskcache:
-                        cachepath.parent.mkdir(parents=True, exist_ok=True)
-                        # possible todo: put this i/o in another thread
-                        with cachepath.open('wb') as f:
-                            tree.version = VERSION
-                            pickle.dump(tree, f)
-                    if memcache:
-                        self.parse_tree_cache[path] = tree
-                return tree
+                yield from self.stream_scanner(f, strict).events(select)
             except:
                 print(path, file=sys.stderr)
                 raise
 
+    @property
+    def node_makers(self):
+        """the node constructors for the scanners"""
+        return self.scanner.lean_make if self.lean else None
+
     def parse(self, string):
-        tokens = list(self.tokenizer.tokenize(string))
-        tree = self.toplevel.parse(tokens)
-        return tree
+        if self.engine in ('scanner', 'mmap'):
+            return self.scanner.parse(string, self.strict, self.node_makers)
+        if self.engine == 'lazy':
+            return self.lazy_scanner.parse(string, self.strict)
+        tokens = TokenBuffer(string, self.tokenizer)
+        try:
+            return self.toplevel.parse(tokens)
+        except NoParseError:
+            # the rest of the text is tokenized too, so that an unterminated
+            # quote after the error is reported instead, as when the whole
+            # text was tokenized before parsing
+            tokens.fill(sys.maxsize)
+            raise
 
-    def write(self, tree, path):
-        path.parent.mkdir(parents=True, exist_ok=True)
+    def write(self, tree, path, skip_unchanged=None):
+        """write tree to path, and return whether the file was written. with
+        skip_unchanged, a file which already holds the same bytes is not"""
+        if skip_unchanged is None:
+            skip_unchanged = self.skip_unchanged_default
         try:
-            with path.open('w', encoding=self.encoding,
-                           newline=('\r\n' if self.crlf else '\n')) as f:
-                f.write(tree.str(self))
+            if skip_unchanged:
+                written = self.write_bytes(self.to_bytes(tree), path)
+            else:
+                path.parent.mkdir(parents=True, exist_ok=True)
+                with path.open('w', encoding=self.encoding,
+                               newline=('\r\n' if self.crlf else '\n')) as f:
+                    f.writelines(tree.str_chunks(self))
+                written = True
         except:
             print(path)
             raise
+        if written:
+            self.files_written += 1
+        else:
+            self.files_unchanged += 1
+        return written
+
+    def write_all(self, items, workers=None, skip_unchanged=None):
+        """write each (tree, path) of items as write does, and return the
+        numbers of files written and left unchanged. the trees are written
+        out here, in order, while a pool of threads does the file i/o"""
+        if workers is None:
+            workers = self.write_workers_default
+        if skip_unchanged is None:
+            skip_unchanged = self.skip_unchanged_default
+        written = unchanged = 0
+        with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+            futures = []
+            for tree, path in items:
+                futures.append((path, executor.submit(
+                    self.write_bytes, self.to_bytes(tree), path,
+                    skip_unchanged)))
+            for path, future in futures:
+                try:
+                    if future.result():
+                        written += 1
+                    else:
+                        unchanged += 1
+                except:
+                    print(path)
+                    raise
+        self.files_written += written
+        self.files_unchanged += unchanged
+        return written, unchanged
+
+    @staticmethod
+    def remove_stale(outdir, outpaths):
+        """remove what is in outdir but not in outpaths, and return the
+        removed paths. outdir need not exist"""
+        removed = []
+        if outdir.exists():
+            for path in sorted(outdir.iterdir()):
+                if path not in outpaths:
+                    if path.is_dir():
+                        shutil.rmtree(str(path))
+                    else:
+                        path.unlink()
+                    removed.append(path)
+        return removed
+
+    def to_bytes(self, tree):
+        """the contents of the file write writes for tree"""
+        s = tree.str(self)
+        if self.crlf:
+            s = s.replace('\n', '\r\n')
+        return s.encode(self.encoding)
+
+    @staticmethod
+    def write_bytes(data, path, skip_unchanged=True):
+        """write data to path, unless skip_unchanged and path already holds
+        it; return whether it was written"""
+        try:
+            if (skip_unchanged and path.stat().st_size == len(data) and
+                    path.read_bytes() == data):
+                return False
+        except FileNotFoundError:
+            pass
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(data)
+        return True
 
 class FullParser(SimpleParser):
     tokenizer = FullTokenizer
+    engines = 'funcparserlib',
+    lean_engines = ()
 
-    def setup_parser(self):
+    def build_grammar(self):
         unarg = lambda f: lambda x: f(*x)
         unquote = lambda s: s[1:-1]
         tokval = lambda x: x.value
@@ -1144,5 +2934,5 @@ class FullParser(SimpleParser):
         else:
             obj = kel + many(pair | value) + (ker | end) >> unarg(Obj)
         value.define(obj | key | quoted_string)
-        self.toplevel = (many(pair) + many(nl + comment) + end >>
-                         unarg(TopLevel))
+        return (many(pair) + many(nl + comment) + end >>
+                unarg(TopLevel))
@@ -1,15 +1,20 @@
 #!/usr/bin/env python3
 
 import collections
+import concurrent.futures
 import csv
 import functools
+import gc
 import hashlib
+import importlib.util
 import io
+import mmap
 import operator
 import os
 import pathlib
 import pickle
 import re
+import struct
 import sys
 import time
 import traceback
@@ -17,14 +22,17 @@ from funcparserlib.lexer import make_tokenizer, Token
 from funcparserlib.parser import (some, a, maybe, many, finished, skip,
                                   oneplus, forward_decl, NoParseError)
 from localpaths import rootpath, ck3dir, ck3cachedir
+from cachestore import CacheDB, TreeCache, read_repo
+from gamedate import GameDate
+from fileindex import file_index
+from locstore import Localisation
+import timeline
 
-try:
-    import git
-    git_present = True
-except ImportError:
-    git_present = False
+# GitPython takes long to import, so it is only imported once a repository
+# is looked up
+git_present = importlib.util.find_spec('git') is not None
 
-VERSION = 1
+VERSION = 2
 
 csv.register_dialect('ckii', delimiter=';', doublequote=False,
                      quotechar='\0', quoting=csv.QUOTE_NONE, strict=True)
@@ -48,11 +56,7 @@ def csv_rows(path, linenum=False, comments=False):
 # give mod dirs in descending lexicographical order of mod name (Z-A),
 # modified for dependencies as necessary.
 def files(glob, moddirs=(), basedir=ck3dir, reverse=False):
-    result_paths = {p.relative_to(d): p
-                    for d in (basedir,) + tuple(moddirs) for p in d.glob(glob)}
-    for _, p in sorted(result_paths.items(), key=lambda t: t[0].parts,
-                       reverse=reverse):
-        yield p
+    yield from file_index(basedir, moddirs).glob(glob, reverse)
 
 # def get_cultures(parser, groups=True):
 #     cultures = []
@@ -112,15 +116,11 @@ def files(glob, moddirs=(), basedir=ck3dir, reverse=False):
 #                 locs[row[0]] = row[1]
 #     return locs
 
-def localization():
-    localization_dict = {}
-    for path in (ck3dir / 'localization').glob('*_l_english.yml'):
-        with path.open(encoding='utf-8-sig') as f:
-            for line in f:
-                match = re.fullmatch(r'\s*([^#\s:]+):\d?\s*"(.*)"[^"]*', line)
-                if match:
-                    localization_dict[match.group(1)] = match.group(2)
-    return localization_dict
+def localization(language='english'):
+    """the localization as a read-only mapping, which looks strings up in
+    its tables on disk instead of holding them all"""
+    paths = (ck3dir / 'localization').glob('*_l_{}.yml'.format(language))
+    return Localisation(paths, language, first_wins=False)
 
 def static_values(parser):
     static_values_dict = {}
@@ -161,13 +161,8 @@ def chars(line, parser):
         line = line.splitlines()[-1]
     except IndexError: # empty string
         pass
-    col = 0
-    for char in line:
-        if char == '\t':
-            col = (col // parser.indent_width + 1) * parser.indent_width
-        else:
-            col += 1
-    return col
+    # tab stops every indent_width columns
+    return len(line.expandtabs(parser.indent_width))
 
 def comments_to_str(parser, comments, indent):
     s = ''
@@ -181,11 +176,19 @@ def comments_to_str(parser, comments, indent):
     comments_str = '\n'.join(c.val for c in comments)
     if comments_str == '':
         return s
+    # the same comments are often written again, as the butlast of longer
+    # ones or across the files of a rewrite
     try:
-        tree = parser.parse(comments_str)
-        if not tree.contents:
-            raise ValueError()
-    except (NoParseError, ValueError):
+        tree = parser.comment_trees[comments_str]
+    except KeyError:
+        try:
+            tree = parser.parse(comments_str)
+            if not tree.contents:
+                raise ValueError()
+        except (NoParseError, ValueError):
+            tree = None
+        parser.comment_trees[comments_str] = tree
+    if tree is None:
         butlast = comments_to_str(parser, comments[:-1], indent)
         if butlast:
             butlast += indent * indent_str
@@ -219,7 +222,7 @@ class Stringifiable:
 
 
 class TopLevel(Stringifiable):
-    __slots__ = 'contents', 'post_comments', '_dictionary', 'settings'
+    __slots__ = 'contents', 'post_comments', '_dictionary'
 
     def __init__(self, contents=None, post_comments=None):
         super().__init__()
@@ -301,42 +304,59 @@ class TopLevel(Stringifiable):
         return self._dictionary
 
     def str(self, parser, indent=0):
-        s = ''
+        return ''.join(self.str_chunks(parser, indent))
+
+    def str_chunks(self, parser, indent=0):
+        """generate str() in pieces, one or two per item"""
         for i, item in enumerate(self):
-            s += item.str(parser, indent)
+            yield item.str(parser, indent)
             if indent <= parser.newlines_to_depth:
                 if (i < len(self) - 1 and (isinstance(item.value, Obj) or
                     isinstance(self.contents[i + 1].value, Obj))):
-                    s += '\n'
+                    yield '\n'
         if self.post_comments:
-            s += comments_to_str(parser, self.post_comments, indent)
-        return s
+            yield comments_to_str(parser, self.post_comments, indent)
+
+
+# the pre_comments of nodes without any, until they are used
+_NO_COMMENTS = ()
 
 
 class Commented(Stringifiable):
-    __slots__ = 'pre_comments', 'val', 'post_comment'
+    __slots__ = '_pre_comments', 'val', 'post_comment'
 
     def __init__(self, *args):
         super().__init__()
         if len(args) == 3:
-            self.pre_comments = [Comment(s) for s in args[0]]
+            self._pre_comments = ([Comment(s) for s in args[0]] or
+                                  _NO_COMMENTS)
             self.val = self.str_to_val(args[1])
             self.post_comment = Comment(args[2]) if args[2] else None
         elif len(args) == 2:
-            self.pre_comments = args[1].pre_comments
+            self._pre_comments = args[1]._pre_comments
             if isinstance(args[0], str):
                 self.val = self.str_to_val(args[0])
             else:
                 self.val = args[0]
             self.post_comment = args[1].post_comment
         else:
-            self.pre_comments = []
+            self._pre_comments = _NO_COMMENTS
             self.val = self.str_to_val(args[0])
             self.post_comment = None
 
+    @property
+    def pre_comments(self):
+        if self._pre_comments is _NO_COMMENTS:
+            self._pre_comments = []
+        return self._pre_comments
+
+    @pre_comments.setter
+    def pre_comments(self, value):
+        self._pre_comments = value
+
     @property
     def has_comments(self):
-        return self.pre_comments or self.post_comment
+        return self._pre_comments or self.post_comment
 
     def str_to_val(self, string):
         return string
@@ -351,21 +371,21 @@ class Commented(Stringifiable):
     def str(self, parser, indent=0):
         s = ''
         indent_str = '\t' if parser.tab_indents else ' ' * parser.indent_width
-        if self.pre_comments:
+        if self._pre_comments:
             s += indent * indent_str
-            s += comments_to_str(parser, self.pre_comments, indent)
+            s += comments_to_str(parser, self._pre_comments, indent)
         s += indent * indent_str + self.val_str()
         if self.post_comment:
             s += ' ' + str(self.post_comment)
         s += '\n'
         return s
 
-    def inline_str(self, parser, indent=0, col=0):
+    def inline_str(self, parser, indent=0, col=0, fit=False):
         nl = 0
         indent_str = '\t' if parser.tab_indents else ' ' * parser.indent_width
         sep = '\n' + indent * indent_str
         s = ''
-        if self.pre_comments:
+        if self._pre_comments:
             if col > indent * parser.indent_width:
                 s += sep
                 nl += 1
@@ -376,7 +396,7 @@ class Commented(Stringifiable):
                 pre_indent = indent
             # I can't tell the difference if I'm just after, say, "NOT = { "
             # with indent_width == 8, but whatever. # ?????
-            c_s = (comments_to_str(parser, self.pre_comments, pre_indent) +
+            c_s = (comments_to_str(parser, self._pre_comments, pre_indent) +
                    sep[1:])
             s += c_s
             nl += c_s.count('\n')
@@ -391,6 +411,9 @@ class Commented(Stringifiable):
         return s, (nl, col)
 
 
+_no_space = re.compile(r'\S+').fullmatch
+
+
 class String(Commented):
     __slots__ = 'force_quote',
 
@@ -398,14 +421,19 @@ class String(Commented):
         super().__init__(*args)
         self.force_quote = False
 
+    def str_to_val(self, string):
+        # values repeat throughout the trees, so share one copy of each
+        return sys.intern(string) if type(string) is str else string
+
     def val_str(self):
         s = self.val
-        if self.force_quote or not re.fullmatch(r'\S+', s):
+        if self.force_quote or not _no_space(s):
             s = f'"{s}"'
         return s
 
 
 class Number(Commented):
+    __slots__ = ()
 
     def str_to_val(self, string):
         try:
@@ -415,6 +443,7 @@ class Number(Commented):
 
 
 class Date(Commented):
+    __slots__ = ()
 
     def str_to_val(self, string):
         return tuple((int(x) if x else 0) for x in string.split('.'))
@@ -422,9 +451,14 @@ class Date(Commented):
     def val_str(self):
         return '{}.{}.{}'.format(*self.val)
 
+    @property
+    def ordinal(self):
+        """the GameDate of the date, to order and count days by"""
+        return GameDate(*self.val)
+
 
 class Op(Commented):
-    pass
+    __slots__ = ()
 
 
 class Pair(Stringifiable):
@@ -494,8 +528,9 @@ class Pair(Stringifiable):
             s += self_is + '\n'
         return s
 
-    def inline_str(self, parser, indent=0, col=0):
-        if isinstance(self.key, String) and self.key.val in parser.fq_keys:
+    def inline_str(self, parser, indent=0, col=0, fit=False):
+        if (isinstance(self.key, String) and self.key.val in parser.fq_keys and
+                isinstance(self.value, String)):
             self.value.force_quote = True
         s = ''
         nl = 0
@@ -525,7 +560,8 @@ class Pair(Stringifiable):
         if not s[-1].isspace():
             s += ' '
             col += 1
-        val_is, (nl_val, col_val) = self.value.inline_str(parser, indent, col)
+        val_is, (nl_val, col_val) = self.value.inline_str(parser, indent, col,
+                                                          fit)
         if val_is[0] == '\n':
             s = s[:-1]
             col -= 1
@@ -535,6 +571,10 @@ class Pair(Stringifiable):
         return s, (nl, col)
 
 
+class _NoFit(Exception):
+    pass
+
+
 class Obj(Stringifiable):
     __slots__ = 'kel', 'contents', 'ker', '_dictionary'
 
@@ -618,7 +658,7 @@ class Obj(Stringifiable):
         return s
 
     def might_fit_on_line(self, parser, indent):
-        if self.kel.has_comments or self.ker.pre_comments:
+        if self.kel.has_comments or self.ker._pre_comments:
             return False
         if self.contents and isinstance(self.contents[0], Pair):
             return (len(self) == 1 and not self.contents[0].has_comments and
@@ -627,7 +667,10 @@ class Obj(Stringifiable):
         return all(isinstance(x, Commented) and not x.has_comments
                    for x in self)
 
-    def inline_str(self, parser, indent=0, col=0):
+    # with fit, an Obj raises _NoFit rather than spread over several lines,
+    # which fails the one line attempt of the Obj it is in anyway. otherwise
+    # each level of Objs would build the text of all of its contents twice
+    def inline_str(self, parser, indent=0, col=0, fit=False):
         s = ''
         nl = 0
         kel_is, (nl_kel, col_kel) = self.kel.inline_str(parser, indent, col)
@@ -637,23 +680,28 @@ class Obj(Stringifiable):
         if self.might_fit_on_line(parser, indent):
             # attempt one line object
             s_oneline, col_oneline = s, col
-            for item in self:
-                item_is, (nl_item, col_item) = item.inline_str(parser, indent,
-                                                               1 + col_oneline)
-                s_oneline += ' ' + item_is
-                col_oneline = col_item
-                if nl_item > 0 or col_oneline + 2 > parser.chars_per_line:
-                    break
-            else:
-                if self.contents:
-                    s_oneline += ' '
-                    col_oneline += 1
-                ker_is, (nl_ker, col_ker) = self.ker.inline_str(parser, indent,
-                                                                col_oneline)
-                if nl_ker == 0 or (chars(ker_is.splitlines()[0], parser) <=
-                                   parser.chars_per_line):
-                    s_oneline += ker_is
-                    return s_oneline, (nl_ker, col_ker)
+            try:
+                for item in self:
+                    item_is, (nl_item, col_item) = item.inline_str(
+                        parser, indent, 1 + col_oneline, True)
+                    s_oneline += ' ' + item_is
+                    col_oneline = col_item
+                    if nl_item > 0 or col_oneline + 2 > parser.chars_per_line:
+                        break
+                else:
+                    if self.contents:
+                        s_oneline += ' '
+                        col_oneline += 1
+                    ker_is, (nl_ker, col_ker) = self.ker.inline_str(
+                        parser, indent, col_oneline)
+                    if nl_ker == 0 or (chars(ker_is.splitlines()[0], parser) <=
+                                       parser.chars_per_line):
+                        s_oneline += ker_is
+                        return s_oneline, (nl_ker, col_ker)
+            except _NoFit:
+                pass
+        if fit:
+            raise _NoFit
         indent_str = '\t' if parser.tab_indents else ' ' * parser.indent_width
         if self.has_pairs:
             if s[-1].isspace():
@@ -711,6 +759,13 @@ class Obj(Stringifiable):
         return s, (nl, col)
 
 
+class Timeline(timeline.Timeline):
+    """the Timeline of a history of this parser's trees"""
+
+    def __init__(self, history):
+        super().__init__(history, Pair, Date, Obj)
+
+
 class SimpleTokenizer:
     specs = [
         ('Comment', (r'#.*',)),
@@ -761,18 +816,65 @@ class FullTokenizer(SimpleTokenizer):
     t = staticmethod(make_tokenizer(specs))
 
 
+# state of the parser in each worker process of SimpleParser.parse_paths
+_worker_parser = None
+
+def _init_worker(cls, state, repos):
+    global _worker_parser
+    _worker_parser = cls.__new__(cls)
+    _worker_parser.__dict__.update(state)
+    _worker_parser.in_worker = True
+    _worker_parser.parse_tree_cache = TreeCache()
+    cls.repos.update(repos)
+
+def _parse_file_in_worker(path, kwargs):
+    return _worker_parser.parse_file(path, memcache=False, **kwargs)
+
+
+CACHE_FORMAT = 1
+
+
+class PickleTreeSerializer:
+    """Stores the whole tree with pickle"""
+
+    magic = b'CKTP'
+
+    @staticmethod
+    def dump(tree, f):
+        pickle.dump(tree, f, pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def load(f):
+        # the trees are acyclic, so collection passes while they are being
+        # built only cost time
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            return pickle.load(f)
+        finally:
+            if gc_enabled:
+                gc.enable()
+
+
 class SimpleParser:
     tokenizer = SimpleTokenizer
+    serializers = PickleTreeSerializer,
+    cache_header = struct.Struct('4s2i')
     repos = {}
+    # funcparserlib grammars by class, shared by all parsers
+    grammars = {}
+    in_worker = False
 
-    def __init__(self, *moddirs):
+    def __init__(self, *moddirs, memcache_max_size=None):
         self.moddirs = list(moddirs)
         self.basedir = ck3dir
         self.cache_hits = 0
         self.cache_misses = 0
-        self.parse_tree_cache = {}
+        # trees kept in memory, up to memcache_max_size bytes of source
+        self.parse_tree_cache = TreeCache(memcache_max_size)
         self.memcache_default = False
         self.diskcache_default = True
+        self.workers_default = 1
         self.tab_indents = True
         self.indent_width = 8 # minimum 2
         self.chars_per_line = 125
@@ -780,21 +882,40 @@ class SimpleParser:
         self.no_fold_keys = []
         self.no_fold_to_depth = -1
         self.newlines_to_depth = -1
+        # parsed comment text by text, for comments_to_str
+        self.comment_trees = {}
         self.crlf = False
         self.encoding = 'utf_8_sig'
         self.ignore_cache = False
+        self.serializer = PickleTreeSerializer
+        self.cachedb = None
+        # key the disk cache by file contents instead of by repo and commit
+        self.content_keys = False
+        self.content_digests = {}
         self.vanilla_is_repo = False
+        # created by the first cache write
         self.cachedir = ck3cachedir / self.__class__.__name__
-        self.cachedir.mkdir(parents=True, exist_ok=True)
-        self.setup_parser()
 
     def __del__(self):
-        if not self.ignore_cache:
+        if not self.ignore_cache and not self.in_worker:
             print('{}: {} hits, {} misses'.format(
                   self.__class__.__name__, self.cache_hits, self.cache_misses),
                   file=sys.stderr)
+            if self.parse_tree_cache.hits or self.parse_tree_cache.evictions:
+                print('{} memory cache: {}'.format(
+                      self.__class__.__name__, self.parse_tree_cache.stats()),
+                      file=sys.stderr)
+
+    @property
+    def toplevel(self):
+        """the funcparserlib grammar, built on first use"""
+        try:
+            return self.grammars[self.__class__]
+        except KeyError:
+            toplevel = self.grammars[self.__class__] = self.build_grammar()
+            return toplevel
 
-    def setup_parser(self):
+    def build_grammar(self):
         unarg = lambda f: lambda x: f(*x)
         tokval = lambda x: x.value
         toktype = lambda t: some(lambda x: x.type == t) >> tokval
@@ -811,14 +932,37 @@ class SimpleParser:
         obj.define(kel + many(pair | key | obj) + (ker | skip(finished)) >>
                    unarg(Obj))
         pair.define(key + op + (obj | key) >> unarg(Pair))
-        self.toplevel = many(pair | key | obj) + skip(finished) >> TopLevel
+        return many(pair | key | obj) + skip(finished) >> TopLevel
 
     def flush(self, path=None):
         if path is None:
-            self.parse_tree_cache = {}
+            self.parse_tree_cache.clear()
         elif path in self.parse_tree_cache:
             del self.parse_tree_cache[path]
 
+    @property
+    def memcache_max_size(self):
+        """how many bytes of source files the trees in the memory cache may
+        add up to, or None for no limit. the least recently used trees which
+        aren't pinned are dropped to keep to it"""
+        return self.parse_tree_cache.max_size
+
+    @memcache_max_size.setter
+    def memcache_max_size(self, max_size):
+        self.parse_tree_cache.max_size = max_size
+        if max_size is not None:
+            self.parse_tree_cache.evict(max_size)
+
+    def pin(self, glob, basedir=None, moddirs=None):
+        """always keep the trees of the files matching glob in the memory
+        cache, however large it grows"""
+        if moddirs is None:
+            moddirs = self.moddirs
+        if basedir is None:
+            basedir = self.basedir
+        for path in files(glob, moddirs, basedir=basedir):
+            self.parse_tree_cache.pin(path.resolve())
+
     def invalidate_repo_cache(self, bad_path=None):
         if bad_path is None:
             self.repos.clear()
@@ -830,18 +974,20 @@ class SimpleParser:
             if bad_repo_path != None:
                 del self.repos[bad_repo_path]
 
-    def get_cachepath(self, path):
-        m = hashlib.md5()
-        m.update(bytes(path))
-        name = m.hexdigest()
+    def get_cachekey(self, path):
+        """(repo, commit, relpath) of path in the disk cache and whether that
+        entry is indexed by commit. repo is None outside of any repository
+        (or ck3dir if it isn't one), commit is None for files changed since
+        their last commit, and relpath is relative to repo if there is one"""
         if not self.vanilla_is_repo and ck3dir in path.parents:
-            return self.cachedir / 'vanilla' / name, False
+            return (ck3dir, None, str(path.relative_to(ck3dir))), False
         for repo_path, (latest_commit, dirty_paths) in self.repos.items():
             if repo_path in path.parents:
                 break
         else:
             repo_init_start = time.time()
             if git_present:
+                import git
                 try:
                     repo = git.Repo(str(path.parent), odbt=git.GitCmdObjectDB,
                                     search_parent_directories=True)
@@ -853,44 +999,70 @@ class SimpleParser:
             if no_git:
                 if self.vanilla_is_repo and ck3dir in path.parents:
                     self.vanilla_is_repo = False
-                    return self.cachedir / 'vanilla' / name, False
-                return self.cachedir / name, False
+                    return self.get_cachekey(path)
+                return (None, None, str(path)), False
             repo_path = pathlib.Path(repo.working_tree_dir)
-            tracked_files = set(repo.git.ls_files(z=True).split('\x00')[:-1])
-            latest_commit = {}
-            log_output = repo.git.log('.', m=True, pretty='format:%h', z=True,
-                                      name_only=True)
-            log_iter = iter(log_output.split('\x00'))
-            for entry in log_iter:
-                try:
-                    commit, file_str = entry.split('\n', maxsplit=1)
-                except ValueError:
-                    continue
-                while file_str:
-                    try:
-                        tracked_files.remove(file_str)
-                        latest_commit[file_str] = commit
-                    except KeyError:
-                        pass
-                    file_str = next(log_iter)
-                if not tracked_files:
-                    break
-            dirty_paths = []
-            status_output = repo.git.status(z=True)
-            status_iter = iter(status_output.split('\x00')[:-1])
-            for entry in status_iter:
-                dirty_paths.append(pathlib.Path(entry[3:]))
-                if entry[0] == 'R':
-                    next(status_iter)
+            latest_commit, dirty_paths = read_repo(repo)
             self.repos[repo_path] = latest_commit, dirty_paths
             print('Repo {} processed in {:g} s'.format(
                   repo_path.name, time.time() - repo_init_start),
                   file=sys.stderr)
-        repo_cachedir = self.cachedir / repo_path.name
         path = path.relative_to(repo_path)
         if not any(p == path or p in path.parents for p in dirty_paths):
-            return repo_cachedir / latest_commit[str(path)] / name, True
-        return repo_cachedir / name, False
+            return (repo_path, latest_commit[str(path)], str(path)), True
+        return (repo_path, None, str(path)), False
+
+    def get_cachepath(self, path):
+        m = hashlib.md5()
+        m.update(bytes(path))
+        name = m.hexdigest()
+        (repo, commit, _), is_indexed = self.get_cachekey(path)
+        if repo is None:
+            return self.cachedir / name, False
+        if not self.vanilla_is_repo and repo == ck3dir:
+            return self.cachedir / 'vanilla' / name, False
+        if commit is None:
+            return self.cachedir / repo.name / name, False
+        return self.cachedir / repo.name / commit / name, True
+
+    def get_cacheref(self, path, encoding):
+        """where the tree of path is cached: a file under cachedir, or a key
+        of cachedb if there is one, and whether it is indexed by commit (or
+        by content, with content_keys)"""
+        if self.content_keys:
+            digest = self.content_digest(path, encoding)
+            if self.cachedb is None:
+                return self.cachedir / 'content' / digest[:2] / digest, True
+            return (self.__class__.__name__, encoding or '', '', digest, ''), True
+        if self.cachedb is None:
+            return self.get_cachepath(path)
+        (repo, commit, relpath), is_indexed = self.get_cachekey(path)
+        key = (self.__class__.__name__, encoding or '',
+               '' if repo is None else str(repo), commit or '', relpath)
+        return key, is_indexed
+
+    def content_digest(self, path, encoding):
+        """hash of the bytes of path and the encoding they are read as,
+        remembered until the file's size or mtime changes"""
+        stat = path.stat()
+        try:
+            mtime, size, digest = self.content_digests[path, encoding]
+            if mtime == stat.st_mtime_ns and size == stat.st_size:
+                return digest
+        except KeyError:
+            pass
+        m = hashlib.blake2b(str(encoding).encode(), digest_size=16)
+        with path.open('rb') as f:
+            m.update(f.read())
+        digest = m.hexdigest()
+        self.content_digests[path, encoding] = (stat.st_mtime_ns,
+                                                stat.st_size, digest)
+        return digest
+
+    def use_cachedb(self, max_size=None):
+        """keep the disk cache in one sqlite file shared by all parsers"""
+        self.cachedb = CacheDB(self.cachedir.parent / 'trees.sqlite3',
+                               max_size)
 
     def files(self, glob, reverse=False):
         yield from files(glob, self.moddirs, basedir=self.basedir,
@@ -899,14 +1071,125 @@ class SimpleParser:
     def file(self, *args, **kwargs):
         return next(self.files(*args, **kwargs))
 
-    def parse_files(self, glob, basedir=None, moddirs=None, **kwargs):
+    def parse_files(self, glob, basedir=None, moddirs=None, workers=None,
+                    **kwargs):
         if moddirs is None:
             moddirs = self.moddirs
         if basedir is None:
             basedir = self.basedir
-        for path in files(glob, moddirs, basedir=basedir):
-            if path.is_file():
+        paths = (path for path in files(glob, moddirs, basedir=basedir)
+                 if path.is_file())
+        yield from self.parse_paths(paths, workers, **kwargs)
+
+    def parse_paths(self, paths, workers=None, **kwargs):
+        """parse each path, yielding (path, tree) in the order given
+
+        with more than one worker, files which are in neither the memory nor
+        the disk cache are parsed (and written to the disk cache) in a pool
+        of that many processes, a few files ahead of the consumer"""
+        if workers is None:
+            workers = self.workers_default
+        if self.cachedb is not None and not self.ignore_cache:
+            paths = [path.resolve() for path in paths]
+            self.cachedb.prefetch(
+                self.get_cacheref(path, kwargs.get('encoding'))[0]
+                for path in paths)
+        if workers <= 1:
+            for path in paths:
                 yield path.resolve(), self.parse_file(path, **kwargs)
+            return
+        memcache = kwargs.pop('memcache', None)
+        jobs = [(path.resolve(), self.is_cached(path, kwargs.get('encoding')))
+                for path in paths]
+        if all(cached for _, cached in jobs):
+            for path, _ in jobs:
+                yield path, self.parse_file(path, memcache=memcache, **kwargs)
+            return
+        state = {k: v for k, v in vars(self).items()
+                 if k != 'parse_tree_cache'}
+        with concurrent.futures.ProcessPoolExecutor(
+                workers, initializer=_init_worker,
+                initargs=(self.__class__, state, dict(self.repos))) as executor:
+            window = collections.deque()
+            jobs = iter(jobs)
+            while True:
+                for path, cached in jobs:
+                    future = None if cached else executor.submit(
+                        _parse_file_in_worker, path, kwargs)
+                    window.append((path, future))
+                    if len(window) >= 4 * workers:
+                        break
+                if not window:
+                    break
+                path, future = window.popleft()
+                if future is None:
+                    tree = self.parse_file(path, memcache=memcache, **kwargs)
+                else:
+                    tree = future.result()
+                    if not self.ignore_cache:
+                        self.cache_misses += 1
+                        if memcache is None:
+                            keep = (self.memcache_default or
+                                    path in self.parse_tree_cache.pinned)
+                        else:
+                            keep = memcache
+                        if keep:
+                            self.parse_tree_cache[path] = tree
+                yield path, tree
+
+    def is_cached(self, path, encoding=None):
+        """whether parse_file would answer from the memory or disk cache"""
+        path = path.resolve()
+        if self.ignore_cache:
+            return False
+        if path in self.parse_tree_cache:
+            return True
+        return self.cache_is_current(path,
+                                     *self.get_cacheref(path, encoding))
+
+    def cache_is_current(self, path, cacheref, is_indexed):
+        if self.cachedb is not None:
+            return self.cachedb.is_current(cacheref, path, is_indexed)
+        return cacheref.exists() and (is_indexed or
+                                      (os.path.getmtime(str(cacheref)) >=
+                                       os.path.getmtime(str(path))))
+
+    def read_cache(self, cacheref, settings):
+        """the tree stored at cacheref, or None if it was written in another
+        cache format or with other settings"""
+        if self.cachedb is not None:
+            f = self.cachedb.open(cacheref)
+        else:
+            f = cacheref.open('rb')
+        with f:
+            header = f.read(self.cache_header.size)
+            if len(header) < self.cache_header.size:
+                return None
+            magic, cache_format, settings_len = self.cache_header.unpack(header)
+            for serializer in self.serializers:
+                if serializer.magic == magic:
+                    break
+            else:
+                return None
+            if (cache_format != CACHE_FORMAT or
+                pickle.loads(f.read(settings_len)) != settings):
+                return None
+            return serializer.load(f)
+
+    def write_cache(self, cacheref, tree, settings):
+        settings = pickle.dumps(settings)
+        if self.cachedb is not None:
+            f = io.BytesIO()
+        else:
+            cacheref.parent.mkdir(parents=True, exist_ok=True)
+            f = cacheref.open('wb')
+        with f:
+            f.write(self.cache_header.pack(self.serializer.magic, CACHE_FORMAT,
+                                           len(settings)))
+            f.write(settings)
+            self.serializer.dump(tree, f)
+            if self.cachedb is not None:
+                self.cachedb.put(cacheref, f.getvalue())
 
     def parse_file(self, path, encoding=None, errors=None,
                    memcache=None, diskcache=None):
@@ -916,70 +1199,77 @@ class SimpleParser:
             return self.parse_file(self.file(path),
                                    encoding, errors, memcache, diskcache)
         if memcache is None:
-            memcache = self.memcache_default
+            memcache = (self.memcache_default or
+                        path in self.parse_tree_cache.pinned)
         if diskcache is None:
             diskcache = self.diskcache_default
         if encoding is None:
             errors = None
         ignore_cache = self.ignore_cache
         if not ignore_cache:
-            if path in self.parse_tree_cache:
-                return self.parse_tree_cache[path]
-            cachepath, is_indexed = self.get_cachepath(path)
+            tree = self.parse_tree_cache.get(path)
+            if tree is not None:
+                return tree
+            cacheref, is_indexed = self.get_cacheref(path, encoding)
             try:
-                if cachepath.exists() and (is_indexed or
-                                           (os.path.getmtime(str(cachepath)) >=
-                                            os.path.getmtime(str(path)))):
-                    with cachepath.open('rb') as f:
-                        tree = pickle.load(f)
-                        if tree.settings == (VERSION, encoding, errors):
-                            if memcache:
-                                self.parse_tree_cache[path] = tree
-                            self.cache_hits += 1
-                            return tree
-            # except AttributeError:
-            #     pass
+                if self.cache_is_current(path, cacheref, is_indexed):
+                    tree = self.read_cache(cacheref,
+                                           (VERSION, encoding, errors))
+                    if tree is not None:
+                        if memcache:
+                            self.parse_tree_cache[path] = tree
+                        self.cache_hits += 1
+                        return tree
             except (pickle.PickleError, EOFError, ImportError, IndexError,
-                    AttributeError):
+                    AttributeError, struct.error):
                 print('Error retrieving cache for {}'.format(path),
                       file=sys.stderr)
                 traceback.print_exc()
             self.cache_misses += 1
-        args = (path, errors, ignore_cache, diskcache, cachepath, memcache,
-                encoding)
-        if encoding is not None:
-            return self.parse_file_as(encoding, *args)
         try:
-            return self.parse_file_as('utf_8_sig', *args)
+            tree = self.parse(self.read_file(path, encoding, errors))
+            if not ignore_cache:
+                if diskcache:
+                    # possible todo: put this i/o in another thread
+                    self.write_cache(cacheref, tree,
+                                     (VERSION, encoding, errors))
+                if memcache:
+                    self.parse_tree_cache[path] = tree
+            return tree
         except UnicodeDecodeError:
-            return self.parse_file_as('cp1252', *args)
+            raise
+        except:
+            print(path, file=sys.stderr)
+            # if (path.name in ('00_bastard_triggers.txt',
+            #                   'stress_threshold_events.txt') or
+            #     any(p.name == 'map_object_data' for p in path.parents)):
+            #     print('discarding parse error assumed from vanilla',
+            #           file=sys.stderr)
+            #     return None
+            raise
 
-    def parse_file_as(self, encoding, path, errors, ignore_cache, diskcache,
-                      cachepath, memcache, orig_encoding):
-        with path.open(encoding=encoding, errors=errors) as f:
-            try:
-                tree = self.parse(f.read())
-                if not ignore_cache:
-                    if diskcache:
-                        cachepath.parent.mkdir(parents=True, exist_ok=True)
-                        # possible todo: put this i/o in another thread
-                        with cachepath.open('wb') as f:
-                            tree.settings = VERSION, orig_encoding, errors
-                            pickle.dump(tree, f)
-                    if memcache:
-                        self.parse_tree_cache[path] = tree
-                return tree
-            except UnicodeDecodeError:
-                raise
-            except:
-                print(path, file=sys.stderr)
-                # if (path.name in ('00_bastard_triggers.txt',
-                #                   'stress_threshold_events.txt') or
-                #     any(p.name == 'map_object_data' for p in path.parents)):
-                #     print('discarding parse error assumed from vanilla',
-                #           file=sys.stderr)
-                #     return None
-                raise
+    def read_file(self, path, encoding=None, errors=None):
+        """the text of the file as read in text mode. with no encoding, it is
+        UTF-8 (skipping a BOM), or cp1252 if it isn't valid UTF-8. the file
+        is mapped and decoded straight from the mapping, and only decoded
+        again as cp1252 if the UTF-8 decoding fails, rather than read again"""
+        if errors is None:
+            errors = 'strict'
+        with path.open('rb') as f:
+            # empty files can't be mapped
+            if os.fstat(f.fileno()).st_size == 0:
+                return ''
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                if encoding is not None:
+                    string = str(data, encoding, errors)
+                else:
+                    try:
+                        string = str(data, 'utf_8_sig')
+                    except UnicodeDecodeError:
+                        string = str(data, 'cp1252', errors)
+        if '\r' in string:
+            string = string.replace('\r\n', '\n').replace('\r', '\n')
+        return string
 
     def parse(self, string):
         tokens = list(self.tokenizer.tokenize(string))
@@ -991,7 +1281,7 @@ class SimpleParser:
         try:
             with path.open('w', encoding=self.encoding,
                            newline=('\r\n' if self.crlf else '\n')) as f:
-                f.write(tree.str(self))
+                f.writelines(tree.str_chunks(self))
         except:
             print(path)
             raise
@@ -999,7 +1289,7 @@ class SimpleParser:
 class FullParser(SimpleParser):
     tokenizer = FullTokenizer
 
-    def setup_parser(self):
+    def build_grammar(self):
         unarg = lambda f: lambda x: f(*x)
         unquote = lambda s: s[1:-1]
         tokval = lambda x: x.value
@@ -1022,8 +1312,8 @@ class FullParser(SimpleParser):
         pair = key + op + value >> unarg(Pair)
         obj = kel + many(pair | value) + (ker | end) >> unarg(Obj)
         value.define(obj | key)
-        self.toplevel = (many(pair | value) + many(nl + comment) + end >>
-                         unarg(TopLevel))
+        return (many(pair | value) + many(nl + comment) + end >>
+                unarg(TopLevel))
 
 # maybe todo: build StrictParser & StrictFullParser.
 #  - final kers required
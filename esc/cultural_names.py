@@ -9,7 +9,7 @@ from print_time import print_time
 
 @print_time
 def main():
-    parser = SimpleParser(rootpath / 'SWMH-BETA/SWMH')
+    parser = SimpleParser(rootpath / 'SWMH-BETA/SWMH', lean=True)
     cultures = set()
     for _, tree in parser.parse_files('common/cultures/*.txt'):
         for n, v in tree:
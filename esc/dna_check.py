@@ -5,7 +5,7 @@ from print_time import print_time
 
 @print_time
 def main():
-    parser = SimpleParser()
+    parser = SimpleParser(lean=True)
     dna_chars = set()
     for action, moddirs in [(dna_chars.add, []), (dna_chars.discard, [rootpath / 'SWMH-BETA/SWMH'])]:
         for _, tree in parser.parse_files('history/characters/*.txt', moddirs=moddirs):
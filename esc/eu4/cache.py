@@ -57,12 +57,12 @@ def disk_cache(serializer=PickleSerializer):
         @wraps(f)
         def wrapper(self):
             cachedir_with_module = eu4cachedir / f.__module__
-            cachedir_with_module.mkdir(parents=True, exist_ok=True)
             cachefile = cachedir_with_module / (f.__name__ + '.' + serializer.get_file_extension())
             if cachefile.exists():
                 return serializer.deserialize(cachefile)
             else:
                 return_value = f(self)
+                cachedir_with_module.mkdir(parents=True, exist_ok=True)
                 serializer.serialize(return_value, cachefile)
                 return return_value
         return wrapper
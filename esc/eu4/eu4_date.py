@@ -1,5 +1,10 @@
+import os
 import re
+import sys
 
+# add the parent folder to the path so that imports work even if the working directory is the eu4 folder
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+from gamedate import GameDate
 
 class Eu4Date:
     """subtracting two dates results in an int which is their difference in days"""
@@ -22,6 +27,7 @@ class Eu4Date:
                 self.day = int(matches.group(1))
             else:
                 raise Exception('Invalid date ' + datestring)
+        self.date = GameDate(self.year, self.month, self.day)
 
     def get_iso_date(self):
         return '{}-{:02}-{:02}'.format(self.year, self.month, self.day)
@@ -30,14 +36,10 @@ class Eu4Date:
         return '{}.{}.{}'.format(self.year, self.month, self.day)
 
     def get_days_in_year(self):
-        days_in_year = 0
-        for month in range(1, self.month):
-            days_in_year += self.days_in_month[month]
-        days_in_year += self.day
-        return days_in_year
+        return self.date.day_of_year
 
     def get_days_since_year_zero(self):
-        return 365 * self.year + self.get_days_in_year()
+        return int(self.date) + 1
 
     def __sub__(self, other_date):
-        return self.get_days_since_year_zero() - other_date.get_days_since_year_zero()
\ No newline at end of file
+        return self.date - other_date.date
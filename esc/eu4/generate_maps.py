@@ -2,7 +2,6 @@
 import math
 import os
 import sys
-import re
 import numpy as np
 from PIL import Image
 from pathlib import Path
@@ -572,16 +571,16 @@ every_province = {
         print('\n'.join(add_core_code))
 
     def generate_provincelists(self, savefile):
-        save_data = open(savefile, encoding='cp1252').read()
-        core_regex = re.compile('^-([0-9]{1,4})=.*?(cores=\{\n([^}\n]*)|^\t\})', re.MULTILINE |re.DOTALL)
+        # stream the save, which can be hundreds of MB, and only build the cores of each province.
+        # strict=False allows the EU4txt header
         tags_to_provinces = {}
-        for match in core_regex.finditer(save_data):
-            if match[3]:
-                provinceID = match[1]
-                for tag in match[3].split():
-                    if tag not in tags_to_provinces:
-                        tags_to_provinces[tag] = []
-                    tags_to_provinces[tag].append(provinceID)
+        for _, path, pair in self.mapparser.parser.iterparse(Path(savefile), 'provinces/*/cores',
+                                                             encoding='cp1252', strict=False):
+            provinceID = path[1].lstrip('-')
+            for tag in pair.value:
+                if tag.val not in tags_to_provinces:
+                    tags_to_provinces[tag.val] = []
+                tags_to_provinces[tag.val].append(provinceID)
 
         print('Please add the following code to eu4/provincelists.py')
         print('-'*40)
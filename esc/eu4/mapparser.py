@@ -2,7 +2,8 @@ from collections import OrderedDict
 import re
 import numpy as np
 from PIL import Image
-from ck2parser import csv_rows, Pair
+from ck2parser import (csv_rows, Pair, province_adjacencies,
+                       province_id_raster)
 from localpaths import cachedir
 from eu4.provincelists import terrain_to_provinces
 from eu4.eu4lib import *
@@ -28,7 +29,6 @@ class Eu4MapParser(Eu4Parser):
         self.regionColors = None
         if cachedir:
             self.cachedir = cachedir / self.__class__.__name__
-            self.cachedir.mkdir(parents=True, exist_ok=True)
 
     def map_path(self, key):
         return self.parser.file('map/' + self.default_tree[key].val)
@@ -56,9 +56,8 @@ class Eu4MapParser(Eu4Parser):
         # the code is valid, because Image implements __array_interface__
         # noinspection PyTypeChecker
         pa = np.array(Image.open(str(self.map_path('provinces'))))
-        pa = pa.view('u1,u1,u1')[..., 0]
-        pa = np.vectorize(lambda x: self._get_provinces_rgb_map()[tuple(x)],
-                          otypes=[np.uint16])(pa)
+        pa, _ = province_id_raster(pa, self._get_provinces_rgb_map(),
+                                   warn=True)
         return pa
 
     @cached_property
@@ -445,6 +444,8 @@ class Eu4MapParser(Eu4Parser):
         and it should not be called directly
         """
         provinces_data = {}
+        numbers = []
+        paths = []
         for path in self.parser.files('history/provinces/*'):
             match = re.match(r'\d+', path.stem)
             if not match:
@@ -452,9 +453,12 @@ class Eu4MapParser(Eu4Parser):
             number = int(match.group())
             if number >= self.max_provinces:
                 continue
+            numbers.append(number)
+            paths.append(path)
 
+        for number, (_, tree) in zip(numbers, self.parser.parse_paths(paths)):
             cores = set()
-            values = self.parser.parse_file(path).get_entries_at_date(
+            values = tree.get_entries_at_date(
                 duplicated_keys=['add_permanent_province_modifier', 'add_province_triggered_modifier'],
                 special_handlers={'add_core': lambda value, previous_values: cores.add(value.val),
                                   'remove_core': lambda value, previous_values:
@@ -520,25 +524,19 @@ class Eu4MapParser(Eu4Parser):
     @disk_cache()
     def adjacency_map(self):
         """dictionary between provinceIDs and a set of adjacent provinceIDs"""
-        id_map = self.positions_to_provinceID_array
-        max_x = len(id_map[0])
-        max_y = len(id_map)
-        adjacency_map = {provinceID: set() for provinceID in self.all_provinceIDs}
-        for x in range(max_x):
-            for y in range(max_y):
-                provinceID = id_map[y][x]
-                if x > 0:
-                    adjacency_map[provinceID].add(id_map[y][x - 1])
-                if y > 0:
-                    adjacency_map[provinceID].add(id_map[y - 1][x])
-                if x < max_x - 1:
-                    adjacency_map[provinceID].add(id_map[y][x + 1])
-                if y < max_y - 1:
-                    adjacency_map[provinceID].add(id_map[y + 1][x])
-                # tests indicate that diagonal pixels don't count as adjacent
-                # examples:
-                # Halmaheran Sea(1400) - Flores Sea(1357)
-                # Stadacona (994) - Pekuakamiulnuatsh (2579)
+        # a province's own pixels border each other, so it is in its own set
+        adjacency_map = {provinceID: {provinceID}
+                         for provinceID in self.all_provinceIDs}
+        # tests indicate that diagonal pixels don't count as adjacent
+        # examples:
+        # Halmaheran Sea(1400) - Flores Sea(1357)
+        # Stadacona (994) - Pekuakamiulnuatsh (2579)
+        pairs = province_adjacencies(self.positions_to_provinceID_array)
+        for one, two in pairs.tolist():
+            if one in adjacency_map:
+                adjacency_map[one].add(two)
+            if two in adjacency_map:
+                adjacency_map[two].add(one)
 
         return adjacency_map
 
@@ -568,11 +566,13 @@ class Eu4MapParser(Eu4Parser):
 
     def _find_tags_by_effect_and_folder(self, effects: list[str], folder: str) -> set[str]:
         tags = set()
+        # all the effects in one walk of each file
+        selectors = ['**/' + effect for effect in effects]
         for file, data in self.parser.parse_files(folder + '/**/*.txt'):
-            for effect in effects:
-                for tag in data.find_all_recursively(effect):
-                    if re.fullmatch(r'[A-Z]{3}', tag):
-                        tags.add(tag)
+            for pair in data.select(*selectors):
+                tag = getattr(pair.value, 'val', None)
+                if isinstance(tag, str) and re.fullmatch(r'[A-Z]{3}', tag):
+                    tags.add(tag)
         return tags
 
     @cached_property
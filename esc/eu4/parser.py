@@ -11,6 +11,7 @@ from eu4.paths import eu4_version, eu4_major_version
 from eu4.eu4lib import Religion, Idea, IdeaGroup, Policy, Eu4Color, Country, Mission, MissionGroup, GovernmentReform, \
     CultureGroup, Culture, DLC, BaseGame, Estate
 from eu4.cache import disk_cache, cached_property
+from locstore import Localisation
 
 
 class Eu4Parser:
@@ -28,16 +29,10 @@ class Eu4Parser:
         self.parser.basedir = eu4dir
 
     @cached_property
-    @disk_cache()
     def _localisation_dict(self):
-        localisation_dict = {}
-        for path in (eu4dir / 'localisation').glob('*_l_english.yml'):
-            with path.open(encoding='utf-8-sig') as f:
-                for line in f:
-                    match = re.fullmatch(r'\s*([^#\s:]+):\d?\s*"(.*)"[^"]*', line)
-                    if match:
-                        localisation_dict[match.group(1)] = match.group(2)
-        return localisation_dict
+        """a read-only mapping which looks strings up in tables on disk"""
+        paths = (eu4dir / 'localisation').glob('*_l_english.yml')
+        return Localisation(paths, first_wins=False)
 
     def localize(self, key: str, default: str = None) -> str:
         """localize the key from the english eu4 localisation files
@@ -2,7 +2,7 @@
 
 import numpy as np
 from PIL import Image
-from ck2parser import rootpath, csv_rows, SimpleParser
+from ck2parser import rootpath, csv_rows, SimpleParser, province_id_raster
 from localpaths import eu4dir
 from print_time import print_time
 
@@ -48,9 +48,7 @@ for row in csv_rows(map_path('definitions')):
         rgb = tuple(np.uint8(row[1:4]))
         rgb_number_map[rgb] = np.uint16(number)
 prov_rgb = np.array(Image.open(str(map_path('provinces'))))
-prov_rgb = prov_rgb.view('u1,u1,u1')[..., 0]
-prov_id = np.vectorize(lambda x: rgb_number_map[tuple(x)],
-                       otypes=[np.uint16])(prov_rgb)
+prov_id, _ = province_id_raster(prov_rgb, rgb_number_map, warn=True)
 borders_path = rootpath / 'eu4borderlayer.png'
 borders = Image.open(str(borders_path))
 prov_color_lut_base = np.full(max_provinces, colors['land'], '3u1')
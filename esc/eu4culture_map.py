@@ -9,7 +9,8 @@ import urllib.request
 import numpy as np
 from PIL import Image
 import spectra
-from ck2parser import rootpath, csv_rows, SimpleParser, Obj
+from ck2parser import (rootpath, csv_rows, SimpleParser, Obj,
+                       province_id_raster)
 from localpaths import eu4dir
 from eu4.paths import eu4outpath
 from print_time import print_time
@@ -113,8 +114,7 @@ def main():
         prov_color_lut[int(n.val)] = colors['sea']
 
     image = Image.open(str(provinces_path))
-    a = np.array(image).view('u1,u1,u1')[..., 0]
-    b = np.vectorize(lambda x: rgb_number_map[tuple(x)], otypes=[np.uint16])(a)
+    b, _ = province_id_raster(np.array(image), rgb_number_map, warn=True)
     mod = parser.moddirs[0].name.lower() + '_' if parser.moddirs else ''
     borders_path = rootpath / (mod + 'eu4borderlayer.png')
     borders = Image.open(str(borders_path))
@@ -8,7 +8,7 @@ import matplotlib.cm
 import matplotlib.colors
 import numpy as np
 from PIL import Image, ImageFont, ImageDraw
-from ck2parser import rootpath, csv_rows, SimpleParser
+from ck2parser import rootpath, csv_rows, SimpleParser, province_id_raster
 from localpaths import eu4dir
 from print_time import print_time
 
@@ -85,8 +85,7 @@ def main():
         prov_color_lut[int(n.val)] = colors['sea']
 
     image = Image.open(str(provinces_path))
-    a = np.array(image).view('u1,u1,u1')[..., 0]
-    b = np.vectorize(lambda x: rgb_number_map[tuple(x)], otypes=[np.uint16])(a)
+    b, _ = province_id_raster(np.array(image), rgb_number_map, warn=True)
     font = ImageFont.truetype(str(rootpath / 'ck2utils/esc/NANOTYPE.ttf'), 16)
     mod = parser.moddirs[0].name.lower() + '_' if parser.moddirs else ''
     borders_path = rootpath / (mod + 'eu4borderlayer.png')
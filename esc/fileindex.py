@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+
+# the files of a game dir and its mod dirs, as the parsers look them up by
+# glob, with the listing of each directory kept between lookups.
+
+import fnmatch
+import os
+import pathlib
+import re
+import time
+
+has_magic = re.compile('[*?[]').search
+
+
+class FileIndex:
+    """the merged view of a base dir and its mod dirs, where a path in a
+    later dir overrides the same relative path in the earlier ones
+
+    each directory is listed in every root on its first lookup, and the
+    result of each glob is kept along with the directories it looked at;
+    later lookups only stat those again, and list anew where an mtime
+    changed"""
+
+    def __init__(self, roots):
+        self.roots = tuple(roots)
+        # relative dir -> (mtime in each root, None where it is missing,
+        # {normcased name: (name, last root having it, last root having it
+        # as a dir or None)},
+        # names sorted)
+        self.dirs = {}
+        # (glob, reverse) -> (relative dirs looked at, paths)
+        self.globs = {}
+
+    def mtimes(self, reldir):
+        """the mtime of reldir in each root, None where it is missing, or
+        False if it may still change without its mtime moving"""
+        mtimes = []
+        now = time.time_ns()
+        for root in self.roots:
+            try:
+                mtime = os.stat(os.path.join(root, reldir)).st_mtime_ns
+            except OSError:
+                mtime = None
+            else:
+                # within the mtime resolution of the filesystem, a dir may
+                # change again without its mtime moving
+                if now - mtime < 2 * 10 ** 9:
+                    return False
+            mtimes.append(mtime)
+        return tuple(mtimes)
+
+    def is_current(self, reldir):
+        cached = self.dirs.get(reldir)
+        return cached is not None and cached[0] and (
+            self.mtimes(reldir) == cached[0])
+
+    def listing(self, reldir):
+        mtimes = self.mtimes(reldir)
+        cached = self.dirs.get(reldir)
+        if mtimes and cached is not None and mtimes == cached[0]:
+            return cached
+        entries = {}
+        for i, root in enumerate(self.roots):
+            if mtimes and mtimes[i] is None:
+                continue
+            try:
+                scan = os.scandir(os.path.join(root, reldir))
+            except OSError:
+                continue
+            with scan:
+                for entry in scan:
+                    try:
+                        is_dir = entry.is_dir()
+                    except OSError:
+                        is_dir = False
+                    key = os.path.normcase(entry.name)
+                    name, _, dir_root = entries.get(key,
+                                                    (entry.name, None, None))
+                    entries[key] = name, root, root if is_dir else dir_root
+        names = sorted(name for name, _, _ in entries.values())
+        self.dirs[reldir] = mtimes, entries, names
+        return self.dirs[reldir]
+
+    def glob(self, glob, reverse=False):
+        """the paths matching glob (as in pathlib.Path.glob), sorted by
+        their path relative to the roots"""
+        cached = self.globs.get((glob, reverse))
+        if cached is not None and all(map(self.is_current, cached[0])):
+            return list(cached[1])
+        parts = pathlib.PurePath(glob).parts
+        i = 0
+        while i < len(parts) - 1 and not has_magic(parts[i]):
+            i += 1
+        results = {}
+        seen = []
+        self._match(pathlib.PurePath(*parts[:i]), parts[i:], results, seen)
+        paths = [results[k] for k in sorted(results, reverse=reverse)]
+        self.globs[glob, reverse] = seen, paths
+        return list(paths)
+
+    def _match(self, reldir, parts, results, seen):
+        seen.append(str(reldir))
+        _, entries, names = self.listing(str(reldir))
+        part, rest = parts[0], parts[1:]
+        if part == '**':
+            if rest:
+                self._match(reldir, rest, results, seen)
+            elif not reldir.parts:
+                results[()] = self.roots[-1]
+            elif reldir.parts not in results:
+                # the dir the glob starts from, which is in its parent's
+                # listing (deeper ones are added as they are found below)
+                seen.append(str(reldir.parent))
+                _, parent_entries, _ = self.listing(str(reldir.parent))
+                _, _, dir_root = parent_entries.get(
+                    os.path.normcase(reldir.name), (None, None, None))
+                if dir_root is not None:
+                    results[reldir.parts] = dir_root / reldir
+            for name in names:
+                _, _, dir_root = entries[os.path.normcase(name)]
+                if dir_root is not None:
+                    if not rest:
+                        # pathlib yields only directories for a trailing **,
+                        # so a file of the same path in a later root doesn't
+                        # hide one
+                        results[(reldir / name).parts] = (
+                            dir_root / reldir / name)
+                    self._match(reldir / name, parts, results, seen)
+            return
+        if has_magic(part):
+            keys = [os.path.normcase(name) for name in names
+                    if fnmatch.fnmatch(name, part)]
+        else:
+            keys = [os.path.normcase(part)]
+        for key in keys:
+            if key in entries:
+                name, root, dir_root = entries[key]
+                if not rest:
+                    results[(reldir / name).parts] = root / reldir / name
+                elif dir_root is not None:
+                    self._match(reldir / name, rest, results, seen)
+
+
+_file_indexes = {}
+
+def file_index(basedir, moddirs=()):
+    """the FileIndex of basedir and moddirs, shared by all their lookups"""
+    roots = (pathlib.Path(basedir),) + tuple(map(pathlib.Path, moddirs))
+    try:
+        return _file_indexes[roots]
+    except KeyError:
+        return _file_indexes.setdefault(roots, FileIndex(roots))
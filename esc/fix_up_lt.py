@@ -2,10 +2,7 @@
 
 import collections
 import csv
-import pathlib
 import re
-import shutil
-import tempfile
 import time
 from ck2parser import (rootpath, is_codename, get_province_id_name_map,
                        get_provinces, get_localisation, get_cultures,
@@ -179,18 +176,18 @@ def main():
         if inpath.stem.startswith('b_'):
             historical_baronies.append(inpath.stem)
 
-    with tempfile.TemporaryDirectory() as td:
-        lt_t = pathlib.Path(td)
-        for inpath, tree in full_parser.parse_files(
-            'common/landed_titles/*.txt'):
-            outpath = lt_t / inpath.name
-            update_tree(tree)
-            with outpath.open('w', encoding='cp1252', newline='\r\n') as f:
-                f.write(tree.str(full_parser))
-        while lt.exists():
-            print('Removing old landed_titles...')
-            shutil.rmtree(str(lt), ignore_errors=True)
-        shutil.copytree(str(lt_t), str(lt))
+    # every tree is updated before any file is written, so that an error
+    # leaves lt as it was. files which come out the same are left alone, so
+    # the parse caches of the mod stay valid for them
+    items = []
+    for inpath, tree in full_parser.parse_files('common/landed_titles/*.txt'):
+        update_tree(tree)
+        items.append((tree, lt / inpath.name))
+    written, unchanged = full_parser.write_all(items, skip_unchanged=True)
+    print('landed_titles: {} files written, {} unchanged'.format(written,
+                                                                 unchanged))
+    for path in full_parser.remove_stale(lt, {path for _, path in items}):
+        print('Removing {}...'.format(path.name))
 
 if __name__ == '__main__':
     main()
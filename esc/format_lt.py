@@ -1,8 +1,5 @@
 #!/usr/bin/env python3
 
-import pathlib
-import shutil
-import tempfile
 import ck2parser
 import print_time
 
@@ -20,7 +17,6 @@ def main():
     modpath = ck2parser.rootpath / 'EMF/EMF+Vanilla'
     simple_parser.moddirs = [modpath]
     full_parser.moddirs = [modpath]
-    full_parser.crlf = False
     out = modpath / 'common/landed_titles'
     # simple_parser.diskcache_default = False
     # full_parser.diskcache_default = False
@@ -43,16 +39,15 @@ def main():
                         raise
                 update_tree(v)
 
-    with tempfile.TemporaryDirectory() as td:
-        temp = pathlib.Path(td)
-        for inpath, tree in full_parser.parse_files('common/landed_titles/*.txt'):
-            outpath = temp / inpath.name
-            update_tree(tree)
-            with outpath.open('w', encoding='cp1252', newline='\r\n') as f:
-                f.write(tree.str(full_parser))
-        while out.exists():
-            shutil.rmtree(str(out), ignore_errors=True)
-        shutil.copytree(str(temp), str(out))
+    # every tree is updated before any file is written, so that an error
+    # leaves out as it was. files which come out the same are left alone, so
+    # the parse caches of the mod stay valid for them
+    items = []
+    for inpath, tree in full_parser.parse_files('common/landed_titles/*.txt'):
+        update_tree(tree)
+        items.append((tree, out / inpath.name))
+    full_parser.write_all(items, skip_unchanged=True)
+    full_parser.remove_stale(out, {path for _, path in items})
 
 if __name__ == '__main__':
     main()
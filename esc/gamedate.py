@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+
+# dates of the games' calendar (12 months, 365 days a year, no leap years) as
+# plain ints counting days, so that comparing, sorting and hashing them, and
+# the day arithmetic of history checks, are int operations.
+#
+# GameDate(1066, 9, 15) or GameDate.parse('1066.9.15') is a date; day 0 is
+# 0.1.1. date + days and date - days are dates, date - date is a number of
+# days. days and months past the end of their month or year run on into the
+# next ones.
+
+import bisect
+import functools
+
+days_in_month = [None, 31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31]
+
+# days in the year before each month, and the days of the year
+_month_starts = [0]
+for _days in days_in_month[1:]:
+    _month_starts.append(_month_starts[-1] + _days)
+DAYS_IN_YEAR = _month_starts.pop()
+
+
+@functools.lru_cache(maxsize=None)
+def ordinal(year, month, day):
+    """the day number of year.month.day"""
+    years, month = divmod(month - 1, 12)
+    return (year + years) * DAYS_IN_YEAR + _month_starts[month] + day - 1
+
+
+class GameDate(int):
+    __slots__ = ()
+
+    def __new__(cls, *args):
+        """GameDate(year, month, day) or GameDate(day number)"""
+        if len(args) == 3:
+            return super().__new__(cls, ordinal(*args))
+        return super().__new__(cls, *args)
+
+    @classmethod
+    def parse(cls, string):
+        """the date of a 'y.m.d' string"""
+        return _parse(cls, string)
+
+    @property
+    def ymd(self):
+        """(year, month, day)"""
+        year, day = divmod(int(self), DAYS_IN_YEAR)
+        month = bisect.bisect_right(_month_starts, day)
+        return year, month, day - _month_starts[month - 1] + 1
+
+    @property
+    def year(self):
+        return int(self) // DAYS_IN_YEAR
+
+    @property
+    def day_of_year(self):
+        """1 for 1 January"""
+        return int(self) % DAYS_IN_YEAR + 1
+
+    def __add__(self, days):
+        return type(self)(int(self) + days)
+
+    __radd__ = __add__
+
+    def __sub__(self, other):
+        if isinstance(other, GameDate):
+            return int(self) - int(other)
+        return type(self)(int(self) - other)
+
+    def __repr__(self):
+        if self is GameDate.EARLIEST or self is GameDate.LATEST:
+            return 'GameDate.{}'.format(
+                'EARLIEST' if self is GameDate.EARLIEST else 'LATEST')
+        return 'GameDate({}, {}, {})'.format(*self.ymd)
+
+    def __str__(self):
+        return '{}.{}.{}'.format(*self.ymd)
+
+    def __format__(self, spec):
+        return format(str(self), spec)
+
+
+@functools.lru_cache(maxsize=None)
+def _parse(cls, string):
+    year, month, day = ((int(x) if x else 0) for x in string.split('.'))
+    return cls(year, month, day)
+
+# before and after any date of the games
+GameDate.EARLIEST = GameDate(-(1 << 62))
+GameDate.LATEST = GameDate(1 << 62)
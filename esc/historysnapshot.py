@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+
+# the history of all the titles (or characters) of a mod as columnar numpy
+# arrays, for reading who held what, or any other attribute, at many dates
+# at once.
+
+import numpy as np
+import ck2parser
+import gamedate
+from gamedate import GameDate
+
+# dates are their GameDate day numbers, offset into 32 bits so that they
+# can share an int64 with the subject
+_DATE_OFFSET = 1 << 30
+_UNDATED = 0
+
+def date_ordinal(date):
+    """the packed form of a (year, month, day) tuple, Date or GameDate, or
+    of () for undated changes, which sorts before all dates"""
+    if isinstance(date, GameDate):
+        return int(date) + _DATE_OFFSET
+    val = getattr(date, 'val', date)
+    if not val:
+        return _UNDATED
+    return gamedate.ordinal(*val) + _DATE_OFFSET
+
+def ordinal_date(ordinal):
+    """the (year, month, day) tuple of a packed date, or () if undated"""
+    if ordinal == _UNDATED:
+        return ()
+    return GameDate(ordinal - _DATE_OFFSET).ymd
+
+def value_text(node):
+    val = node.val
+    if isinstance(val, str):
+        return val
+    if isinstance(val, tuple):
+        return '{}.{}.{}'.format(*val)
+    return str(val)
+
+
+class HistorySnapshot:
+    """the changes to some attributes in the histories of the files matching
+    glob, as sorted columns of subject, date and value id per attribute
+
+    with by_file (as in ck2 history/titles), each file is the history of the
+    subject named by its stem, otherwise (as in ck2 history/characters and
+    ck3 history/titles) each top level block is the history of the subject
+    named by its key. the changes of each history are taken in the order
+    its Timeline (from the parser's module) applies them, so the last
+    change up to a date is its value then, like with at_time. values which
+    are blocks (e.g. death = { ... }) are read as ''."""
+
+    def __init__(self, parser, glob='history/titles/*.txt',
+                 attributes=('holder', 'liege'), by_file=True,
+                 timeline=ck2parser.Timeline):
+        self.attributes = list(attributes)
+        attribute_ids = {a: i for i, a in enumerate(self.attributes)}
+        self.subjects = []
+        self.subject_ids = {}
+        self.values = []
+        value_ids = {}
+        columns = subject_col, attribute_col, date_col, value_col = (
+            [], [], [], [])
+        for path, tree in parser.parse_files(glob):
+            if by_file:
+                histories = [(path.stem, tree)]
+            else:
+                histories = [(value_text(n), v) for n, v in tree
+                             if hasattr(v, 'contents')]
+            for name, history in histories:
+                subject = self.subject_ids.setdefault(name,
+                                                      len(self.subjects))
+                if subject == len(self.subjects):
+                    self.subjects.append(name)
+                history = timeline(history)
+                for date, pair in zip(history.dates, history.pairs):
+                    attribute = attribute_ids.get(pair.key.val)
+                    if attribute is None:
+                        continue
+                    # a block still changes the attribute
+                    if hasattr(pair.value, 'contents'):
+                        text = ''
+                    else:
+                        text = value_text(pair.value)
+                    value = value_ids.setdefault(text, len(self.values))
+                    if value == len(self.values):
+                        self.values.append(text)
+                    subject_col.append(subject)
+                    attribute_col.append(attribute)
+                    date_col.append(date_ordinal(date))
+                    value_col.append(value)
+        subject_col, attribute_col, date_col, value_col = (
+            np.array(col, dtype) for col, dtype in
+            zip(columns, (np.int64, np.int8, np.int64, np.int32)))
+        # lexsort is stable, so changes of the same date stay in order
+        order = np.lexsort((date_col, subject_col, attribute_col))
+        # per attribute, subject << 32 | date, sorted, and the value ids
+        self.keys = {}
+        self.value_ids = {}
+        for i, attribute in enumerate(self.attributes):
+            rows = order[attribute_col[order] == i]
+            self.keys[attribute] = subject_col[rows] << 32 | date_col[rows]
+            self.value_ids[attribute] = value_col[rows]
+
+    def __len__(self):
+        return sum(len(keys) for keys in self.keys.values())
+
+    def ids_at(self, attribute, dates, subjects=None):
+        """the value ids of attribute for each subject (by default all) at
+        each of dates, as an array of shape (dates, subjects), with -1
+        where it was not set yet"""
+        if subjects is None:
+            subjects = np.arange(len(self.subjects), dtype=np.int64)
+        else:
+            subjects = np.asarray(subjects, np.int64)
+        ordinals = np.array([date_ordinal(date) for date in dates], np.int64)
+        keys = self.keys[attribute]
+        queries = subjects[np.newaxis, :] << 32 | ordinals[:, np.newaxis]
+        rows = np.searchsorted(keys, queries, side='right') - 1
+        found = rows >= 0
+        rows[~found] = 0
+        if len(keys):
+            found &= keys[rows] >> 32 == subjects[np.newaxis, :]
+            ids = self.value_ids[attribute][rows]
+        else:
+            ids = np.zeros(rows.shape, np.int32)
+        return np.where(found, ids, -1)
+
+    def at(self, attribute, date):
+        """{subject: value} of attribute at date, of the subjects for which
+        it was set by then"""
+        return self.at_dates(attribute, [date])[0]
+
+    def at_dates(self, attribute, dates):
+        """at for each of dates"""
+        values = self.values
+        result = []
+        for ids in self.ids_at(attribute, dates):
+            subjects = np.nonzero(ids >= 0)[0]
+            result.append({self.subjects[s]: values[ids[s]]
+                           for s in subjects.tolist()})
+        return result
+
+    def value_at(self, subject, attribute, date, default=None):
+        """the value of attribute of one subject at date, or default"""
+        value_id = self.ids_at(attribute, [date],
+                               [self.subject_ids[subject]])[0, 0]
+        return default if value_id < 0 else self.values[value_id]
+
+    def changes(self, attribute, start=(), end=None):
+        """(subject, date, value) of the changes of attribute after start,
+        up to and including end (by default, all dated ones), in order of
+        subject and date"""
+        keys = self.keys[attribute]
+        dates = keys & 0xffffffff
+        mask = dates > date_ordinal(start)
+        if end is not None:
+            mask &= dates <= date_ordinal(end)
+        rows = np.nonzero(mask)[0]
+        subjects = (keys[rows] >> 32).tolist()
+        value_ids = self.value_ids[attribute][rows].tolist()
+        return [(self.subjects[s], ordinal_date(d), self.values[v])
+                for s, d, v in zip(subjects, dates[rows].tolist(),
+                                   value_ids)]
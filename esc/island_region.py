@@ -7,7 +7,8 @@ import networkx as nx
 import numpy as np
 from PIL import Image
 from ck2parser import (rootpath, csv_rows, SimpleParser, is_codename, Pair,
-                       Number, TopLevel, FullParser)
+                       Number, TopLevel, FullParser, province_adjacencies,
+                       province_id_raster)
 from print_time import print_time
 
 
@@ -42,15 +43,14 @@ def main():
             county_id_map[county] = prov_id
     province_graph = nx.Graph()
     provinces_path = parser.file('map/' + default_tree['provinces'].val)
-    a = np.array(Image.open(str(provinces_path)))
-    for i, j in np.ndindex(a.shape[0] - 1, a.shape[1] - 1):
-        province = rgb_id_map.get(tuple(a[i, j]))
-        if province in id_county_map:
-            province_graph.add_node(province)
-            for coords in ((i, j + 1), (i + 1, j)):
-                neighbor = rgb_id_map.get(tuple(a[coords]))
-                if neighbor != province and neighbor in id_county_map:
-                    province_graph.add_edge(province, neighbor)
+    ids, _ = province_id_raster(np.array(Image.open(str(provinces_path))),
+                                rgb_id_map)
+    province_graph.add_nodes_from(province for province in
+                                  np.unique(ids).tolist()
+                                  if province in id_county_map)
+    province_graph.add_edges_from(
+        (one, two) for one, two in province_adjacencies(ids).tolist()
+        if one in id_county_map and two in id_county_map)
     for row in csv_rows(parser.file('map/' + default_tree['adjacencies'].val)):
         try:
             one, two = int(row[0]), int(row[1])
@@ -6,8 +6,8 @@ import pathlib
 import re
 import shutil
 import tempfile
-from ck2parser import (rootpath, vanilladir, csv_rows, files, is_codename,
-                       get_cultures, get_localisation, SimpleParser)
+from ck2parser import (rootpath, vanilladir, is_codename, get_cultures,
+                       localisation, SimpleParser)
 from print_time import print_time
 
 modpath = rootpath / 'SWMH-BETA/SWMH'
@@ -20,18 +20,16 @@ def abbrev_path(path):
 def get_locs(where):
     locs = collections.OrderedDict()
     dupe_lines = []
-    for path in files('localisation/*.csv', where):
-        vanilla = modpath not in path.parents
-        for row, linenum in csv_rows(path, linenum=True):
-            if row[0] in locs:
-                # don't care about overriding vanilla
-                if not vanilla:
-                    line = ('{0!r} localisation at {1[1]!r}:{1[2]} '
-                        'overrides {2!r}:{3}\n'.format(row[0],
-                        locs[row[0]], abbrev_path(path), linenum))
-                    dupe_lines.append(line)
-            else:
-                locs[row[0]] = row[1], abbrev_path(path), linenum
+    for key, value, path, linenum in localisation(where).rows():
+        if key in locs:
+            # don't care about overriding vanilla
+            if modpath in path.parents:
+                line = ('{0!r} localisation at {1[1]!r}:{1[2]} '
+                    'overrides {2!r}:{3}\n'.format(key,
+                    locs[key], abbrev_path(path), linenum))
+                dupe_lines.append(line)
+        else:
+            locs[key] = value, abbrev_path(path), linenum
     locs = collections.OrderedDict((k, v[0]) for k, v in locs.items())
     return locs, dupe_lines
 
@@ -66,7 +64,7 @@ def main():
     # province_title.update(province_title_mod)
     cultures, cult_group = get_cultures(parser)
     mod_loc, dupe_lines = get_locs(parser.moddirs)
-    vanilla_loc = get_localisation()
+    vanilla_loc = localisation()
     # localisation = vanilla_loc.copy()
     # localisation.update(mod_loc)
     dynamics, undef = scan_landed_titles(parser, cultures, mod_loc)
@@ -0,0 +1,333 @@
+#!/usr/bin/env python3
+
+# localisation tables kept on disk and read through mmap, so that looking up
+# a key doesn't mean reading every localisation file.
+#
+# each source file is parsed once into a table named by the hash of its bytes
+# (and the format and language it is read as). the tables of the files of a
+# base dir and its mod dirs are merged into one table with each key once,
+# named by the hashes of the file tables, so only the files which changed
+# are parsed again and only their merge is redone.
+#
+# a table is touched whenever it is used, so prune (run by cachestore.py
+# prune) can drop those which weren't used for max_age days.
+
+import array
+import collections.abc
+import csv
+import hashlib
+import io
+import mmap
+import os
+import re
+import struct
+import time
+from localpaths import cachedir
+
+VERSION = 1
+
+# where the tables are kept
+locdir = cachedir / 'loc'
+
+# the column of each language in the ck2 csv files
+csv_columns = {'english': 1, 'french': 2, 'german': 3, 'spanish': 5}
+
+_yml_line = re.compile(r'\s*([^#\s:]+):\d?\s*"(.*)"[^"]*').fullmatch
+
+# magic, version, number of rows
+_header = struct.Struct('<4sII')
+# per row: key start, key end, value start, value end, line, file number
+_row_width = 6
+
+# days after their last use that prune drops tables
+PRUNE_AGE = 30
+
+# the mtime, size and hash of each source file, while they stay the same
+_digests = {}
+
+
+def csv_entries(data, language='english'):
+    """(key, value, line) for each row of a ck2 csv file, as csv_rows reads
+    them, with the value in the column of language"""
+    column = csv_columns[language]
+    text = data.decode('cp1252', errors='replace')
+    reader = csv.reader(io.StringIO(text, newline=''), delimiter=';',
+                        doublequote=False, quotechar='\0',
+                        quoting=csv.QUOTE_NONE, strict=True)
+    for i, row in enumerate(reader):
+        if (row and row[0] and not row[0].startswith('#') and
+                len(row) > column):
+            yield row[0], row[column], i + 1
+
+def yml_entries(data):
+    """(key, value, line) for each localisation line of a yml file"""
+    text = data.decode('utf-8-sig')
+    lines = text.replace('\r\n', '\n').replace('\r', '\n').split('\n')
+    for i, line in enumerate(lines):
+        match = _yml_line(line)
+        if match:
+            yield match.group(1), match.group(2), i + 1
+
+def write_table(path, entries):
+    """write (key, value, line, file number) entries to path as a table,
+    in the order given"""
+    rows = array.array('I')
+    blob = bytearray()
+    keys = []
+    for key, value, line, fileno in entries:
+        key = key.encode()
+        keys.append(key)
+        key_start = len(blob)
+        blob += key
+        value_start = len(blob)
+        blob += value.encode()
+        rows.extend((key_start, value_start, value_start, len(blob), line,
+                     fileno))
+    # stable, so equal keys stay in file order
+    order = array.array('I', sorted(range(len(keys)), key=keys.__getitem__))
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = path.with_name(path.name + '.{}.tmp'.format(os.getpid()))
+    with temp_path.open('wb') as f:
+        f.write(_header.pack(b'LOCT', VERSION, len(keys)))
+        f.write(rows.tobytes())
+        f.write(order.tobytes())
+        f.write(blob)
+    os.replace(str(temp_path), str(path))
+
+
+class LocTable:
+    """a table written by write_table, read in place through mmap"""
+
+    def __init__(self, path):
+        with open(str(path), 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.n = _header.unpack_from(self.mm)
+        if magic != b'LOCT' or version != VERSION:
+            raise ValueError('not a localisation table: {}'.format(path))
+        start = _header.size
+        end = start + 4 * _row_width * self.n
+        self.rows = memoryview(self.mm)[start:end].cast('I')
+        self.order = memoryview(self.mm)[end:end + 4 * self.n].cast('I')
+        self.blob_start = end + 4 * self.n
+
+    def __len__(self):
+        return self.n
+
+    def key(self, i):
+        i *= _row_width
+        start = self.blob_start
+        return self.mm[start + self.rows[i]:
+                       start + self.rows[i + 1]].decode()
+
+    def value(self, i):
+        i *= _row_width
+        start = self.blob_start
+        return self.mm[start + self.rows[i + 2]:
+                       start + self.rows[i + 3]].decode()
+
+    def source(self, i):
+        """(line, file number) of row i"""
+        i *= _row_width
+        return self.rows[i + 4], self.rows[i + 5]
+
+    def find(self, key):
+        """the row of the first occurrence of key, or None"""
+        key = key.encode()
+        mm, rows, order = self.mm, self.rows, self.order
+        start = self.blob_start
+        lo, hi = 0, self.n
+        while lo < hi:
+            mid = (lo + hi) // 2
+            i = order[mid] * _row_width
+            if mm[start + rows[i]:start + rows[i + 1]] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.n:
+            i = order[lo]
+            j = i * _row_width
+            if mm[start + rows[j]:start + rows[j + 1]] == key:
+                return i
+        return None
+
+    def entries(self):
+        """(key, value, line, file number) of each row, in order"""
+        mm, rows, start = self.mm, self.rows, self.blob_start
+        for i in range(0, self.n * _row_width, _row_width):
+            key_start, key_end, value_start, value_end, line, fileno = (
+                rows[i:i + _row_width])
+            yield (mm[start + key_start:start + key_end].decode(),
+                   mm[start + value_start:start + value_end].decode(),
+                   line, fileno)
+
+    def close(self):
+        self.rows.release()
+        self.order.release()
+        self.mm.close()
+
+
+def file_digest(path, salt):
+    """hash of salt and the bytes of path, remembered until the file's size
+    or mtime changes"""
+    stat = path.stat()
+    try:
+        mtime, size, digest = _digests[path, salt]
+        if mtime == stat.st_mtime_ns and size == stat.st_size:
+            return digest
+    except KeyError:
+        pass
+    m = hashlib.blake2b(salt.encode(), digest_size=16)
+    with path.open('rb') as f:
+        m.update(f.read())
+    digest = m.hexdigest()
+    _digests[path, salt] = stat.st_mtime_ns, stat.st_size, digest
+    return digest
+
+def table_digest(path, language='english'):
+    """the hash the table of a .csv or .yml file is named by"""
+    if path.suffix.lower() == '.csv':
+        return file_digest(path, '{} csv {}'.format(VERSION, language))
+    return file_digest(path, '{} yml'.format(VERSION))
+
+def touch(path):
+    """mark the table at path as used, returning whether it exists"""
+    try:
+        os.utime(str(path))
+    except FileNotFoundError:
+        return False
+    return True
+
+def file_table(path, language='english'):
+    """the LocTable of a .csv or .yml file, parsed only if no table of the
+    same bytes is on disk yet"""
+    digest = table_digest(path, language)
+    table_path = locdir / digest[:2] / digest
+    if not touch(table_path):
+        data = path.read_bytes()
+        if path.suffix.lower() == '.csv':
+            rows = csv_entries(data, language)
+        else:
+            rows = yml_entries(data)
+        write_table(table_path, ((k, v, l, 0) for k, v, l in rows))
+    return LocTable(table_path)
+
+
+class Localisation(collections.abc.Mapping):
+    """the localisation of some files in one language, as a read-only
+    mapping from key to string
+
+    paths are in the order the games read them. with first_wins (as in
+    ck2), a key gets the string of its first occurrence, otherwise (as in
+    the yml files of ck3 and eu4) that of its last. the tables are only
+    looked up on first use."""
+
+    def __init__(self, paths, language='english', first_wins=True):
+        self.paths = list(paths)
+        self.language = language
+        self.first_wins = first_wins
+        self._table = None
+
+    @property
+    def table(self):
+        """the merged table, with each key once"""
+        if self._table is None:
+            m = hashlib.blake2b(digest_size=16)
+            m.update('{} {}'.format(VERSION, self.first_wins).encode())
+            digests = [table_digest(path, self.language)
+                       for path in self.paths]
+            for digest in digests:
+                m.update(b' ' + digest.encode())
+            digest = m.hexdigest()
+            table_path = locdir / 'merged' / digest
+            if touch(table_path):
+                # the file tables are kept as long as their merge, so a
+                # change to one file doesn't mean parsing all of them again
+                for digest in digests:
+                    touch(locdir / digest[:2] / digest)
+            else:
+                merged = {}
+                for fileno, path in enumerate(self.paths):
+                    table = file_table(path, self.language)
+                    for key, value, line, _ in table.entries():
+                        if not self.first_wins or key not in merged:
+                            merged[key] = value, line, fileno
+                    table.close()
+                write_table(table_path, ((k, v, l, n) for k, (v, l, n)
+                                         in merged.items()))
+            self._table = LocTable(table_path)
+        return self._table
+
+    def __getitem__(self, key):
+        i = self.table.find(key)
+        if i is None:
+            raise KeyError(key)
+        return self.table.value(i)
+
+    def __contains__(self, key):
+        return self.table.find(key) is not None
+
+    def __len__(self):
+        return len(self.table)
+
+    def __iter__(self):
+        table = self.table
+        return (table.key(i) for i in range(len(table)))
+
+    def items(self):
+        return ((k, v) for k, v, _, _ in self.table.entries())
+
+    def localize(self, key, default=None):
+        """the string of key, or default, or the key itself if default is
+        None"""
+        i = self.table.find(key)
+        if i is None:
+            return key if default is None else default
+        return self.table.value(i)
+
+    def localize_all(self, keys):
+        """{key: string} of those of keys which are localised, looked up in
+        the order of the table so the pages of the map are read in order"""
+        keys = sorted(set(keys), key=str.encode)
+        table = self.table
+        found = {}
+        for key in keys:
+            i = table.find(key)
+            if i is not None:
+                found[key] = table.value(i)
+        return found
+
+    def source(self, key):
+        """(path, line) of the string key gets"""
+        i = self.table.find(key)
+        if i is None:
+            raise KeyError(key)
+        line, fileno = self.table.source(i)
+        return self.paths[fileno], line
+
+    def rows(self):
+        """(key, value, path, line) of every localisation row of every file,
+        duplicates included, in the order the files are read"""
+        for path in self.paths:
+            table = file_table(path, self.language)
+            for key, value, line, _ in table.entries():
+                yield key, value, path, line
+            table.close()
+
+
+def prune(max_age=PRUNE_AGE):
+    """drop the tables (and the leftovers of interrupted writes) not used
+    for max_age days, returning how many were dropped and their size"""
+    cutoff = time.time() - max_age * 86400
+    count = size = 0
+    if not locdir.exists():
+        return count, size
+    for subdir in locdir.iterdir():
+        if not subdir.is_dir():
+            continue
+        for path in subdir.iterdir():
+            stat = path.stat()
+            if stat.st_mtime < cutoff:
+                path.unlink()
+                count += 1
+                size += stat.st_size
+    return count, size
@@ -2,7 +2,7 @@
 
 import numpy as np
 from PIL import Image
-from ck2parser import rootpath, csv_rows, SimpleParser
+from ck2parser import rootpath, csv_rows, SimpleParser, province_id_raster
 from localpaths import eu4dir
 
 parser = SimpleParser()
@@ -40,6 +40,11 @@ def run3(): # 4.15
     a = np.vectorize(lambda x: provinces_rgb_map[tuple(x)],
                      otypes=[np.uint16])(a)
 
+def run3b():
+    im = Image.open(provinces_path)
+    a = np.array(im)[:512, :512]
+    a, _ = province_id_raster(a, provinces_rgb_map)
+
 def run4(): # ~33.5
     im = Image.open(provinces_path)
     a = np.array(im).view('u1,u1,u1')[:512, :512, 0]
@@ -62,3 +67,9 @@ def run6(): # ~15.1
                       otypes=[np.uint16])(pa)
     for number in range(1, max_provinces):
         prov_indices = np.nonzero(pa == number)
+
+def run7():
+    im = Image.open(provinces_path)
+    pa, _ = province_id_raster(np.array(im)[:512, :512], provinces_rgb_map)
+    for number in range(1, max_provinces):
+        prov_indices = np.nonzero(pa == number)
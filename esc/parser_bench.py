@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+
+# usage: parser_bench.py [mode] [glob ...]
+# globs are relative to vanilladir; run with no arguments to benchmark the
+# parser engines over the same files as libck2's simplebench. engine times
+# include reading and decoding each file, which the mmap engine does itself.
+# the memory mode measures the trees of all of history/ instead, from each
+# engine and as lean trees. the init mode takes module:class arguments instead
+# of globs, and times importing the module and creating parsers from it, each
+# in a new interpreter. the write mode times writing out the trees of
+# history/titles/ as FullParser and SimpleParser do for a rewrite. the history
+# mode takes games (ck2, ck3) instead of globs, and times reading the holder
+# and liege of every title at every bookmark date, history by history and from
+# a HistorySnapshot. the repo mode takes git repositories (by default, the one
+# this script is in) instead of globs, and checks that the latest commit map
+# read_repo keeps up to date matches one rebuilt from scratch.
+
+import gc
+import pathlib
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from ck2parser import (SimpleParser, FullParser, Pair, Obj, String,
+                       LeanString)
+from historysnapshot import HistorySnapshot, value_text
+import cachestore
+from print_time import print_time
+
+default_globs = ['common/*/*.txt', 'history/*/*.txt', 'decisions/*.txt',
+                 'events/*.txt']
+
+def read_paths(parser, globs):
+    return [path for glob in globs for path in parser.files(glob)
+            if path.is_file()]
+
+def bench_engines(globs):
+    parsers = {}
+    for engine in SimpleParser.engines:
+        parsers[engine] = SimpleParser(engine=engine)
+        parsers[engine].ignore_cache = True
+    paths = read_paths(parsers['funcparserlib'], globs)
+    size = sum(path.stat().st_size for path in paths)
+    print('{} files, {:.1f} MB'.format(len(paths), size / 2 ** 20))
+    outputs = {}
+    times = {}
+    for engine, parser in parsers.items():
+        times[engine] = 0
+        outputs[engine] = []
+        for path in paths:
+            start_time = time.perf_counter()
+            tree = parser.parse_file(path)
+            times[engine] += time.perf_counter() - start_time
+            outputs[engine].append(tree.str(parser))
+    for engine, elapsed in times.items():
+        print('{:>14}: {:8.3f} s {:8.2f} MB/s {:6.2f}x'.format(
+              engine, elapsed, size / 2 ** 20 / elapsed,
+              times['funcparserlib'] / elapsed))
+    mismatches = 0
+    for engine, strs in outputs.items():
+        for path, s, s_ref in zip(paths, strs, outputs['funcparserlib']):
+            if s != s_ref:
+                print('round-trip mismatch ({}): {}'.format(engine, path))
+                mismatches += 1
+    print('{} round-trip mismatches'.format(mismatches))
+
+def count_nodes(tree):
+    nodes = strings = 0
+    string_vals = set()
+    stack = [tree]
+    while stack:
+        for item in stack.pop():
+            for node in (item.key, item.op, item.value) if isinstance(
+                    item, Pair) else (item,):
+                nodes += 1
+                if isinstance(node, Obj):
+                    nodes += 2
+                    stack.append(node)
+                elif isinstance(node, (String, LeanString)):
+                    strings += 1
+                    string_vals.add(id(node.val))
+    return nodes, strings, string_vals
+
+def bench_memory(globs):
+    paths = None
+    variants = ([(engine, False) for engine in SimpleParser.engines] +
+                [(engine, True) for engine in SimpleParser.lean_engines])
+    for engine, lean in variants:
+        parser = SimpleParser(engine=engine, lean=lean)
+        parser.ignore_cache = True
+        if paths is None:
+            paths = read_paths(parser, globs)
+            size = sum(path.stat().st_size for path in paths)
+            print('{} files, {:.1f} MB'.format(len(paths), size / 2 ** 20))
+        gc.collect()
+        tracemalloc.start()
+        trees = [parser.parse_file(path) for path in paths]
+        held, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        # counted after measuring, as it builds any lazy containers
+        nodes = strings = 0
+        string_vals = set()
+        for tree in trees:
+            tree_nodes, tree_strings, tree_vals = count_nodes(tree)
+            nodes += tree_nodes
+            strings += tree_strings
+            string_vals |= tree_vals
+        print('{:>18}: {:8.2f} MB held {:8.2f} MB peak {:6.1f} B/node '
+              '{} strings, {} distinct objects'.format(
+              engine + (' lean' if lean else ''), held / 2 ** 20, peak / 2 ** 20, held / nodes, strings,
+              len(string_vals)))
+        del trees
+
+def bench_write(globs):
+    for cls in (FullParser, SimpleParser):
+        parser = cls()
+        parser.ignore_cache = True
+        paths = read_paths(parser, globs)
+        trees = [parser.parse_file(path) for path in paths]
+        start_time = time.perf_counter()
+        strs = [tree.str(parser) for tree in trees]
+        elapsed = time.perf_counter() - start_time
+        size = sum(len(s) for s in strs)
+        # the output must read back as the same trees
+        unstable = sum(parser.parse(s).str(parser) != s for s in strs)
+        print('{:>14}: {} files, {:.1f} MB in {:8.3f} s {:8.2f} MB/s, '
+              '{} unstable'.format(cls.__name__, len(paths), size / 2 ** 20,
+                                   elapsed, size / 2 ** 20 / elapsed,
+                                   unstable))
+
+# bookmarks of the base games, for when common/bookmarks can't be read
+default_bookmarks = {
+    'ck2': [(769, 1, 1), (867, 1, 1), (1066, 9, 15), (1337, 1, 1)],
+    'ck3': [(867, 1, 1), (1066, 9, 15), (1178, 10, 1)],
+}
+
+def bookmark_dates(parser, game):
+    dates = set()
+    for _, tree in parser.parse_files('common/bookmarks/**/*.txt'):
+        for _, v in tree:
+            if hasattr(v, 'contents'):
+                for n2, v2 in v:
+                    if n2.val in ('date', 'start_date') and isinstance(
+                            v2.val, tuple):
+                        dates.add(v2.val)
+    return sorted(dates) or default_bookmarks[game]
+
+def bench_history(games):
+    attributes = ['holder', 'liege']
+    for game in games:
+        if game == 'ck3':
+            import ck3parser as module
+            # ck3 title histories are blocks in files of many titles
+            by_file = False
+        else:
+            import ck2parser as module
+            by_file = True
+        parser = module.SimpleParser()
+        dates = bookmark_dates(parser, game)
+        glob = 'history/titles/*.txt'
+        start_time = time.perf_counter()
+        trees = list(parser.parse_files(glob))
+        expected = [{a: {} for a in attributes} for _ in dates]
+        for path, tree in trees:
+            if by_file:
+                histories = [(path.stem, tree)]
+            else:
+                histories = [(value_text(n), v) for n, v in tree
+                             if hasattr(v, 'contents')]
+            for date, by_attribute in zip(dates, expected):
+                for name, history in histories:
+                    timeline = module.Timeline(history)
+                    for attribute in attributes:
+                        pair = timeline.pair_at(attribute, date)
+                        if pair is not None:
+                            by_attribute[attribute][name] = (
+                                '' if hasattr(pair.value, 'contents')
+                                else value_text(pair.value))
+        history_time = time.perf_counter() - start_time
+        start_time = time.perf_counter()
+        snapshot = HistorySnapshot(parser, glob, attributes, by_file,
+                                   module.Timeline)
+        build_time = time.perf_counter() - start_time
+        start_time = time.perf_counter()
+        found = {a: snapshot.at_dates(a, dates) for a in attributes}
+        query_time = time.perf_counter() - start_time
+        mismatches = sum(found[a][i] != by_attribute[a]
+                         for i, by_attribute in enumerate(expected)
+                         for a in attributes)
+        print('{}: {} titles, {} changes, {} dates'.format(
+              game, len(snapshot.subjects), len(snapshot), len(dates)))
+        print('{:>14}: {:8.3f} s'.format('by history', history_time))
+        print('{:>14}: {:8.3f} s build, {:8.3f} s query, {:6.2f}x'.format(
+              'snapshot', build_time, query_time,
+              history_time / (build_time + query_time)))
+        print('{} mismatches'.format(mismatches))
+
+def bench_repo(repo_paths):
+    import git
+    for repo_path in repo_paths:
+        repo = git.Repo(repo_path, search_parent_directories=True)
+        start_time = time.perf_counter()
+        latest_commit, _ = cachestore.read_repo(repo)
+        update_time = time.perf_counter() - start_time
+        indexdir = cachestore.repoindexdir
+        with tempfile.TemporaryDirectory() as tempdir:
+            cachestore.repoindexdir = pathlib.Path(tempdir)
+            try:
+                start_time = time.perf_counter()
+                rebuilt, _ = cachestore.read_repo(repo)
+                rebuild_time = time.perf_counter() - start_time
+            finally:
+                cachestore.repoindexdir = indexdir
+        mismatches = sorted(path for path in latest_commit.keys() | rebuilt
+                            if latest_commit.get(path) != rebuilt.get(path))
+        for path in mismatches:
+            print('{}: {} kept, {} rebuilt'.format(
+                  path, latest_commit.get(path), rebuilt.get(path)))
+        print('{}: {} files, {:8.3f} s kept, {:8.3f} s rebuilt, '
+              '{} mismatches'.format(repo.working_tree_dir, len(rebuilt),
+                                     update_time, rebuild_time,
+                                     len(mismatches)))
+
+init_code = '''
+import sys, time
+module_name, class_name, n = sys.argv[1], sys.argv[2], int(sys.argv[3])
+start_time = time.perf_counter()
+cls = getattr(__import__(module_name, fromlist=[class_name]), class_name)
+import_time = time.perf_counter()
+parsers = [cls()]
+first_time = time.perf_counter()
+parsers.extend(cls() for _ in range(n))
+end_time = time.perf_counter()
+print(import_time - start_time, first_time - import_time,
+      (end_time - first_time) / n)
+'''
+
+def bench_init(targets, n=100):
+    for target in targets:
+        module_name, class_name = target.split(':')
+        # the parsers report their cache stats on stderr as they go
+        result = subprocess.run(
+            [sys.executable, '-c', init_code, module_name, class_name, str(n)],
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+            universal_newlines=True)
+        if result.returncode:
+            print('{:>24}: failed'.format(target))
+            continue
+        import_time, first_time, each_time = map(float, result.stdout.split())
+        print('{:>24}: import {:8.1f} ms, first {:8.3f} ms, then {:8.3f} ms '
+              'each'.format(target, import_time * 1000, first_time * 1000,
+                            each_time * 1000))
+
+modes = {
+    'engines': (bench_engines, default_globs),
+    'memory': (bench_memory, ['history/**/*.txt']),
+    'write': (bench_write, ['history/titles/*.txt']),
+    'history': (bench_history, ['ck2', 'ck3']),
+    'repo': (bench_repo, [str(pathlib.Path(__file__).parent)]),
+    'init': (bench_init, ['ck2parser:SimpleParser', 'ck2parser:FullParser',
+                          'eu4.parser:Eu4Parser']),
+}
+
+@print_time
+def main():
+    args = sys.argv[1:]
+    mode = args.pop(0) if args and args[0] in modes else 'engines'
+    bench, globs = modes[mode]
+    bench(args or globs)
+
+if __name__ == '__main__':
+    main()
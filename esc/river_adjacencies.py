@@ -8,7 +8,8 @@ import sys
 import networkx as nx
 import numpy as np
 from PIL import Image
-from ck2parser import rootpath, csv_rows, SimpleParser
+from ck2parser import (rootpath, csv_rows, SimpleParser, province_adjacencies,
+                       province_id_raster)
 from print_time import print_time
 
 
@@ -43,20 +44,39 @@ def main():
     province_graph = nx.Graph()
     provinces_path = parser.file('map/' + default_tree['provinces'].val)
     a = np.array(Image.open(str(provinces_path)))
-    for i, j in np.ndindex(a.shape[0] - 1, a.shape[1] - 1):
-        province = rgb_id_map.get(tuple(a[i, j]))
-        if province in land_or_river:
-            province_graph.add_node(province)
-            if province in rivers:
-                rivers[province][0].append((i, j))
-            for coords in ((i, j + 1), (i + 1, j)):
-                neighbor = rgb_id_map.get(tuple(a[coords]))
-                if neighbor != province and neighbor in land_or_river:
-                    province_graph.add_edge(province, neighbor)
-                    if province in rivers and neighbor not in rivers:
-                        rivers[province][1].append(coords)
-                    if neighbor in rivers and province not in rivers:
-                        rivers[neighbor][1].append((i, j))
+    ids, _ = province_id_raster(a, rgb_id_map)
+    province_graph.add_nodes_from(province for province in
+                                  np.unique(ids).tolist()
+                                  if province in land_or_river)
+    province_graph.add_edges_from(
+        (one, two) for one, two in province_adjacencies(ids).tolist()
+        if one in land_or_river and two in land_or_river)
+    # the pixels of each river, and the pixels bordering it from land, in
+    # the order of the pixel walk this replaced (row by row, each pixel
+    # before its neighbors to the right and below, minus the last row and
+    # column), which decides ties between equally near border pixels
+    is_river = np.zeros(max(ids.max(), *land_or_river) + 1, bool)
+    is_river[list(rivers)] = True
+    is_land = np.zeros_like(is_river)
+    is_land[list(id_county_map)] = True
+    is_land &= ~is_river
+    walked = ids[:-1, :-1]
+    for i, j in np.transpose(np.nonzero(is_river[walked])).tolist():
+        rivers[ids[i, j]][0].append((i, j))
+    borders = []
+    for di, dj in [(0, 1), (1, 0)]:
+        neighbors = ids[di:ids.shape[0] - 1 + di, dj:ids.shape[1] - 1 + dj]
+        for river_side, land_side, at_neighbor in [(walked, neighbors, True),
+                                                   (neighbors, walked, False)]:
+            i, j = np.nonzero(is_river[river_side] & is_land[land_side])
+            border_i, border_j = (i + di, j + dj) if at_neighbor else (i, j)
+            borders.append(np.stack([i, j, np.full_like(i, di), border_i,
+                                     border_j, river_side[i, j]], axis=1))
+    borders = np.concatenate(borders)
+    borders = borders[np.lexsort((borders[:, 2], borders[:, 1],
+                                  borders[:, 0]))]
+    for *_, border_i, border_j, river in borders.tolist():
+        rivers[river][1].append((border_i, border_j))
     river_adjacencies = defaultdict(set)
     for river, (river_px, border_px) in rivers.items():
         if not river_px:
@@ -65,13 +85,10 @@ def main():
         if not border_px:
             print('WARNING: no border for {}'.format(river))
             continue
+        border_px = np.array(border_px)
         for i0, j0 in river_px:
-            min_item, min_val = None, float('inf')
-            for i1, j1 in border_px:
-                sqdist = (i1 - i0) * (i1 - i0) + (j1 - j0) * (j1 - j0)
-                if sqdist < min_val:
-                    min_val = sqdist
-                    min_item = i1, j1
+            sqdist = ((border_px - (i0, j0)) ** 2).sum(axis=1)
+            min_item = tuple(border_px[sqdist.argmin()])
             px = a[min_item]
             a[i0, j0] = px
             province = rgb_id_map[tuple(px)]
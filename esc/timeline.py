@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+
+# the changes a history (of a title, a character, a province...) makes, in
+# the order the game applies them, for looking up its state at any date.
+# each parser module subclasses Timeline with the node classes of its trees.
+
+import bisect
+from gamedate import GameDate
+
+
+class Timeline:
+    """the changes a history makes, in the order they apply: the undated
+    pairs of the history (a TopLevel or Obj), then those of its dated
+    blocks by date. built once, it gives the state of a key at any number
+    of dates by bisection, without sorting the history again.
+
+    undated changes have the date (), before any other. dates to look up
+    may be (year, month, day) tuples, Dates or GameDates. pair_type,
+    date_types and container_types are the classes of the parser's trees
+    that pairs, dates and blocks are told apart by."""
+
+    def __init__(self, history, pair_type, date_types, container_types):
+        undated = []
+        blocks = []
+        for item in history:
+            if not isinstance(item, pair_type):
+                continue
+            if isinstance(item.key, date_types):
+                if isinstance(item.value, container_types):
+                    blocks.append(item)
+            else:
+                undated.append(item)
+        # stable, so blocks of the same date apply in the order they appear
+        blocks.sort(key=lambda block: block.key.val)
+        self.dates = [()] * len(undated)
+        self.pairs = undated
+        for block in blocks:
+            for pair in block.value:
+                if isinstance(pair, pair_type):
+                    self.dates.append(block.key.val)
+                    self.pairs.append(pair)
+        # key -> (indices into dates and pairs of its changes)
+        self.by_key = {}
+        for i, pair in enumerate(self.pairs):
+            self.by_key.setdefault(pair.key.val, []).append(i)
+
+    def count_until(self, date):
+        """how many changes apply up to and including date"""
+        if isinstance(date, GameDate):
+            date = date.ymd
+        else:
+            date = getattr(date, 'val', date)
+        return bisect.bisect_right(self.dates, date)
+
+    def pairs_until(self, date):
+        return self.pairs[:self.count_until(date)]
+
+    def pair_at(self, key, date):
+        """the last pair setting key up to date, or None"""
+        indices = self.by_key.get(key)
+        if indices:
+            i = bisect.bisect_right(indices, self.count_until(date) - 1)
+            if i:
+                return self.pairs[indices[i - 1]]
+        return None
+
+    def value_at(self, key, date, default=None):
+        """the value key was last set to up to date, or default"""
+        pair = self.pair_at(key, date)
+        return default if pair is None else pair.value
+
+    def values_at(self, key, dates, default=None):
+        """value_at for each of dates"""
+        return [self.value_at(key, date, default) for date in dates]
+
+    def periods(self, dates):
+        """for each of dates, which must be in order, (date, [(change date,
+        pair)] of the changes after the previous date up to it)"""
+        start = 0
+        for date in dates:
+            end = max(start, self.count_until(date))
+            yield date, list(zip(self.dates[start:end],
+                                 self.pairs[start:end]))
+            start = end
@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+
+# usage: treeindex.py term [moddir ...]
+# lists where term occurs as a key or a value in the script files of vanilla
+# ck2 and the given mod dirs, by key path.
+
+import pathlib
+import sqlite3
+import sys
+from ck2parser import Pair, Obj, ContainerMixin, SimpleParser, files
+from localpaths import cachedir
+from print_time import print_time
+
+KEY, VALUE = 0, 1
+
+default_globs = ['common/**/*.txt', 'decisions/*.txt', 'events/*.txt',
+                 'history/**/*.txt', 'map/*.txt']
+
+
+def node_term(node):
+    """the text of a key or value as it is indexed"""
+    val = node.val
+    if isinstance(val, str):
+        return val
+    if isinstance(val, tuple):
+        return '{}.{}.{}'.format(*val)
+    return str(val)
+
+def postings(tree):
+    """the distinct (kind, term, key path) of the keys and values of a tree,
+    where the key path of a key ends in the key itself and that of a value
+    is the one of the pair holding it"""
+    found = set()
+    stack = [(tree.contents, '')]
+    while stack:
+        contents, keypath = stack.pop()
+        for item in contents:
+            if isinstance(item, Pair):
+                key = node_term(item.key)
+                item_path = keypath + '/' + key if keypath else key
+                found.add((KEY, key, item_path))
+                if isinstance(item.value, ContainerMixin):
+                    stack.append((item.value.contents, item_path))
+                else:
+                    found.add((VALUE, node_term(item.value), item_path))
+            elif isinstance(item, Obj):
+                stack.append((item.contents, keypath))
+            else:
+                found.add((VALUE, node_term(item), keypath))
+    return found
+
+
+class TreeIndex:
+    """an inverted index of the keys and values of the files matching globs
+    in a parser's base dir and mod dirs, kept in an sqlite file
+
+    refresh only parses the files which changed since they were last
+    indexed (through the parser, so its disk cache is used). files of other
+    mod dirs or globs may share the database; queries only see the files in
+    the current view, where a mod file hides the vanilla one it overrides."""
+
+    schema = ['''CREATE TABLE IF NOT EXISTS files (
+                     id INTEGER PRIMARY KEY,
+                     path TEXT NOT NULL UNIQUE,
+                     mtime INTEGER NOT NULL,
+                     size INTEGER NOT NULL)''',
+              '''CREATE TABLE IF NOT EXISTS postings (
+                     file INTEGER NOT NULL,
+                     kind INTEGER NOT NULL,
+                     term TEXT NOT NULL,
+                     keypath TEXT NOT NULL)''',
+              'CREATE INDEX IF NOT EXISTS postings_term '
+              'ON postings(term, kind)',
+              'CREATE INDEX IF NOT EXISTS postings_file ON postings(file)']
+
+    def __init__(self, parser, globs=default_globs, path=None):
+        self.parser = parser
+        self.globs = list(globs)
+        if path is None:
+            path = cachedir / 'treeindex.sqlite3'
+        self.path = pathlib.Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(str(self.path), timeout=60,
+                                  isolation_level=None)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        for statement in self.schema:
+            self.db.execute(statement)
+        # file id -> path of the files in the current view
+        self.view = {}
+        self.refresh()
+
+    def close(self):
+        self.db.close()
+
+    def refresh(self):
+        """index the files which were added or changed since the last
+        refresh, and forget those which no longer exist. returns how many
+        files were indexed"""
+        stats = {}
+        for glob in self.globs:
+            for path in files(glob, self.parser.moddirs,
+                              basedir=self.parser.basedir):
+                if path.is_file():
+                    stats[str(path)] = path.stat()
+        known = {path: (file_id, mtime, size) for file_id, path, mtime, size
+                 in self.db.execute('SELECT id, path, mtime, size FROM files')}
+        changed = [pathlib.Path(path) for path, stat in stats.items()
+                   if known.get(path, (None,))[1:] !=
+                   (stat.st_mtime_ns, stat.st_size)]
+        gone = [file_id for path, (file_id, _, _) in known.items()
+                if path not in stats and not pathlib.Path(path).exists()]
+        self.db.execute('BEGIN')
+        try:
+            self.forget(gone)
+            trees = self.parser.parse_paths(changed)
+            for path, (_, tree) in zip(changed, trees):
+                stat = stats[str(path)]
+                row = known.get(str(path))
+                if row is None:
+                    file_id = self.db.execute(
+                        'INSERT INTO files (path, mtime, size) '
+                        'VALUES (?, ?, ?)', (str(path), stat.st_mtime_ns,
+                                             stat.st_size)).lastrowid
+                else:
+                    file_id = row[0]
+                    self.db.execute('DELETE FROM postings WHERE file = ?',
+                                    (file_id,))
+                    self.db.execute('UPDATE files SET mtime = ?, size = ? '
+                                    'WHERE id = ?', (stat.st_mtime_ns,
+                                                     stat.st_size, file_id))
+                self.db.executemany(
+                    'INSERT INTO postings VALUES (?, ?, ?, ?)',
+                    ((file_id,) + posting for posting in postings(tree)))
+            self.db.execute('COMMIT')
+        except:
+            self.db.execute('ROLLBACK')
+            raise
+        self.view = {file_id: pathlib.Path(path) for file_id, path
+                     in self.db.execute('SELECT id, path FROM files')
+                     if path in stats}
+        return len(changed)
+
+    def forget(self, file_ids):
+        for file_id in file_ids:
+            self.db.execute('DELETE FROM postings WHERE file = ?', (file_id,))
+            self.db.execute('DELETE FROM files WHERE id = ?', (file_id,))
+
+    def find(self, term, kind=None):
+        """(path, key path, kind) of each occurrence of term in the view, as
+        a key (KEY) or value (VALUE), or either if kind is None"""
+        if kind is None:
+            cursor = self.db.execute(
+                'SELECT file, keypath, kind FROM postings WHERE term = ?',
+                (term,))
+        else:
+            cursor = self.db.execute(
+                'SELECT file, keypath, kind FROM postings '
+                'WHERE term = ? AND kind = ?', (term, kind))
+        return sorted((self.view[file_id], keypath, kind)
+                      for file_id, keypath, kind in cursor
+                      if file_id in self.view)
+
+    def keys(self, term):
+        """(path, key path) of each pair with term as its key"""
+        return [(path, keypath) for path, keypath, _ in self.find(term, KEY)]
+
+    def values(self, term):
+        """(path, key path) of each occurrence of term as a value"""
+        return [(path, keypath)
+                for path, keypath, _ in self.find(term, VALUE)]
+
+    def files(self, term):
+        """the paths in which term occurs as a key or a value"""
+        return sorted({path for path, _, _ in self.find(term)})
+
+
+@print_time
+def main():
+    if len(sys.argv) < 2:
+        sys.exit('usage: treeindex.py term [moddir ...]')
+    parser = SimpleParser(lean=True)
+    parser.moddirs = [pathlib.Path(arg) for arg in sys.argv[2:]]
+    index = TreeIndex(parser)
+    for path, keypath, kind in index.find(sys.argv[1]):
+        print('{}: {} ({})'.format(path, keypath,
+                                   'key' if kind == KEY else 'value'))
+    index.close()
+
+if __name__ == '__main__':
+    main()
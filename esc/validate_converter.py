@@ -10,7 +10,7 @@ from print_time import print_time
 def main():
     ck2root = localpaths.vanilladir
     eu4root = localpaths.eu4dir
-    parser = SimpleParser()
+    parser = SimpleParser(lean=True)
     # parser.moddirs.append(rootpath / 'SWMH-BETA/SWMH')
     ck2titles = set()
     for _, tree in parser.parse_files('common/landed_titles/*.txt'):
@@ -67,8 +67,7 @@ def process_cultures(parser, build):
             mutated |= update_obj(v)
         if not AUDIT and mutated:
             outpath = make_outpath(build, inpath, vanilladir, *parser.moddirs)
-            with outpath.open('w', encoding='cp1252', newline='\r\n') as f:
-                f.write(tree.str(parser))
+            parser.write(tree, outpath, skip_unchanged=True)
     return cultures, culture_groups
 
 def process_history(parser, build, extra_keys):
@@ -99,8 +98,7 @@ def process_history(parser, build, extra_keys):
             if mutated:
                 outpath = make_outpath(build, inpath, vanilladir,
                                        *parser.moddirs)
-                with outpath.open('w', encoding='cp1252', newline='\r\n') as f:
-                    f.write(tree.str(parser))
+                parser.write(tree, outpath, skip_unchanged=True)
     # if critical_error:
     #     raise SystemExit()
     return id_name, prov_title
@@ -183,8 +181,7 @@ def main():
         outpath = make_outpath(build, inpath, vanilladir, *parser.moddirs)
         update_tree(tree)
         if not AUDIT:
-            with outpath.open('w', encoding='cp1252', newline='\r\n') as f:
-                f.write(tree.str(parser))
+            parser.write(tree, outpath, skip_unchanged=True)
 
     # process history
     id_name, prov_title = process_history(parser, build, extra_keys)